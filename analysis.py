@@ -0,0 +1,145 @@
+"""
+Analysis-only entry point for headless workers.
+
+Importing this module never imports PsychoPy and does not import pandas or NumPy
+either: the analysis functions are resolved from experiment_results, batch_analysis,
+sdt_metrics, rt_analysis, stream_analysis, results_db and analysis_cache on first attribute access, e.g.
+analysis.load_data(path). The command line only pays for the modules its command uses.
+
+- Usage: python analysis.py session <session_dir> [--cache DIR] |
+         batch <root> [--output FILE] [--workers N] [--cache DIR] |
+         sdt <root> [--output FILE] [--n-boot N] [--seed N] [--group] [--cache DIR]
+
+"""
+# Imports #
+import argparse
+import importlib
+import os
+
+LAZY_ATTRIBUTES = {
+    'experiment_results': ('load_data', 'save_npz', 'load_npz', 'export_csv', 'format_df', 'format_df_vectorized',
+                           'explode_df', 'study_mask', 'process_data', 'store_results', 'load_npz_events',
+                           'event_table', 'concat_events', 'event_metrics'),
+    'batch_analysis': ('SessionResult', 'find_sessions', 'phase_file', 'analyse_session', 'cohort_table',
+                       'analyse_tree'),
+    'sdt_metrics': ('norm_ppf', 'corrected_rates', 'sdt_measures', 'response_counts', 'bootstrap_measures',
+                    'group_bootstrap', 'sdt_table'),
+    'rt_analysis': ('rt_table', 'group_quantiles', 'mad_trim', 'fit_exgauss', 'rt_summary'),
+    'stream_analysis': ('read_chunks', 'study_lists', 'stream_aggregates', 'aggregate_metrics', 'stream_results'),
+    'results_db': ('ResultsDB',),
+    'analysis_cache': ('AnalysisCache', 'file_digest', 'session_key'),
+}
+_SOURCES = {name: module for module, names in LAZY_ATTRIBUTES.items() for name in names}
+
+__all__ = sorted(_SOURCES)
+
+
+# Functions #
+def __getattr__(name):
+    """
+        Imports the module defining an analysis function on first access (PEP 562).
+
+        Arguments:
+            name (str): attribute name
+
+        return:
+            value: the function or class of that name
+    """
+    if name not in _SOURCES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(_SOURCES[name]), name)
+    globals()[name] = value
+
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_SOURCES))
+
+
+def session_frames(root, cache_dir=None):
+    """
+        Scores the test phase of every session under root against its study images,
+        keeping one row per response for signal-detection analysis.
+
+        Arguments:
+            root (str): path to the directory experiment data was saved to
+            cache_dir (str): optional directory of an AnalysisCache to read the frames from and store them in
+
+        return:
+            f_df (pandas dataframe): format_df_vectorized output of all sessions with 'Subject ID',
+            'Date' and 'Trial' columns
+    """
+    import pandas as pd
+    from batch_analysis import find_sessions, phase_file
+    from experiment_results import load_data, format_df_vectorized
+    from analysis_cache import AnalysisCache
+
+    cache = AnalysisCache(cache_dir) if cache_dir is not None else None
+    frames = []
+    for session_dir in find_sessions(root):
+        trial_dir, trial = os.path.split(session_dir)
+        subj_dir, dt = os.path.split(trial_dir)
+
+        if cache is not None:
+            f_df, _ = cache.analyse(phase_file(session_dir, 'test_phase'), phase_file(session_dir, 'study_phase'))
+        else:
+            study_df = load_data(phase_file(session_dir, 'study_phase'))
+            test_df = load_data(phase_file(session_dir, 'test_phase'))
+            f_df = format_df_vectorized(test_df, study_df['Image'].dropna().tolist())
+        frames.append(f_df.assign(**{'Subject ID': os.path.basename(subj_dir), 'Date': dt, 'Trial': trial}))
+
+    if cache is not None:
+        cache.close()
+
+    return pd.concat(frames, ignore_index=True)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Analyse stored experiment data without PsychoPy.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    session_parser = commands.add_parser('session', help="score one <subject>/<date>/<trial> directory")
+    session_parser.add_argument('session_dir', help="session directory")
+    session_parser.add_argument('--cache', help="directory of an analysis cache")
+
+    batch_parser = commands.add_parser('batch', help="score every session under a results directory")
+    batch_parser.add_argument('root', help="directory experiment data was saved to")
+    batch_parser.add_argument('--output', help="path of the cohort CSV (default: <root>/cohort_results.csv)")
+    batch_parser.add_argument('--workers', type=int, default=None, help="number of worker processes")
+    batch_parser.add_argument('--cache', help="directory of an analysis cache")
+
+    sdt_parser = commands.add_parser('sdt', help="signal-detection metrics per subject under a results directory")
+    sdt_parser.add_argument('root', help="directory experiment data was saved to")
+    sdt_parser.add_argument('--output', help="path of the metrics CSV (default: <root>/sdt_results.csv)")
+    sdt_parser.add_argument('--n-boot', type=int, default=10000, help="bootstrap resamples, 0 to skip intervals")
+    sdt_parser.add_argument('--seed', type=int, default=None, help="seed for the bootstrap")
+    sdt_parser.add_argument('--group', action='store_true',
+                            help="add a row with the group means and their bootstrap intervals over subjects")
+    sdt_parser.add_argument('--cache', help="directory of an analysis cache")
+    args = parser.parse_args()
+
+    # Module __getattr__ does not apply to global name lookups, so the commands import what they use
+    if args.command == 'session':
+        from batch_analysis import analyse_session
+        result = analyse_session(os.path.abspath(args.session_dir), cache_dir=args.cache)
+        for field, value in result._asdict().items():
+            print(f"{field}: {value}")
+
+    elif args.command == 'batch':
+        from batch_analysis import analyse_tree
+        out = args.output or os.path.join(args.root, 'cohort_results.csv')
+        session_results = analyse_tree(args.root, output=out, workers=args.workers, cache_dir=args.cache)
+        failed = sum(r.error is not None for r in session_results)
+        print(f"Scored {len(session_results) - failed} of {len(session_results)} sessions, cohort table: {out}")
+
+    else:
+        from sdt_metrics import sdt_table
+        out = args.output or os.path.join(args.root, 'sdt_results.csv')
+        table = sdt_table(session_frames(args.root, cache_dir=args.cache), by='Subject ID', n_boot=args.n_boot,
+                          seed=args.seed, group=args.group)
+        table.to_csv(out)
+        print(table.to_string())
+        print(f"Signal-detection metrics saved to: {out}")
@@ -0,0 +1,344 @@
+"""
+Persistent, size-bounded cache of scored sessions.
+
+An entry holds the formatted frame (format_df_vectorized output, as a typed .npz
+archive) and the process_data metrics of one test phase file. It is keyed by a hash
+of the file contents, the study images and SCORING_VERSION, so an edited session, a
+different study list or a change of the scoring code is a miss, while an unchanged
+session is never read or exploded again. File digests are remembered by size and
+modification time, and study lists by the digest of their file, so a hit reads neither
+the session nor its study phase file. Least recently used entries are evicted once
+the stored frames exceed max_bytes.
+
+- Usage: python analysis_cache.py <cache_dir> [--clear]
+
+"""
+# Imports #
+import argparse
+import hashlib
+import json
+import sqlite3
+import time
+from experiment_results import *
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    metrics TEXT NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS studies (
+    digest TEXT PRIMARY KEY,
+    images TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access);
+"""
+
+
+# Functions #
+def file_digest(path):
+    """
+        Hashes the contents of a file.
+
+        Arguments:
+            path (str): absolute path to file
+
+        return:
+            digest (str): hex BLAKE2b digest of the file contents
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+
+    return h.hexdigest()
+
+
+def session_key(digest, img_list):
+    """
+        Builds the cache key of a scored session.
+
+        Arguments:
+            digest (str): content digest of the test phase file
+            img_list (list): study images, None for a continuous-recognition session
+
+        return:
+            key (str): hex BLAKE2b digest of the test file, study image names and SCORING_VERSION
+    """
+    # Scoring only looks at the set of study image names (see study_mask), so neither their
+    # order nor their directory changes the key
+    study = sorted(set(os.path.basename(str(k)) for k in img_list)) if img_list is not None else ['\0continuous']
+
+    h = hashlib.blake2b(digest_size=16)
+    for part in [str(SCORING_VERSION), digest, *study]:
+        h.update(part.encode('utf-8'))
+        h.update(b'\0')
+
+    return h.hexdigest()
+
+
+# Classes #
+class AnalysisCache:
+    """
+        Cache of formatted frames and metrics of scored sessions, stored under one directory
+        with an SQLite index. Safe to share between the worker processes of a batch run.
+
+        Arguments:
+            path (str): absolute path to cache directory, created if it does not exist
+            max_bytes (int): maximum total size of the stored frames before least recently used
+            entries are evicted
+    """
+
+    def __init__(self, path, max_bytes=512 * 1024 ** 2):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(path, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(path, 'index.db'), timeout=30)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+            Closes the index connection.
+        """
+        self.conn.close()
+
+    def digest(self, path):
+        """
+            Content digest of a file, read again only if its size or modification time changed.
+
+            Arguments:
+                path (str): path to file
+
+            return:
+                digest (str): hex BLAKE2b digest of the file contents
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        row = self.conn.execute("SELECT size, mtime_ns, digest FROM files WHERE path = ?", (path,)).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+
+        digest = file_digest(path)
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                              (path, stat.st_size, stat.st_mtime_ns, digest))
+
+        return digest
+
+    def study_images(self, path):
+        """
+            Study images of a study phase file, read again only if the file contents changed.
+
+            Arguments:
+                path (str): path to study phase CSV or .npz file
+
+            return:
+                img_list (list): images of the study phase
+        """
+        digest = self.digest(path)
+        row = self.conn.execute("SELECT images FROM studies WHERE digest = ?", (digest,)).fetchone()
+        if row is not None:
+            return json.loads(row[0])
+
+        img_list = load_data(path)['Image'].dropna().tolist()
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO studies VALUES (?, ?)", (digest, json.dumps(img_list)))
+
+        return img_list
+
+    def key(self, path, img_list):
+        """
+            Cache key of a test phase file scored against a study list.
+
+            Arguments:
+                path (str): path to test phase CSV or .npz file
+                img_list (list or str): study images, or path to the study phase file, see study_images
+
+            return:
+                key (str): cache key, see session_key
+        """
+        if isinstance(img_list, str):
+            img_list = self.study_images(img_list)
+
+        return session_key(self.digest(path), img_list)
+
+    def get(self, key, frame=True):
+        """
+            Looks up a scored session.
+
+            Arguments:
+                key (str): cache key returned by key
+                frame (bool): false to skip reading the formatted frame when only the metrics are needed
+
+            return:
+                entry (tuple): formatted frame (None if not read) and (hit ratio, false alarm ratio,
+                average RT), or None on a miss
+        """
+        f_df = None
+        row = self.conn.execute("SELECT metrics FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is not None and frame:
+            try:
+                f_df = load_npz(self._frame_path(key))
+            except OSError:
+                # Evicted by another process between the index lookup and the read
+                row = None
+
+        if row is None:
+            self._count('misses')
+            return None
+
+        with self.conn:
+            self.conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+        self._count('hits')
+
+        return f_df, tuple(json.loads(row[0]))
+
+    def put(self, key, f_df, metrics):
+        """
+            Stores a scored session and evicts least recently used entries over max_bytes.
+
+            Arguments:
+                key (str): cache key returned by key
+                f_df (pandas dataframe): formatted frame of the session
+                metrics (tuple): hit ratio, false alarm ratio and average RT
+        """
+        frame_path = self._frame_path(key)
+        tmp_path = f"{frame_path}.{os.getpid()}.tmp.npz"
+        save_npz(f_df, tmp_path)
+        os.replace(tmp_path, frame_path)
+
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                              (key, os.path.getsize(frame_path), json.dumps([float(x) for x in metrics]),
+                               time.time()))
+        self.evict()
+
+    def analyse(self, path, img_list, df=None, frame=True):
+        """
+            Formatted frame and metrics of a test phase file, scored only on a cache miss.
+
+            Arguments:
+                path (str): path to test phase CSV or .npz file
+                img_list (list or str): study images, or path to the study phase file, see study_images
+                df (pandas dataframe): contents of path if already loaded
+                frame (bool): false to skip reading the formatted frame on a hit
+
+            return:
+                f_df (pandas dataframe): format_df_vectorized output, None on a hit with frame false
+                metrics (tuple): hit ratio, false alarm ratio and average RT, as process_data
+        """
+        key = self.key(path, img_list)
+        entry = self.get(key, frame=frame)
+        if entry is not None:
+            return entry
+
+        if isinstance(img_list, str):
+            img_list = self.study_images(img_list)
+        if df is None:
+            df = load_data(path)
+
+        f_df = format_df_vectorized(df, img_list)
+        metrics = process_data(f_df)
+        self.put(key, f_df, metrics)
+
+        return f_df, metrics
+
+    def evict(self, max_bytes=None):
+        """
+            Removes least recently used entries until the stored frames fit in max_bytes.
+
+            Arguments:
+                max_bytes (int): size limit, defaults to the limit of the cache
+
+            return:
+                evicted (int): number of entries removed
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= max_bytes:
+            return 0
+
+        evicted = []
+        for key, size in self.conn.execute("SELECT key, size FROM entries ORDER BY last_access"):
+            if total <= max_bytes:
+                break
+            evicted.append(key)
+            total -= size
+
+        with self.conn:
+            self.conn.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key in evicted])
+        for key in evicted:
+            try:
+                os.remove(self._frame_path(key))
+            except FileNotFoundError:
+                pass
+
+        return len(evicted)
+
+    def clear(self):
+        """
+            Removes every entry and resets the hit and miss counters.
+        """
+        self.evict(max_bytes=-1)
+        with self.conn:
+            self.conn.execute("DELETE FROM counters")
+        self.hits = self.misses = 0
+
+    def stats(self):
+        """
+            Size of the cache and hit and miss counts.
+
+            return:
+                stats (dict): 'entries', 'bytes' and 'max_bytes', 'hits' and 'misses' of this
+                instance, and 'total_hits' and 'total_misses' of every process since the last clear
+        """
+        entries, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        totals = dict(self.conn.execute("SELECT name, value FROM counters"))
+
+        return {'entries': entries, 'bytes': size, 'max_bytes': self.max_bytes, 'hits': self.hits,
+                'misses': self.misses, 'total_hits': totals.get('hits', 0), 'total_misses': totals.get('misses', 0)}
+
+    def _frame_path(self, key):
+        return os.path.join(self.path, key + '.npz')
+
+    def _count(self, name):
+        setattr(self, name, getattr(self, name) + 1)
+        with self.conn:
+            self.conn.execute("INSERT INTO counters VALUES (?, 1) ON CONFLICT (name) DO UPDATE SET value = value + 1",
+                              (name,))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Show or clear a session analysis cache.")
+    parser.add_argument('cache_dir', help="cache directory")
+    parser.add_argument('--clear', action='store_true', help="remove every entry")
+    args = parser.parse_args()
+
+    with AnalysisCache(args.cache_dir) as cache:
+        if args.clear:
+            cache.clear()
+        for name, value in cache.stats().items():
+            print(f"{name}: {value}")
@@ -0,0 +1,165 @@
+"""
+Non-interactive batch analysis of every session stored under a results directory.
+
+Sessions are discovered from the directory layout written by create_directory
+(<root>/<subject>/<date>/<trial>/test_phase.csv or .npz), scored in a process pool and
+collected into one cohort table of hit rate, false alarm rate and average reaction time.
+With a cache directory, sessions scored by an earlier run are read from the cache, so
+re-running a cohort after adding sessions only scores the new ones.
+
+- Usage: python batch_analysis.py <root> [--output cohort.csv] [--workers N] [--cache DIR]
+
+"""
+# Imports #
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from analysis_cache import AnalysisCache
+from experiment_results import *
+
+SessionResult = namedtuple('SessionResult',
+                           ['subject', 'date', 'trial', 'hit_rate', 'false_alarm_rate', 'avg_rt', 'path', 'error'])
+
+COHORT_COLUMNS = {'subject': 'Subject ID', 'date': 'Date', 'trial': 'Trial', 'hit_rate': 'Hit Ratio',
+                  'false_alarm_rate': 'False Alarm Ratio', 'avg_rt': 'Average RT (sec)', 'path': 'Path',
+                  'error': 'Error'}
+
+
+# Functions #
+def find_sessions(root):
+    """
+        Finds every session directory containing test phase data under root.
+
+        Arguments:
+            root (str): path to the directory experiment data was saved to
+
+        return:
+            sessions (list): sorted absolute paths of <subject>/<date>/<trial> directories
+    """
+    root = os.path.abspath(root)
+    sessions = []
+
+    for dir_path, dir_names, file_names in os.walk(root):
+        depth = len(os.path.relpath(dir_path, root).split(os.sep))
+        if depth == 3 and ('test_phase.csv' in file_names or 'test_phase.npz' in file_names):
+            sessions.append(dir_path)
+        if depth >= 3:
+            dir_names[:] = []
+
+    return sorted(sessions)
+
+
+def phase_file(session_dir, name):
+    """
+        Picks the stored file of a phase, preferring the typed .npz archive over CSV.
+
+        Arguments:
+            session_dir (str): path of a <subject>/<date>/<trial> directory
+            name (str): name of phase file without extension
+
+        return:
+            path (str): path of the .npz file if present, else of the CSV file
+    """
+    npz_path = os.path.join(session_dir, name + '.npz')
+    if os.path.exists(npz_path):
+        return npz_path
+
+    return os.path.join(session_dir, name + '.csv')
+
+
+def analyse_session(session_dir, cache_dir=None):
+    """
+        Loads and scores the test phase of one session against its study phase images.
+
+        Arguments:
+            session_dir (str): path of a <subject>/<date>/<trial> directory
+            cache_dir (str): optional directory of an AnalysisCache to read the scores from and store them in
+
+        return:
+            result (SessionResult): scores of the session, or the error that prevented scoring
+    """
+    trial_dir, trial = os.path.split(session_dir)
+    subj_dir, dt = os.path.split(trial_dir)
+    subj = os.path.basename(subj_dir)
+
+    try:
+        if cache_dir is not None:
+            with AnalysisCache(cache_dir) as cache:
+                _, (hit_ratio, false_alarm_ratio, rt_avg) = cache.analyse(phase_file(session_dir, 'test_phase'),
+                                                                          phase_file(session_dir, 'study_phase'),
+                                                                          frame=False)
+        else:
+            study_df = load_data(phase_file(session_dir, 'study_phase'))
+            test_df = load_data(phase_file(session_dir, 'test_phase'))
+
+            f_df = format_df_vectorized(test_df, study_df['Image'].dropna().tolist())
+            hit_ratio, false_alarm_ratio, rt_avg = process_data(f_df)
+    except Exception as ex:
+        return SessionResult(subj, dt, trial, None, None, None, session_dir, repr(ex))
+
+    return SessionResult(subj, dt, trial, float(hit_ratio), float(false_alarm_ratio), float(rt_avg),
+                         session_dir, None)
+
+
+def cohort_table(results):
+    """
+        Collects session results into one cohort dataframe.
+
+        Arguments:
+            results (list): SessionResult objects
+
+        return:
+            df (pandas dataframe): one row per subject, date and trial
+    """
+    df = pd.DataFrame(results, columns=SessionResult._fields)
+
+    return df.rename(columns=COHORT_COLUMNS)
+
+
+def analyse_tree(root, output=None, workers=None, cache_dir=None):
+    """
+        Scores every session under root in a process pool.
+
+        Arguments:
+            root (str): path to the directory experiment data was saved to
+            output (str): optional path of the cohort CSV to write
+            workers (int): number of worker processes, defaults to the number of CPUs
+            cache_dir (str): optional directory of an AnalysisCache shared by the workers
+
+        return:
+            results (list): SessionResult objects in session path order
+    """
+    sessions = find_sessions(root)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(partial(analyse_session, cache_dir=cache_dir), sessions,
+                                chunksize=max(1, len(sessions) // 64)))
+
+    if output is not None:
+        cohort_table(results).to_csv(output, index=False)
+
+    return results
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Score every session saved under a results directory.")
+    parser.add_argument('root', help="directory experiment data was saved to")
+    parser.add_argument('--output', help="path of the cohort CSV (default: <root>/cohort_results.csv)")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes")
+    parser.add_argument('--cache', help="directory of an analysis cache to reuse scored sessions from")
+    args = parser.parse_args()
+
+    out = args.output or os.path.join(args.root, 'cohort_results.csv')
+    session_results = analyse_tree(args.root, output=out, workers=args.workers, cache_dir=args.cache)
+
+    failed = [r for r in session_results if r.error is not None]
+    print(f"Scored {len(session_results) - len(failed)} of {len(session_results)} sessions, cohort table: {out}")
+    for r in failed:
+        print(f"{r.path}: {r.error}")
+    if args.cache:
+        with AnalysisCache(args.cache) as cache:
+            stats = cache.stats()
+        print(f"Analysis cache: {stats['entries']} sessions, {stats['bytes']} bytes, "
+              f"{stats['total_hits']} hits and {stats['total_misses']} misses in total")
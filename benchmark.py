@@ -0,0 +1,333 @@
+"""
+Benchmark suite for the data and analysis hot paths.
+
+Each benchmark builds synthetic data at a given scale (number of trials / response
+rows), then times only the operation under test. Results are printed and can be
+written as JSON to compare runs and catch regressions.
+
+A startup benchmark times importing the entry points in fresh interpreters and
+records whether each one pulled in PsychoPy.
+
+- Usage: python benchmark.py [--scales 1 100 10000 1000000] [--repeat 3] [--only NAME ...] [--startup] [--output FILE]
+
+"""
+# Imports #
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from headless import HeadlessBackend
+
+# The benchmarks never open a window, so the psychopy modules are always the headless stand-ins
+HeadlessBackend().install()
+
+from experiment_backend import *
+
+BENCHMARKS = {}
+DEFAULT_SCALES = [100, 1000, 10000, 100000, 1000000]
+STARTUP_IMPORTS = {'analysis': "import analysis",
+                   'analysis_load_data': "import analysis; analysis.load_data",
+                   'experiment_results': "import experiment_results",
+                   'batch_analysis': "import batch_analysis",
+                   'experiment_backend': "import experiment_backend",
+                   'ui_main': "import ui_main"}
+
+
+# Functions #
+def benchmark(name, limit=None):
+    """
+        Registers a benchmark. The decorated function receives the scale and a scratch
+        directory, prepares its inputs and returns the zero-argument callable to time.
+
+        Arguments:
+            name (str): name of the benchmark
+            limit (int): largest scale the benchmark is run at unless limits are disabled
+
+        return:
+            decorator (function): registers the benchmark setup function
+    """
+    def register(setup):
+        BENCHMARKS[name] = (setup, limit)
+        return setup
+
+    return register
+
+
+def synthetic_session(rows, subj=1, pool=2400, seed=0):
+    """
+        Builds a test phase dataframe as written by test_phase, with one response per trial.
+        Even trials show study images and odd trials show lures, as in a real test list.
+
+        Arguments:
+            rows (int): number of trials (response rows)
+            subj (int): subject number or id
+            pool (int): number of distinct images
+            seed (int): value for seeding the synthetic data
+
+        return:
+            df (pandas dataframe): test phase data
+            study (list): image paths of the study set
+    """
+    rng = np.random.default_rng(seed)
+    names = np.array([f"{i + 1}.jpg" for i in range(pool)], dtype=object)
+    study = ['/dataset/' + name for name in names[:pool // 2]]
+
+    responses = np.where(rng.random(rows) < 0.5, 'old', 'new')
+    valid = np.where((rng.random(rows) < 0.95) | (np.arange(rows) < 2), 'Yes', 'No')
+    rts = rng.gamma(4.0, 0.15, rows)
+
+    df = create_df(rows, subj, test=True)
+    half = pool // 2
+    df['Image'] = names[rng.integers(0, half, rows) + np.where(np.arange(rows) % 2 == 0, 0, half)]
+    df['Reaction Time'] = [[x] for x in rts.tolist()]
+    df['Responses'] = [[x] for x in responses.tolist()]
+    df['Valid Response'] = [[x] for x in valid.tolist()]
+    df['Number of Responses'] = 1
+
+    return df, study
+
+
+@benchmark('generate_datasets')
+def bench_generate_datasets(scale, tmp_dir):
+    imgs = [f"/dataset/{i + 1}.jpg" for i in range(max(2, scale))]
+    num = max(1, scale // 2)
+
+    return lambda: generate_datasets(1, num, imgs)
+
+
+@benchmark('add_data', limit=10000)
+def bench_add_data(scale, tmp_dir):
+    dataset = os.path.join(tmp_dir, 'dataset')
+    os.makedirs(dataset)
+    for i in range(scale):
+        open(os.path.join(dataset, f"{i + 1}.jpg"), 'w').close()
+
+    return lambda: add_data(dataset)
+
+
+@benchmark('create_df_fill', limit=10000)
+def bench_create_df_fill(scale, tmp_dir):
+    resp, rt, valid = ['old'], [0.5], ['Yes']
+
+    def fill():
+        df = create_df(scale, 1, test=True)
+        # The chained assignments of the old fill warn once per cell, which would dominate the timing
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            for run in range(scale):
+                df['Image'].loc[run] = '1.jpg'
+                df['Responses'].loc[run] = resp
+                df['Reaction Time'].loc[run] = rt
+                df['Valid Response'].loc[run] = valid
+                df['Number of Responses'].loc[run] = len(resp)
+
+    return fill
+
+
+@benchmark('trial_buffer_fill')
+def bench_trial_buffer_fill(scale, tmp_dir):
+    resp, rt, valid = ['old'], [0.5], ['Yes']
+
+    def fill():
+        records = TrialBuffer(scale, 1, test=True)
+        for run in range(scale):
+            records.record_test(run, '1.jpg', resp, rt, valid)
+        return records.to_df()
+
+    return fill
+
+
+@benchmark('create_directory_csv')
+def bench_create_directory_csv(scale, tmp_dir):
+    df, study = synthetic_session(scale)
+    # Creates the directory up front, so the timed runs only write the CSV and never print
+    with contextlib.redirect_stdout(io.StringIO()):
+        create_directory("test_phase", tmp_dir, 1, 0)
+
+    return lambda: create_directory("test_phase", tmp_dir, 1, 0, df=df)
+
+
+@benchmark('load_data')
+def bench_load_data(scale, tmp_dir):
+    df, study = synthetic_session(scale)
+    path = os.path.join(tmp_dir, 'test_phase.csv')
+    df.to_csv(path)
+
+    return lambda: load_data(path)
+
+
+@benchmark('load_data_npz')
+def bench_load_data_npz(scale, tmp_dir):
+    df, study = synthetic_session(scale)
+    path = save_npz(df, os.path.join(tmp_dir, 'test_phase.npz'))
+
+    return lambda: load_data(path)
+
+
+@benchmark('format_df', limit=10000)
+def bench_format_df(scale, tmp_dir):
+    df, study = synthetic_session(scale)
+
+    return lambda: format_df(df, study)
+
+
+@benchmark('format_df_vectorized')
+def bench_format_df_vectorized(scale, tmp_dir):
+    df, study = synthetic_session(scale)
+
+    return lambda: format_df_vectorized(df, study)
+
+
+@benchmark('event_table')
+def bench_event_table(scale, tmp_dir):
+    df, study = synthetic_session(scale)
+
+    return lambda: event_table(df, study)
+
+
+@benchmark('load_data_npz_events')
+def bench_load_data_npz_events(scale, tmp_dir):
+    df, study = synthetic_session(scale)
+    path = save_npz(df, os.path.join(tmp_dir, 'test_phase.npz'))
+
+    return lambda: load_data(path, events=True, img_list=study)
+
+
+@benchmark('process_data')
+def bench_process_data(scale, tmp_dir):
+    # Rates need at least one old and one new image
+    df, study = synthetic_session(max(scale, 2))
+    f_df = format_df_vectorized(df, study)
+
+    return lambda: process_data(f_df)
+
+
+def run_benchmarks(scales=None, repeat=3, only=None, limits=True):
+    """
+        Runs the registered benchmarks at every scale.
+
+        Arguments:
+            scales (list): scales (number of trials / response rows) to run at
+            repeat (int): number of timed runs per benchmark and scale
+            only (list): names of the benchmarks to run, defaults to all
+            limits (bool): false to also run slow benchmarks beyond their scale limit
+
+        return:
+            results (list): one dict per benchmark and scale with the timings in seconds
+    """
+    results = []
+
+    for name, (setup, limit) in BENCHMARKS.items():
+        if only and name not in only:
+            continue
+        for scale in scales or DEFAULT_SCALES:
+            if limits and limit is not None and scale > limit:
+                continue
+
+            tmp_dir = tempfile.mkdtemp(prefix='wm_bench_')
+            try:
+                with contextlib.redirect_stdout(sys.stderr):
+                    func = setup(scale, tmp_dir)
+                    times = []
+                    for i in range(repeat):
+                        t0 = time.perf_counter()
+                        func()
+                        times.append(time.perf_counter() - t0)
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+            results.append({'benchmark': name, 'scale': scale, 'repeat': repeat, 'times': times,
+                            'min': min(times), 'median': statistics.median(times)})
+            print(f"{name:<24} {scale:>9} rows  min {min(times):10.6f} s  median {statistics.median(times):10.6f} s",
+                  file=sys.stderr)
+
+    return results
+
+
+def startup_times(repeat=5, only=None):
+    """
+        Times importing each entry point in a fresh interpreter, net of the interpreter's
+        own startup time.
+
+        Arguments:
+            repeat (int): number of timed interpreter launches per entry point
+            only (list): names of the entry points to time, defaults to all
+
+        return:
+            results (list): one dict per entry point with the timings in seconds, whether
+            psychopy was imported and the import error if there was one
+    """
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    check = "; import sys; print('psychopy' in sys.modules)"
+
+    def launch(code):
+        t0 = time.perf_counter()
+        proc = subprocess.run([sys.executable, '-c', code], cwd=repo_dir, capture_output=True, text=True)
+        return time.perf_counter() - t0, proc
+
+    baseline = min(launch("pass")[0] for i in range(repeat))
+    results = []
+
+    for name, code in STARTUP_IMPORTS.items():
+        if only and name not in only:
+            continue
+
+        runs = [launch(code + check) for i in range(repeat)]
+        times = [t - baseline for t, proc in runs]
+        proc = runs[-1][1]
+        error = proc.stderr.strip().splitlines()[-1] if proc.returncode else None
+
+        results.append({'import': name, 'repeat': repeat, 'times': times, 'min': min(times),
+                        'median': statistics.median(times), 'psychopy': proc.stdout.strip() == 'True',
+                        'error': error})
+        status = error or ('imports psychopy' if results[-1]['psychopy'] else 'no psychopy')
+        print(f"{name:<24} min {min(times):10.6f} s  median {statistics.median(times):10.6f} s  {status}",
+              file=sys.stderr)
+
+    return results
+
+
+def environment():
+    """
+        Describes the machine and library versions the benchmarks ran on.
+
+        return:
+            env (dict): platform, Python, NumPy and pandas versions, CPU count and date
+    """
+    return {'platform': platform.platform(), 'python': platform.python_version(), 'numpy': np.__version__,
+            'pandas': pd.__version__, 'cpus': os.cpu_count(), 'date': str(datetime.now())}
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Benchmark the data and analysis hot paths.")
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES, help="numbers of response rows")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per benchmark and scale")
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help="benchmarks to run")
+    parser.add_argument('--no-limits', action='store_true', help="run slow benchmarks at every scale")
+    parser.add_argument('--startup', action='store_true', help="also time importing the entry points")
+    parser.add_argument('--output', help="path of the JSON results file")
+    args = parser.parse_args()
+
+    report = {'environment': environment(),
+              'results': run_benchmarks(args.scales, args.repeat, args.only, limits=not args.no_limits)}
+    if args.startup:
+        report['startup'] = startup_times(max(args.repeat, 5))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
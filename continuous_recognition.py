@@ -0,0 +1,196 @@
+"""
+Continuous-recognition mode: one long stream of test trials instead of a study list
+followed by a test list. Every image is first shown as new and, with probability
+p_repeat, comes back once as old after a lag (in trials) drawn from a configurable
+distribution.
+
+The schedule is a generator, so only the repeats still due (at most max(lags) of them)
+are held in memory, and trial records are appended to the CSV as they complete. A
+session of 10,000 trials therefore needs the same memory and setup time as one of 100.
+A journalled session that is interrupted resumes after its last durable trial, since
+the schedule is deterministic for a given seed and subject.
+
+"""
+# Imports #
+import csv
+import numpy as np
+from collections import namedtuple
+from datetime import datetime
+from stimulus_sampling import subject_rng, index_dtype
+
+Presentation = namedtuple('Presentation', ['position', 'image', 'old', 'lag'])
+
+CONTINUOUS_COLUMNS = ['Subject ID', 'Date', 'Position', 'Image', 'Old', 'Lag', 'Reaction Time', 'Responses',
+                      'Number of Responses', 'Valid Response']
+DEFAULT_LAGS = (1, 2, 4, 8, 16, 32, 64)
+
+
+# Functions #
+def continuous_schedule(seed, size, n_trials=None, subj=0, p_repeat=0.5, lags=DEFAULT_LAGS, weights=None,
+                        block=1024):
+    """
+        Lazily generates the trials of a continuous-recognition session. New images are
+        drawn without replacement from the subject's own random stream. A repeat is dropped
+        if its position is already taken by another repeat or lies past the end of the session.
+
+        Arguments:
+            seed (int): value for seeding to generate random images
+            size (int): number of images in overall dataset
+            n_trials (int): length of the session, None for an endless stream
+            subj (int): subject number or id
+            p_repeat (float): probability that a new image comes back as old
+            lags (list): possible lags in trials between the new and the old presentation, at least 1
+            weights (list): relative probability of each lag, uniform by default
+            block (int): number of random draws made at once
+
+        return:
+            schedule (iterator): Presentation tuples of position, image index into the dataset,
+            whether the image is old and its lag (None for new images)
+    """
+    lags = np.asarray(lags, dtype=np.int64)
+    if lags.size == 0 or lags.min() < 1:
+        raise ValueError("Lags must be at least one trial")
+    weights = np.ones(len(lags)) if weights is None else np.asarray(weights, dtype=float)
+    weights = weights / weights.sum()
+
+    rng = subject_rng(seed, subj)
+    order = rng.permutation(size).astype(index_dtype(size))
+
+    due = {}
+    fresh = 0
+    draw = block
+    position = 0
+
+    while n_trials is None or position < n_trials:
+        if position in due:
+            image, lag = due.pop(position)
+            yield Presentation(position, image, True, lag)
+            position += 1
+            continue
+
+        if fresh == size:
+            raise ValueError(f"Dataset of {size} images has no new images left at trial {position}")
+        image = int(order[fresh])
+        fresh += 1
+
+        if draw == block:
+            repeats = rng.random(block) < p_repeat
+            drawn_lags = rng.choice(lags, block, p=weights)
+            draw = 0
+        if repeats[draw]:
+            lag = int(drawn_lags[draw])
+            target = position + lag
+            if target not in due and (n_trials is None or target < n_trials):
+                due[target] = (image, lag)
+        draw += 1
+
+        yield Presentation(position, image, False, None)
+        position += 1
+
+
+def new_images_needed(seed, size, n_trials, subj=0, p_repeat=0.5, lags=DEFAULT_LAGS, weights=None):
+    """
+        Checks that the dataset has enough new images for a session before it starts. The
+        schedule is only run until the trials left could not exhaust the dataset even if
+        all of them were new, so the check costs nothing when the dataset has at least
+        n_trials images and grows with the shortfall otherwise, not with the session.
+
+        Arguments:
+            seed (int): value for seeding to generate random images
+            size (int): number of images in overall dataset
+            n_trials (int): length of the session
+            subj (int): subject number or id
+            p_repeat (float): probability that a new image comes back as old
+            lags (list): possible lags in trials between the new and the old presentation
+            weights (list): relative probability of each lag
+
+        return:
+            needed (int): upper bound on the number of new images the session shows; the
+            schedule raises ValueError if the dataset runs out
+    """
+    if n_trials <= size:
+        return n_trials
+
+    fresh = 0
+    for presentation in continuous_schedule(seed, size, n_trials, subj, p_repeat, lags, weights):
+        fresh += not presentation.old
+        # Every trial left needs at most one new image
+        needed = fresh + n_trials - presentation.position - 1
+        if needed <= size:
+            return needed
+
+    return fresh
+
+
+# Classes #
+class ContinuousRecorder:
+    """
+        Appends the records of a continuous-recognition session to a CSV file as each trial
+        completes, in the layout of create_df plus 'Position', 'Old' and 'Lag', so load_data
+        reads it back and format_df_vectorized scores it without a study list. A resumed
+        session first writes the records restored from its journal.
+
+        Arguments:
+            path (str): absolute path to CSV file
+            subj (int): subject number or id
+            restored (list): records of the trials already completed, as returned by record
+    """
+
+    def __init__(self, path, subj, restored=()):
+        self.path = path
+        self.subj = subj
+        self.date = str(datetime.now())
+        self.count = 0
+
+        self._file = open(path, 'w', newline='', encoding='iso-8859-1')
+        self._csv = csv.writer(self._file)
+        self._csv.writerow([''] + CONTINUOUS_COLUMNS)
+        for data in restored:
+            self._write(data.get('Date', self.date), data['Position'], data['Image'], data['Old'], data['Lag'],
+                        data['Reaction Time'], data['Responses'], data['Number of Responses'],
+                        data['Valid Response'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record(self, presentation, image, responses, rt, valid):
+        """
+            Writes the record of a trial.
+
+            Arguments:
+                presentation (Presentation): scheduled trial
+                image (str): name of the image presented
+                responses (list): keyboard responses
+                rt (list): reaction times
+                valid (list): list indicating if key(s) is/are valid
+
+            return:
+                data (dict): column values of the trial, as stored in a trial journal
+        """
+        num_responses = 0 if "None" in responses else len(responses)
+        self._write(self.date, presentation.position, image, presentation.old, presentation.lag, rt, responses,
+                    num_responses, valid)
+
+        return {'Date': self.date, 'Image': image, 'Position': presentation.position, 'Old': presentation.old,
+                'Lag': presentation.lag, 'Responses': responses, 'Reaction Time': rt, 'Valid Response': valid,
+                'Number of Responses': num_responses}
+
+    def _write(self, date, position, image, old, lag, rt, responses, num_responses, valid):
+        # Lists are written as their repr, like DataFrame.to_csv, so load_data's converters apply
+        self._csv.writerow([self.count, self.subj, date, position, image, old, '' if lag is None else lag, rt,
+                            responses, num_responses, valid])
+        self.count += 1
+
+    def close(self):
+        """
+            Closes the CSV file.
+
+            return:
+                path (str): absolute path to CSV file
+        """
+        self._file.close()
+
+        return self.path
@@ -0,0 +1,172 @@
+# Imports #
+import hashlib
+import io
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+MANIFEST_NAME = '.manifest.json'
+MANIFEST_VERSION = 1
+# File extensions of the stimulus pool, matched in any case
+DATASET_EXTENSIONS = ('.jpg',)
+
+
+# Functions #
+def list_images(root, recursive=True, extensions=DATASET_EXTENSIONS):
+    """
+        Lists image files of the dataset.
+
+        Arguments:
+            root (str): absolute path to target folder of dataset
+            recursive (bool): true to include images in nested directories
+            extensions (list): lower-case file extensions of the images, matched in any case
+
+        return:
+            paths (list): sorted image paths relative to root
+    """
+    paths = []
+
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names.sort()
+        for name in file_names:
+            if name.lower().endswith(tuple(extensions)):
+                paths.append(os.path.relpath(os.path.join(dir_path, name), root))
+        if not recursive:
+            break
+
+    return sorted(paths)
+
+
+def scan_image(root, rel_path, previous=None):
+    """
+        Records file size, modification time, pixel dimensions, content hash and whether
+        the image decodes cleanly. An unchanged file (same size and mtime as its previous
+        entry) is not read again.
+
+        Arguments:
+            root (str): absolute path to target folder of dataset
+            rel_path (str): image path relative to root
+            previous (dict): manifest entry of the image from an earlier scan
+
+        return:
+            entry (dict): manifest entry of the image, None if the file was removed since it was listed
+    """
+    try:
+        stat = os.stat(os.path.join(root, rel_path))
+        if previous is not None and previous['size'] == stat.st_size and previous['mtime'] == stat.st_mtime:
+            return previous
+
+        with open(os.path.join(root, rel_path), 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+
+    entry = {'path': rel_path, 'size': stat.st_size, 'mtime': stat.st_mtime, 'width': None, 'height': None,
+             'hash': hashlib.blake2b(data, digest_size=16).hexdigest(), 'valid': True, 'error': None}
+
+    try:
+        im = Image.open(io.BytesIO(data))
+        im.load()
+        entry['width'], entry['height'] = im.size
+    except Exception as ex:
+        entry['valid'] = False
+        entry['error'] = repr(ex)
+
+    return entry
+
+
+def load_manifest(manifest_path, recursive=None):
+    """
+        Reads a stored manifest.
+
+        Arguments:
+            manifest_path (str): path to manifest file
+            recursive (bool): listing the manifest must have been built with, None to accept either
+
+        return:
+            entries (dict): manifest entries keyed by relative image path, empty if missing, outdated or
+            built with another listing
+    """
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    if recursive is not None and manifest.get('recursive') != recursive:
+        return {}
+
+    return {entry['path']: entry for entry in manifest['images']}
+
+
+def build_manifest(root, recursive=True, workers=16, manifest_path=None, extensions=DATASET_EXTENSIONS):
+    """
+        Builds or incrementally updates the manifest of the stimulus pool and stores it
+        next to the dataset. Images are scanned on a thread pool; only new or modified
+        files are read.
+
+        Arguments:
+            root (str): absolute path to target folder of dataset
+            recursive (bool): true to include images in nested directories
+            workers (int): number of scanning threads
+            manifest_path (str): path to manifest file, defaults to root/.manifest.json
+            extensions (list): lower-case file extensions of the images, see list_images
+
+        return:
+            entries (list): manifest entries sorted by relative image path
+    """
+    if manifest_path is None:
+        manifest_path = os.path.join(root, MANIFEST_NAME)
+
+    previous = load_manifest(manifest_path, recursive=recursive)
+    paths = list_images(root, recursive=recursive, extensions=extensions)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        entries = [entry for entry in pool.map(lambda p: scan_image(root, p, previous.get(p)), paths)
+                   if entry is not None]
+
+    # A read-only dataset still gets a manifest for this launch, it just cannot be reused
+    try:
+        _write_manifest(manifest_path, {'version': MANIFEST_VERSION, 'recursive': recursive, 'images': entries})
+    except OSError:
+        pass
+
+    return entries
+
+
+def valid_images(root, recursive=True, workers=16, manifest_path=None, extensions=DATASET_EXTENSIONS):
+    """
+        Returns the absolute paths of every image in the manifest that decodes cleanly.
+
+        Arguments:
+            root (str): absolute path to target folder of dataset
+            recursive (bool): true to include images in nested directories
+            workers (int): number of scanning threads
+            manifest_path (str): path to manifest file, defaults to root/.manifest.json
+            extensions (list): lower-case file extensions of the images, see list_images
+
+        return:
+            img_paths (list): absolute image paths
+    """
+    entries = build_manifest(root, recursive=recursive, workers=workers, manifest_path=manifest_path,
+                             extensions=extensions)
+
+    return [os.path.join(root, entry['path']) for entry in entries if entry['valid']]
+
+
+def _write_manifest(manifest_path, manifest):
+    # Written to a temporary file of its own and replaced atomically, so stations scanning the same
+    # dataset at once never write into each other's file or read a half-written manifest
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(manifest_path) or '.',
+                                    prefix=os.path.basename(manifest_path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, manifest_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
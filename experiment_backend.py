@@ -1,15 +1,28 @@
 # Imports #
 import numpy as np
-import numpy.random as R
-import glob
 import platform
 import sys
+from collections import deque
+from itertools import islice
 from experiment_results import *
+from stimulus_cache import StimulusCache
+from stimulus_sampling import subject_lists
+from dataset_manifest import DATASET_EXTENSIONS, list_images, valid_images
+from texture_store import open_store
+from response_collection import ResponseCollector
+from frame_timing import FrameTimer
+from frame_scheduler import FrameScheduler
+from profiler import Profiler
+from results_db import ResultsDB
+from text_pool import TextPool
+from trial_writer import TrialWriter, load_journal, resume_journal, retire_journal, completed_runs
+from trial_buffer import TrialBuffer
+from analysis_cache import AnalysisCache
+from ingest_service import IngestClient
+from continuous_recognition import DEFAULT_LAGS, continuous_schedule, new_images_needed, ContinuousRecorder
 from datetime import datetime, date
 from psychopy import visual, event, core, gui, logging
 
-pd.options.mode.chained_assignment = None
-
 
 class color:
     PURPLE = '\033[95m'
@@ -54,103 +67,127 @@ def experiment_info():
     return subj, num, time
 
 
-def add_data(path):
+def add_data(path, recursive=False, manifest=False):
     """
         Reads image data paths to store into a data structure.
 
         Arguments:
             path (str): absolute path to target folder of dataset
+            recursive (bool): true to include images in nested directories
+            manifest (bool): true to read paths from the dataset manifest, which skips
+            images that do not decode cleanly and only rescans new or modified files; either
+            way the pool is the .jpg images of DATASET_EXTENSIONS
         return:
             img_paths (list): a list containing the absolute path for each image in the
             dataset
     """
-    # Account for if user has Windows OS
-    if platform.system() == "Windows":
-        sep = '\\'
-    else:
-        sep = '/'
+    if manifest:
+        return valid_images(path, recursive=recursive, extensions=DATASET_EXTENSIONS)
 
-    img_paths = [os.path.join(path, img) for img in glob.glob(path + sep + '*.jpg')]
+    # Listed like the manifest does, so both give the same pool in the same order
+    img_paths = [os.path.join(path, img) for img in list_images(path, recursive=recursive,
+                                                                extensions=DATASET_EXTENSIONS)]
 
     return img_paths
 
 
-def generate_datasets(seed, num, imgs):
+def generate_datasets(seed, num, imgs, subj=0):
     """
         Creates datasets for the study phase and test phase from random images.
+        Images are drawn without replacement from the subject's own random stream,
+        so the study list has no duplicates and never overlaps the lures.
 
         Arguments:
             seed (int): value for seeding to generate random images
             num (int): length of study list (number of images)
             imgs (list): data structure containing paths of all images in overall dataset
+            subj (int): subject number or id
 
         return:
             study_set (list): a list containing the absolute path for each image in the study dataset
             test_set (list): a list containing the absolute path for each image in the test dataset
     """
-    size = len(imgs)
-    study_set = []
-    tmp = []
-
-    R.seed(seed)
-
-    for i in range(num):
-        study_set.append(imgs[R.randint(0, size)])
+    study_idx, test_idx = subject_lists(seed, num, len(imgs), subj)
 
-    j = 0
-    while j < num:
-        img = imgs[R.randint(0, size)]
-        if img not in study_set:
-            tmp.append(img)
-            j += 1
-
-    test_set = [y for x in [study_set, tmp] for y in x]
-
-    R.shuffle(test_set)
+    study_set = [imgs[i] for i in study_idx]
+    test_set = [imgs[i] for i in test_idx]
 
     return study_set, test_set
 
 
-def image_stim(win, img):
+def image_stim(win, img, cache=None, store=None):
     """
         Creates an image to present to the monitor.
 
         Arguments:
             win: psychopy window object
             img (str): path of image
+            cache (StimulusCache): optional cache of preloaded/prefetched stimuli
+            store (TextureStore): optional store of pre-resized pixels, used instead of the JPEG
 
         return:
             im: psychopy visual image object
     """
+    if cache is not None:
+        return cache.get(img)
+
+    if store is not None and img in store:
+        return visual.ImageStim(win, store.image(img), pos=[0, 0], size=0.3, name=str(os.path.basename(img)))
 
     im = visual.ImageStim(win, img, pos=[0, 0], size=0.3, name=str(os.path.basename(img)))
 
     return im
 
 
-def pause(win, time):
+def pause(win, time, scheduler=None):
     """
         Pauses experiment on a given image for a specified amount of time.
 
         Arguments:
             win: psychopy window object
             time (float): time in seconds to present image
+            scheduler (FrameScheduler): optional frame-locked scheduler, the pause is then counted in frames
 
         return:
             None: image is presented on window for provided duration
     """
+    if scheduler is not None:
+        scheduler.hold(win.flip, time)
+        return
 
     win.flip()
     core.wait(time)
 
 
-def key_instructions(win, valid_keys):
+def text_stim(win, text, pos=(0, 0), height=0.05, color='black', pool=None):
+    """
+        Creates a text stimulus, or reuses the pooled one with the same text and layout.
+
+        Arguments:
+            win: psychopy window object
+            text (str): text to display
+            pos (tuple): position of the text on the window
+            height (float): height of the letters
+            color (str): colour of the text
+            pool (TextPool): optional pool of text stimuli for this window
+
+        return:
+            stim: psychopy visual text object
+    """
+    if pool is None:
+        return visual.TextStim(win, text=text, pos=pos, height=height, color=color)
+
+    return pool.get(text, pos=pos, height=height, color=color)
+
+
+def key_instructions(win, valid_keys, pool=None):
     """
         Creates text to output keyboard instructions to monitor.
 
         Arguments:
             win: psychopy window object
             valid_keys (list): keyboard keys users can press as a valid response
+            pool (TextPool): optional pool of text stimuli, the instructions are built once and reused
 
         return:
             instructions: psychopy visual text object
@@ -160,12 +197,13 @@ def key_instructions(win, valid_keys):
     new = valid_keys[1]
     text = "On the keyboard, press '" + str(old) + "' for previously seen images and '" + str(new) + "' for new images"
 
-    instructions = visual.TextStim(win, text=text, pos=(0, -0.2), height=0.02, color='red')
+    instructions = text_stim(win, text, pos=(0, -0.2), height=0.02, color='red', pool=pool)
 
     return instructions
 
 
-def display_image(win, img, delay, time, valid_keys, test=True, instructions=None):
+def display_image(win, img, delay, time, valid_keys, test=True, instructions=None, collector=None, timer=None,
+                  scheduler=None):
     """
         Displays an image stimulus in window for a specified amount of time.
 
@@ -177,6 +215,11 @@ def display_image(win, img, delay, time, valid_keys, test=True, instructions=Non
             valid_keys (list): valid input for keyboard keys
             test (bool): true if image is being displayed for test phase, false if not
             instructions: psychopy visual text object
+            collector (ResponseCollector): optional response collector, keeps polling statistics
+            across trials
+            timer (FrameTimer): optional frame timer recording every flip of the trial
+            scheduler (FrameScheduler): optional frame-locked scheduler, presentation time and delay are
+            then counted in frames instead of waited for
 
         return:
             resp (list): keyboard responses
@@ -193,6 +236,15 @@ def display_image(win, img, delay, time, valid_keys, test=True, instructions=Non
     end = 0.0
     logging.LogFile(f=sys.stdout, level=logging.DATA, filemode='w')
 
+    if collector is None:
+        collector = ResponseCollector()
+
+    if timer is None:
+        flip = win.flip
+    else:
+        flip = timer.flip
+        timer.start_trial(str(img.name), time)
+
     clock = core.Clock()
 
     event.clearEvents()
@@ -202,33 +254,42 @@ def display_image(win, img, delay, time, valid_keys, test=True, instructions=Non
     if test:
         instructions.draw()
 
-    win.flip()
-    logging.data(msg=str(img.name) + ' is presented', obj=clock.getTime())
-    start = float(clock.getTime())
+    if scheduler is None:
+        flip()
+        logging.data(msg=str(img.name) + ' is presented', obj=clock.getTime())
+        start = float(clock.getTime())
+
+        keys = collector.collect(clock, time, stop_keys=valid_keys if test else None)
 
-    trial = True
-    while trial:
-        if clock.getTime() >= time:
-            win.flip()
+        presented = clock.getTime() >= time
+        if presented:
+            flip()
             logging.data(msg=str(img.name) + ' done presenting.', obj=clock.getTime())
             end = float(clock.getTime())
-            trial = False
-
-        keys = event.getKeys(timeStamped=clock)
-        if keys:
-            rt.append(keys[0][1])
-            if test:
-                if keys[0][0] in valid_keys:
-                    valid.append("Yes")
-                    logging.data(msg=str(img.name) + ' done presenting.', obj=clock.getTime())
-                    if keys[0][0] == valid_keys[0]:
-                        resp.append("old")
-                    elif keys[0][0] == valid_keys[1]:
-                        resp.append("new")
-                    trial = False
-                else:
-                    resp.append(keys[0][0])
-                    valid.append("No")
+    else:
+        # The offset flip blanks the screen whether or not a key ended the presentation
+        keys, onset, offset, presented = scheduler.present(flip, [img, instructions] if test else [img], time,
+                                                           clock, collector, stop_keys=valid_keys if test else None)
+        logging.data(msg=str(img.name) + ' is presented', obj=onset)
+        start = float(onset)
+        if presented:
+            logging.data(msg=str(img.name) + ' done presenting.', obj=offset)
+            end = float(offset)
+
+    for key, key_time in keys:
+        rt.append(key_time)
+        if test:
+            if key in valid_keys:
+                valid.append("Yes")
+                logging.data(msg=str(img.name) + ' done presenting.', obj=clock.getTime())
+                if key == valid_keys[0]:
+                    resp.append("old")
+                elif key == valid_keys[1]:
+                    resp.append("new")
+                break
+            else:
+                resp.append(key)
+                valid.append("No")
 
     if test:
         if len(valid) == 0:
@@ -237,9 +298,17 @@ def display_image(win, img, delay, time, valid_keys, test=True, instructions=Non
             resp.append("None")
             rt.append(-1)
 
-    win.flip()
-    logging.data(msg="Blank Screen", obj=clock.getTime())
-    core.wait(delay)
+    if scheduler is None:
+        flip()
+        logging.data(msg="Blank Screen", obj=clock.getTime())
+        if timer is not None:
+            timer.end_trial(terminated=not presented)
+        core.wait(delay)
+    else:
+        if timer is not None:
+            timer.end_trial(terminated=not presented, offset_flip=scheduler.last['Presented Frames'],
+                            frame_locked=True)
+        scheduler.blank(flip, delay)
 
     if test:
         return resp, rt, valid
@@ -247,14 +316,15 @@ def display_image(win, img, delay, time, valid_keys, test=True, instructions=Non
         return start, end
 
 
-def study_phase(win, data, df, num, time, delay, trial, subj, path, valid_keys):
+def study_phase(win, data, records, num, time, delay, trial, subj, path, valid_keys, cache=None, fmt='csv',
+                collector=None, timer=None, db=None, writer=None, resume_from=0, ingest=None, scheduler=None):
     """
         Simulates a run for the study phase portion of the experiment.
 
         Arguments:
             win: psychopy window object
             data (list): image dataset
-            df (pandas dataframe): dataframe to store experimental data
+            records (TrialBuffer): preallocated trial records, exported as a dataframe at the end of the phase
             num (int): length of study list (number of images)
             delay (float): delay or interval between images
             time (float): duration image will display
@@ -262,35 +332,53 @@ def study_phase(win, data, df, num, time, delay, trial, subj, path, valid_keys):
             subj (int): subject number or id
             path (str): path to target directory to store data
             valid_keys (list): valid input for keyboard keys
+            cache (StimulusCache): optional cache of preloaded/prefetched stimuli
+            fmt (str): file format of stored data, 'csv' or 'npz', or None to only store it in db
+            collector (ResponseCollector): optional response collector shared across trials
+            timer (FrameTimer): optional frame timer, its per-trial records are stored next to the phase data
+            scheduler (FrameScheduler): optional frame-locked scheduler, its per-trial records are stored next
+            to the phase data
+            db (ResultsDB): optional results database the phase data is also stored in
+            writer (TrialWriter): optional journal every completed trial is appended to
+            resume_from (int): index of the first trial to run, earlier rows were restored from a journal
+            ingest (IngestClient): optional client every completed trial is sent to a collector with
 
         return:
             path (str): Experimental data in dataframe is stored in csv to target directory
     """
 
-    for run in range(num):
-        img = image_stim(win, data[run])
-        df['Image'].loc[run] = str(img.name)
+    start_logs("study_phase", path, subj, trial, timer, scheduler, append=resume_from > 0)
+
+    for run in range(resume_from, num):
+        img = image_stim(win, data[run], cache=cache)
+        if cache is not None:
+            cache.prefetch(data, run)
 
-        start, end = display_image(win, img, delay, time, valid_keys, test=False, instructions=None)
+        start, end = display_image(win, img, delay, time, valid_keys, test=False, instructions=None,
+                                   collector=collector, timer=timer, scheduler=scheduler)
 
-        df['Start'].loc[run] = start
-        df['End'].loc[run] = end
-        df['Delay'].loc[run] = delay
-        df['Valid Keys'].loc[run] = valid_keys
+        records.record_study(run, str(img.name), start, end, delay, valid_keys)
+        if writer is not None:
+            writer.write("study_phase", trial, run, records.row(run))
+        if ingest is not None:
+            ingest.write("study_phase", trial, run, records.row(run))
 
-    create_directory("study_phase", path, subj, trial, df=df)
+    create_directory("study_phase", path, subj, trial, df=records.to_df(), fmt=fmt, db=db)
+    end_logs(timer, scheduler, fmt=fmt)
 
     return path
 
 
-def test_phase(win, data, df, num, time, delay, trial, subj, path, valid_keys):
+def test_phase(win, data, records, num, time, delay, trial, subj, path, valid_keys, cache=None, fmt='csv',
+               collector=None, timer=None, db=None, pool=None, writer=None, resume_from=0, ingest=None,
+               scheduler=None):
     """
         Simulates a run for the test phase portion of the experiment.
 
         Arguments:
             win: psychopy window object
             data (list): image dataset
-            df (pandas dataframe): dataframe to store experimental data
+            records (TrialBuffer): preallocated trial records, exported as a dataframe at the end of the phase
             num (int): length of test list (number of images)
             delay (float): delay or interval between images
             time (float): duration image will display
@@ -298,36 +386,193 @@ def test_phase(win, data, df, num, time, delay, trial, subj, path, valid_keys):
             subj (int): subject number or id
             path (str): path to target directory to store data
             valid_keys (list): valid input for keyboard keys
+            cache (StimulusCache): optional cache of preloaded/prefetched stimuli
+            fmt (str): file format of stored data, 'csv' or 'npz', or None to only store it in db
+            collector (ResponseCollector): optional response collector shared across trials
+            timer (FrameTimer): optional frame timer, its per-trial records are stored next to the phase data
+            scheduler (FrameScheduler): optional frame-locked scheduler, its per-trial records are stored next
+            to the phase data
+            db (ResultsDB): optional results database the phase data is also stored in
+            pool (TextPool): optional pool of text stimuli, the key instructions are reused across trials
+            writer (TrialWriter): optional journal every completed trial is appended to
+            resume_from (int): index of the first trial to run, earlier rows were restored from a journal
+            ingest (IngestClient): optional client every completed trial is sent to a collector with
 
         return:
             path (str): Experimental data in dataframe is stored in csv to target directory
     """
 
-    for run in range(num):
-        img = image_stim(win, data[run])
-        df['Image'].loc[run] = str(img.name)
+    start_logs("test_phase", path, subj, trial, timer, scheduler, append=resume_from > 0)
 
-        instr = key_instructions(win, valid_keys)
-        resp, rt, valid = display_image(win, img, delay, time, valid_keys, test=True, instructions=instr)
+    for run in range(resume_from, num):
+        img = image_stim(win, data[run], cache=cache)
+        if cache is not None:
+            cache.prefetch(data, run)
 
-        df['Responses'].loc[run] = resp
-        df['Reaction Time'].loc[run] = rt
-        df['Valid Response'].loc[run] = valid
+        instr = key_instructions(win, valid_keys, pool=pool)
+        resp, rt, valid = display_image(win, img, delay, time, valid_keys, test=True, instructions=instr,
+                                        collector=collector, timer=timer, scheduler=scheduler)
 
-        if "None" in resp:
-            df['Number of Responses'].loc[run] = 0
-        else:
-            df['Number of Responses'].loc[run] = len(resp)
+        records.record_test(run, str(img.name), resp, rt, valid)
+        if writer is not None:
+            writer.write("test_phase", trial, run, records.row(run))
+        if ingest is not None:
+            ingest.write("test_phase", trial, run, records.row(run))
 
-    path = create_directory("test_phase", path, subj, trial, df=df)
+    end_logs(timer, scheduler, fmt=fmt)
+    path = create_directory("test_phase", path, subj, trial, df=records.to_df(), fmt=fmt, db=db)
 
     return path
 
 
-def create_directory(name, path, subj, trial, df=None):
+def continuous_phase(win, data, schedule, time, delay, trial, subj, path, valid_keys, cache=None, collector=None,
+                     timer=None, pool=None, writer=None, ingest=None, scheduler=None, restored=(), fmt='csv', db=None):
+    """
+        Runs a continuous-recognition session. Trials are taken from the schedule as they
+        are presented and each record is appended to the CSV when its trial completes, so
+        memory does not grow with the length of the session. A session resumed from its
+        journal skips the scheduled trials it already completed. The completed session is
+        converted to the requested format and stored in the results database, like the other phases.
+
+        Arguments:
+            win: psychopy window object
+            data (list): paths of all images in overall dataset, indexed by the schedule
+            schedule (iterator): Presentation tuples, see continuous_schedule
+            time (float): duration image will display
+            delay (float): delay or interval between images
+            trial (int): trial number of experiment
+            subj (int): subject number or id
+            path (str): path to target directory to store data
+            valid_keys (list): valid input for keyboard keys
+            cache (StimulusCache): optional cache of stimuli, the upcoming images are prefetched
+            collector (ResponseCollector): optional response collector shared across trials
+            timer (FrameTimer): optional frame timer, its per-trial records are stored next to the phase data
+            scheduler (FrameScheduler): optional frame-locked scheduler, its per-trial records are stored next
+            to the phase data
+            pool (TextPool): optional pool of text stimuli, the key instructions are reused across trials
+            writer (TrialWriter): optional journal every completed trial is appended to
+            ingest (IngestClient): optional client every completed trial is sent to a collector with
+            restored (list): records of the trials completed before an interruption, restored from a journal
+            fmt (str): file format of the stored session, 'csv' or 'npz', or None to only store it in db
+            db (ResultsDB): optional results database the session is also stored in
+
+        return:
+            path (str): absolute path of the CSV (or .npz) file of the session, its directory if no file is kept
+    """
+    if fmt not in ('csv', 'npz') and not (fmt is None and db is not None):
+        raise ValueError(f"Unsupported storage format: {fmt}")
+
+    start_logs("continuous_phase", path, subj, trial, timer, scheduler, append=len(restored) > 0)
+    lookahead = cache.prefetch_n if cache is not None else 0
+    schedule = islice(schedule, len(restored), None)
+    upcoming = deque(islice(schedule, lookahead + 1))
+
+    records = ContinuousRecorder(os.path.join(create_directory("continuous_phase", path, subj, trial),
+                                              'continuous_phase.csv'), subj, restored=restored)
+    with records:
+        while upcoming:
+            presentation = upcoming.popleft()
+            upcoming.extend(islice(schedule, 1))
+
+            img = image_stim(win, data[presentation.image], cache=cache)
+            if cache is not None:
+                cache.prefetch([data[p.image] for p in upcoming], -1)
+
+            instr = key_instructions(win, valid_keys, pool=pool)
+            resp, rt, valid = display_image(win, img, delay, time, valid_keys, test=True, instructions=instr,
+                                            collector=collector, timer=timer, scheduler=scheduler)
+
+            row = records.record(presentation, str(img.name), resp, rt, valid)
+            if writer is not None:
+                writer.write("continuous_phase", trial, presentation.position, row)
+            if ingest is not None:
+                ingest.write("continuous_phase", trial, presentation.position, row)
+
+    end_logs(timer, scheduler, fmt=fmt)
+    if fmt == 'csv' and db is None:
+        return records.path
+
+    df = load_data(records.path)
+    path = records.path if fmt == 'csv' else os.path.dirname(records.path)
+    if fmt == 'npz':
+        path = save_npz(df, os.path.splitext(records.path)[0] + '.npz')
+    if db is not None:
+        db.add_session("continuous_phase", df, subj, trial, path=None if fmt is None else path)
+    if fmt != 'csv':
+        os.remove(records.path)
+
+    return path
+
+
+def journal_path(path, subj):
+    """
+        Path of the trial journal of a subject's session today.
+        Journal path format is: path + subject id/number + date + trial_journal.jsonl
+
+        Arguments:
+            path (str): path to target directory to store data
+            subj (int): subject number or id
+
+        return:
+            journal (str): absolute path to journal file
+    """
+    return os.path.join(path, str(subj), str(date.today()), 'trial_journal.jsonl')
+
+
+def start_logs(name, path, subj, trial, timer=None, scheduler=None, append=False):
+    """
+        Starts the per-trial frame timing and schedule logs of a phase, which are written
+        next to the phase data as <name>_frames.csv and <name>_schedule.csv as trials end.
+
+        Arguments:
+            name (str): name of the phase, e.g. 'study_phase'
+            path (str): path to target directory to store data
+            subj (int): subject number or id
+            trial (int): trial number of experiment
+            timer (FrameTimer): optional frame timer
+            scheduler (FrameScheduler): optional frame-locked scheduler
+            append (bool): true to continue the logs of a phase resumed from its journal
+    """
+    if timer is None and scheduler is None:
+        return
+
+    directory = create_directory(name, path, subj, trial)
+    if timer is not None:
+        timer.start_phase(os.path.join(directory, name + '_frames.csv'), append=append)
+    if scheduler is not None:
+        scheduler.start_phase(os.path.join(directory, name + '_schedule.csv'), append=append)
+
+
+def end_logs(timer=None, scheduler=None, fmt='csv'):
+    """
+        Closes the per-trial logs of a phase, converted to a typed .npz archive if the phase
+        data is stored as one.
+
+        Arguments:
+            timer (FrameTimer): optional frame timer
+            scheduler (FrameScheduler): optional frame-locked scheduler
+            fmt (str): file format of the phase data, 'csv', 'npz' or None
+
+        return:
+            paths (list): absolute paths of the stored logs
+    """
+    paths = [log.end_phase() for log in (timer, scheduler) if log is not None]
+    paths = [p for p in paths if p is not None]
+    if fmt != 'npz':
+        return paths
+
+    converted = []
+    for csv_path in paths:
+        converted.append(save_npz(pd.read_csv(csv_path, index_col=0), os.path.splitext(csv_path)[0] + '.npz'))
+        os.remove(csv_path)
+
+    return converted
+
+
+def create_directory(name, path, subj, trial, df=None, fmt='csv', db=None):
     """
         Creates a new directory at specified path if does not already exist and/or
-        stores dataframe as csv.
+        stores dataframe as csv (or as a typed .npz archive, and/or in a results database).
         Directory format is: path + subject id/number + date + trial number
 
         Arguments:
@@ -336,11 +581,15 @@ def create_directory(name, path, subj, trial, df=None):
             path (str): path to target directory to store data
             subj (int): subject number or id
             trial (int): trial number of experiment
+            fmt (str): file format of stored dataframe, 'csv' or 'npz', or None to only store it in db
+            db (ResultsDB): optional results database the dataframe is also stored in
 
         return:
             path: absolute path of new created directory
-            csv_path: absolute path of new CSV file
+            csv_path: absolute path of new CSV (or .npz) file, the directory if no file is written
     """
+    if fmt not in ('csv', 'npz') and not (fmt is None and db is not None):
+        raise ValueError(f"Unsupported storage format: {fmt}")
 
     if platform.system() == "Windows":
         sep = '\\'
@@ -357,9 +606,17 @@ def create_directory(name, path, subj, trial, df=None):
 
     if df is None:
         return path
+    elif fmt is None:
+        db.add_session(name, df, subj, trial, day=dt)
+        return path
     else:
-        csv_path = path + sep + name + '.csv'
-        df.to_csv(csv_path)
+        csv_path = path + sep + name + '.' + fmt
+        if fmt == 'npz':
+            save_npz(df, csv_path)
+        else:
+            df.to_csv(csv_path)
+        if db is not None:
+            db.add_session(name, df, subj, trial, day=dt, path=csv_path)
         return csv_path
 
 
@@ -391,7 +648,7 @@ def create_df(num, subj, test=True):
     return df
 
 
-def end_experiment(win, path, subj, trial, imgs):
+def end_experiment(win, path, subj, trial, imgs, db=None, pool=None, cache=None):
     """
         Closes down the window and ends experiment.
 
@@ -400,14 +657,16 @@ def end_experiment(win, path, subj, trial, imgs):
             path (str): absolute path to target directory
             subj (int): subject number or ID
             trial (int): trial number
-            imgs (list): study phase set of images
+            imgs (list): study phase set of images, None for a continuous-recognition session
+            db (ResultsDB): optional results database, read from if no test phase file was written and
+            written to when results are saved
+            pool (TextPool): optional pool of text stimuli
+            cache (AnalysisCache): optional cache of scored sessions
 
         return:
             None: outputs closing remark to screen, results and shuts down window
     """
-    end = visual.TextStim(win,
-                          text='End of trial. Thank you for participating.',
-                          pos=(0, 0), height=0.05, color='black')
+    end = end_screen(win, pool=pool)
     end.draw()
 
     win.flip()
@@ -422,28 +681,108 @@ def end_experiment(win, path, subj, trial, imgs):
     if str(prompt).lower() != 'y':
         exit()
     else:
-        results_df = load_data(path)
-        output_results(results_df, path, subj, trial, imgs)
+        if db is not None and not os.path.isfile(path):
+            sessions = db.sessions(subject=subj, since=date.today(), until=date.today(), phase='test_phase')
+            results_df = db.session_df(int(sessions['id'].iloc[-1]))
+            output_results(results_df, path, subj, trial, imgs, db=db, fmt=None)
+        else:
+            # With a cache the test phase file is only read if the session was not scored before
+            results_df = load_data(path) if cache is None else None
+            output_results(results_df, path, subj, trial, imgs, db=db, cache=cache)
 
     core.quit()
 
 
-def output_text(win, text):
+def end_screen(win, pool=None):
+    """
+        Creates the closing remark shown at the end of the experiment.
+
+        Arguments:
+            win: psychopy window object
+            pool (TextPool): optional pool of text stimuli
+
+        return:
+            end: psychopy visual text object
+    """
+    return text_stim(win, 'End of trial. Thank you for participating.', pos=(0, 0), height=0.05, color='black',
+                     pool=pool)
+
+
+def text_screen(win, text, pool=None):
+    """
+        Creates the text stimuli of a banner screen waiting for a keypress.
+
+        Arguments:
+            win: psychopy window object
+            text (str): text to output
+            pool (TextPool): optional pool of text stimuli
+
+        return:
+            stims (list): psychopy visual text objects of the text and the keypress prompt
+    """
+    return [text_stim(win, text, pos=(0, 0), height=0.05, color='black', pool=pool),
+            text_stim(win, "Press any key to continue", pos=(0, -0.05), height=0.03, color='black', pool=pool)]
+
+
+def banner_text(phase, trial, start=True):
+    """
+        Text of the banner shown before or after a phase.
+
+        Arguments:
+            phase (str): 'study', 'test' or 'continuous'
+            trial (int): trial number of experiment, counting from 0
+            start (bool): true for the banner before the phase, false for the one after it
+
+        return:
+            text (str): banner text
+    """
+    if start:
+        return "Now starting the " + phase + " phase of Trial: " + str(trial + 1)
+
+    return "End of " + phase + " phase of Trial: " + str(trial + 1)
+
+
+def prewarm_screens(win, pool, valid_keys, trials, phases=('study', 'test')):
+    """
+        Builds every instruction and banner screen of a session in the pool and draws
+        them once off screen, so no text is laid out during the experiment.
+
+        Arguments:
+            win: psychopy window object
+            pool (TextPool): pool of text stimuli for the window
+            valid_keys (list): valid input for keyboard keys
+            trials (int): number of trials for the experiment
+            phases (list): phases whose banners are shown, 'study', 'test' or 'continuous'
+
+        return:
+            pool (TextPool): the pre-warmed pool
+    """
+    key_instructions(win, valid_keys, pool=pool)
+    end_screen(win, pool=pool)
+    for trial in range(trials):
+        for phase in phases:
+            text_screen(win, banner_text(phase, trial, start=True), pool=pool)
+            text_screen(win, banner_text(phase, trial, start=False), pool=pool)
+
+    pool.prewarm()
+
+    return pool
+
+
+def output_text(win, text, pool=None):
     """
         Displays specified text instructions to screen.
 
         Arguments:
             win: psychopy window object
             text (str): text to output
+            pool (TextPool): optional pool of text stimuli
 
         return:
             None: outputs closing text to screen.
     """
-    text_screen = visual.TextStim(win, text=text, pos=(0, 0), height=0.05, color='black')
-    text_screen.draw()
-
-    key_instr = visual.TextStim(win, text="Press any key to continue", pos=(0, -0.05), height=0.03, color='black')
-    key_instr.draw()
+    for stim in text_screen(win, text, pool=pool):
+        stim.draw()
 
     win.flip()
 
@@ -1,21 +1,35 @@
 # Imports #
+import numpy as np
 import pandas as pd
 import os
 from ast import literal_eval
+from itertools import chain
+from pandas.api.types import union_categoricals
 from datetime import datetime, date
 
+NUMERIC_TYPES = ('integer', 'floating', 'mixed-integer-float', 'decimal', 'boolean', 'empty')
+# Bump whenever format_df_vectorized or process_data change, so cached analyses are recomputed
+SCORING_VERSION = 1
+EVENT_COLUMNS = ['Subject ID', 'Trial', 'Press', 'Image', 'Condition', 'Response', 'Valid', 'RT', 'Outcome']
+EVENT_OUTCOMES = ['hit', 'miss', 'false alarm', 'correct rejection', 'invalid']
+
 
 # Functions #
-def load_data(path):
+def load_data(path, events=False, img_list=None):
     """
-        Loads data at specified CSV file path into a dataframe.
+        Loads data at specified CSV (or typed .npz) file path into a dataframe.
 
         Arguments:
-            path (str): absolute path to CSV file.
+            path (str): absolute path to CSV or .npz file.
+            events (bool): return the long-format event table of event_table instead
+            img_list (list): list of images from study set for the event table, None to use the 'Old' column
 
         return:
-            df (pandas dataframe): dataframe containing CSV contents
+            df (pandas dataframe): dataframe containing CSV contents, or the event table
     """
+    if path.endswith('.npz'):
+        return load_npz_events(path, img_list) if events else load_npz(path)
+
     df = pd.read_csv(path,
                      encoding='iso-8859-1',
                      header='infer',
@@ -24,9 +38,150 @@ def load_data(path):
                      low_memory=False,
                      converters={"Responses": literal_eval, "Reaction Time": literal_eval,
                                  'Valid Response': literal_eval})
+    if events:
+        return event_table(df, img_list)
+
     return df
 
 
+def save_npz(df, path):
+    """
+        Stores dataframe as a typed NumPy archive. List cells ('Responses', 'Reaction Time',
+        'Valid Response', 'Valid Keys') are stored as one flat array of values plus row offsets,
+        so they are read back without any string parsing.
+
+        Arguments:
+            df (pandas dataframe): dataframe to store experimental data
+            path (str): absolute path to .npz file
+
+        return:
+            path (str): absolute path to .npz file
+    """
+    arrays = {'__columns__': np.array(df.columns, dtype=str),
+              '__index__': df.index.to_numpy()}
+    kinds = []
+
+    for i, col in enumerate(df.columns):
+        values = df[col].to_numpy()
+        missing = pd.isna(df[col]).to_numpy()
+
+        if df[col].dtype == object and any(isinstance(x, list) for x in values):
+            cells = [x if isinstance(x, list) else [] for x in values]
+            offsets = np.zeros(len(cells) + 1, dtype=np.int64)
+            np.cumsum(np.fromiter(map(len, cells), dtype=np.int64, count=len(cells)), out=offsets[1:])
+            arrays[f'c{i}'] = np.array(list(chain.from_iterable(cells)))
+            arrays[f'o{i}'] = offsets
+            kinds.append('list')
+        elif df[col].dtype == object and pd.api.types.infer_dtype(values, skipna=True) not in NUMERIC_TYPES:
+            arrays[f'c{i}'] = np.where(missing, '', values.astype(str))
+            kinds.append('str')
+        else:
+            arrays[f'c{i}'] = pd.to_numeric(df[col]).to_numpy()
+            kinds.append('num')
+
+        if missing.any():
+            arrays[f'm{i}'] = missing
+
+    arrays['__kinds__'] = np.array(kinds, dtype=str)
+    np.savez_compressed(path, **arrays)
+
+    return path
+
+
+def load_npz(path):
+    """
+        Loads a typed NumPy archive written by save_npz into a dataframe.
+
+        Arguments:
+            path (str): absolute path to .npz file
+
+        return:
+            df (pandas dataframe): dataframe with list cells restored as lists
+    """
+    data = {}
+
+    with np.load(path, allow_pickle=False) as arrays:
+        columns = arrays['__columns__'].tolist()
+        kinds = arrays['__kinds__'].tolist()
+
+        for i, (col, kind) in enumerate(zip(columns, kinds)):
+            values = arrays[f'c{i}']
+            if kind == 'list':
+                flat = values.tolist()
+                offsets = arrays[f'o{i}'].tolist()
+                values = np.empty(len(offsets) - 1, dtype=object)
+                values[:] = [flat[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+            elif kind == 'str':
+                values = values.astype(object)
+
+            if f'm{i}' in arrays:
+                values = values.astype(object) if kind != 'num' else values
+                values[arrays[f'm{i}']] = np.nan
+            data[col] = values
+
+        index = arrays['__index__']
+
+    return pd.DataFrame(data, index=index, columns=columns)
+
+
+def load_npz_events(path, img_list=None):
+    """
+        Builds the event table of event_table straight from the flat arrays of a typed
+        NumPy archive, without restoring the list cells.
+
+        Arguments:
+            path (str): absolute path to .npz file
+            img_list (list): list of images from study set, or None to use the 'Old' column
+
+        return:
+            events (pandas dataframe): one row per keypress, see event_table
+    """
+    trials = {}
+    flat = {}
+
+    with np.load(path, allow_pickle=False) as arrays:
+        columns = arrays['__columns__'].tolist()
+        kinds = arrays['__kinds__'].tolist()
+
+        for i, (col, kind) in enumerate(zip(columns, kinds)):
+            if col not in ('Subject ID', 'Image', 'Old', 'Reaction Time', 'Responses', 'Valid Response'):
+                continue
+            values = arrays[f'c{i}']
+            if kind == 'list':
+                flat[col] = _pad_empty(values, arrays[f'o{i}'])
+                continue
+            if f'm{i}' in arrays:
+                values = values.astype(object) if kind != 'num' else values
+                values[arrays[f'm{i}']] = np.nan
+            trials[col] = values
+
+        index = arrays['__index__']
+
+    (responses, counts), (rt, _), (valid, _) = flat['Responses'], flat['Reaction Time'], flat['Valid Response']
+    study = study_mask(trials['Image'], img_list) if img_list is not None else trials['Old'].astype(bool)
+
+    return _event_frame(trials.get('Subject ID'), index, trials['Image'], study, counts, responses, rt, valid)
+
+
+def export_csv(path, csv_path=None):
+    """
+        Converts a typed .npz session file into the CSV layout read by load_data.
+
+        Arguments:
+            path (str): absolute path to .npz file
+            csv_path (str): target CSV path, defaults to the same name with a .csv extension
+
+        return:
+            csv_path (str): absolute path of new CSV file
+    """
+    if csv_path is None:
+        csv_path = os.path.splitext(path)[0] + '.csv'
+
+    load_npz(path).to_csv(csv_path)
+
+    return csv_path
+
+
 def format_df(df, img_list):
     """
         Formats dataframe for results processing.
@@ -52,6 +207,244 @@ def format_df(df, img_list):
     return tmp
 
 
+def format_df_vectorized(df, img_list, events=False):
+    """
+        Formats dataframe for results processing using NumPy boolean masks instead of
+        row-wise apply. Produces the same columns as format_df, with 'Hits', 'False Alarms',
+        'New to New', 'New to Old' and 'Valid RT' as floats that are NaN for invalid
+        responses. Study images are matched exactly on file name rather than by substring.
+
+        Arguments:
+            df (pandas dataframe): dataframe containing CSV contents
+            img_list (list): list of images from study set, or None to take old images from the
+            'Old' column of a continuous-recognition session
+            events (bool): return the compact long-format event table of event_table instead
+
+        return:
+            df (pandas dataframe): dataframe containing formatted CSV contents, or the event table
+    """
+    if events:
+        return event_table(df, img_list)
+
+    columns = ['Image', 'Reaction Time', 'Responses', 'Valid Response'] + (['Old'] if img_list is None else [])
+    tmp = explode_df(df[columns], ['Reaction Time', 'Responses', 'Valid Response'])
+
+    study = study_mask(tmp['Image'], img_list) if img_list is not None else tmp.pop('Old').to_numpy(dtype=bool)
+    valid = tmp['Valid Response'].to_numpy() == "Yes"
+    old = tmp['Responses'].to_numpy() == 'old'
+    new = tmp['Responses'].to_numpy() == 'new'
+    rt = pd.to_numeric(tmp['Reaction Time'], errors='coerce').to_numpy(dtype=float)
+
+    tmp['Study Imgs'] = study
+    tmp['Hits'] = np.where(valid, old & study, np.nan)
+    tmp['False Alarms'] = np.where(valid, old & ~study, np.nan)
+    tmp['New to New'] = np.where(valid, new & ~study, np.nan)
+    tmp['New to Old'] = np.where(valid, new & study, np.nan)
+    tmp['Valid RT'] = np.where(valid, rt, np.nan)
+
+    return tmp
+
+
+def explode_df(df, columns):
+    """
+        Expands list cells into one row per element, like pd.Series.explode applied to
+        each column, but in a single pass over all list columns. Empty lists become NaN.
+
+        Arguments:
+            df (pandas dataframe): dataframe containing list cells
+            columns (list): names of the columns holding lists of equal length per row
+
+        return:
+            df (pandas dataframe): exploded dataframe, index values repeated per element
+    """
+    data = {}
+    lengths = None
+    for col in columns:
+        values = df[col].to_numpy()
+        if set(map(type, values)) != {list} or not all(values):
+            values = [x if isinstance(x, list) and x else [np.nan] if isinstance(x, list) else [x] for x in values]
+
+        counts = np.fromiter(map(len, values), dtype=np.int64, count=len(values))
+        if lengths is None:
+            lengths = counts
+        elif not np.array_equal(lengths, counts):
+            raise ValueError(f"columns must have matching element counts, '{col}' differs")
+
+        data[col] = np.array(list(chain.from_iterable(values)), dtype=object)
+
+    for col in df.columns:
+        if col not in data:
+            data[col] = np.repeat(df[col].to_numpy(), lengths)
+    data = {col: data[col] for col in df.columns}
+
+    return pd.DataFrame(data, index=np.repeat(df.index.to_numpy(), lengths))
+
+
+def study_mask(images, img_list):
+    """
+        Flags which images belong to the study set with a hash lookup per distinct image.
+
+        Arguments:
+            images (pandas series): image names
+            img_list (list): list of images from study set
+
+        return:
+            mask (numpy array): true where the image is a study image
+    """
+    study = set(os.path.basename(k) for k in img_list)
+    codes, uniques = pd.factorize(images)
+    lookup = np.fromiter((os.path.basename(str(x)) in study for x in uniques), dtype=bool, count=len(uniques))
+
+    # Missing images get code -1, which picks up the trailing False
+    return np.append(lookup, False)[codes]
+
+
+def event_table(df, img_list):
+    """
+        Builds the canonical long-format event table of a session: one row per keypress,
+        with categorical subject, image, condition, response and outcome columns, small
+        integer trial and keypress numbers, a boolean validity flag and float32 reaction
+        times. Responses are scored like format_df_vectorized, so the table takes about a
+        tenth of the memory of its output and groups without hashing strings.
+
+        Arguments:
+            df (pandas dataframe): dataframe containing CSV contents
+            img_list (list): list of images from study set, or None to take old images from the
+            'Old' column of a continuous-recognition session
+
+        return:
+            events (pandas dataframe): columns of EVENT_COLUMNS, 'RT' is NaN where no key was pressed
+            and 'Outcome' is 'invalid' for keys other than the response keys
+    """
+    responses, counts = _flatten(df['Responses'].to_numpy())
+    rt, _ = _flatten(df['Reaction Time'].to_numpy())
+    valid, _ = _flatten(df['Valid Response'].to_numpy())
+    study = study_mask(df['Image'], img_list) if img_list is not None else df['Old'].to_numpy(dtype=bool)
+    subjects = df['Subject ID'].to_numpy() if 'Subject ID' in df.columns else None
+
+    return _event_frame(subjects, df.index.to_numpy(), df['Image'].to_numpy(), study, counts, responses, rt, valid)
+
+
+def concat_events(tables):
+    """
+        Stacks the event tables of several sessions, e.g. a cohort. pd.concat turns categorical
+        columns whose categories differ into object columns, here the categories are unified
+        so the combined table keeps the compact dtypes.
+
+        Arguments:
+            tables (list): event tables of event_table
+
+        return:
+            events (pandas dataframe): combined event table with a fresh index
+    """
+    tables = list(tables)
+    if not tables:
+        return pd.DataFrame(columns=EVENT_COLUMNS)
+
+    data = {}
+    for col in EVENT_COLUMNS:
+        if isinstance(tables[0][col].dtype, pd.CategoricalDtype):
+            data[col] = union_categoricals([table[col] for table in tables], ignore_order=True)
+        else:
+            data[col] = np.concatenate([table[col].to_numpy() for table in tables])
+
+    return pd.DataFrame(data, columns=EVENT_COLUMNS)
+
+
+def event_metrics(events, by=None):
+    """
+        Calculates the hit rate, false alarm rate and average reaction time of process_data
+        from an event table.
+
+        Arguments:
+            events (pandas dataframe): event table of event_table
+            by (str or list): column(s) to group by, e.g. 'Subject ID', None for the whole table
+
+        return:
+            metrics (tuple or pandas dataframe): hit rate, false alarm rate and average reaction time,
+            or a dataframe of 'Hit Ratio', 'False Alarm Ratio' and 'Average RT (sec)' per group
+    """
+    outcome = events['Outcome'].cat.codes.to_numpy()
+    counts = pd.DataFrame({outcome_name: outcome == code for code, outcome_name in enumerate(EVENT_OUTCOMES[:4])})
+    # Summed in float64, as process_data averages the float64 reaction times
+    counts['rt'] = events['RT'].where(events['Valid']).astype(float)
+
+    if by is None:
+        totals = counts.sum()
+        totals['rt'] = counts['rt'].mean()
+        totals = totals.to_frame().T
+    else:
+        totals = counts.groupby([events[col] for col in ([by] if isinstance(by, str) else by)], observed=True)
+        totals = totals.agg({**{name: 'sum' for name in EVENT_OUTCOMES[:4]}, 'rt': 'mean'})
+
+    hit_rate = totals['hit'] / (totals['hit'] + totals['miss'])
+    false_alarm_rate = totals['false alarm'] / (totals['false alarm'] + totals['correct rejection'])
+    # Python's round per value, as process_data rounds its floats
+    metrics = pd.DataFrame({'Hit Ratio': [round(x, 2) for x in hit_rate],
+                            'False Alarm Ratio': [round(x, 2) for x in false_alarm_rate],
+                            'Average RT (sec)': [round(x, 4) for x in totals['rt']]}, index=totals.index)
+
+    return tuple(metrics.iloc[0]) if by is None else metrics
+
+
+def _flatten(values):
+    # Flat element array and element count per row, with empty lists and scalars as one element like explode_df
+    if set(map(type, values)) != {list} or not all(values):
+        values = [x if isinstance(x, list) and x else [np.nan] if isinstance(x, list) else [x] for x in values]
+    counts = np.fromiter(map(len, values), dtype=np.int64, count=len(values))
+
+    return np.array(list(chain.from_iterable(values)), dtype=object), counts
+
+
+def _pad_empty(flat, offsets):
+    # Element counts from save_npz offsets, with a NaN element for each empty list like _flatten
+    counts = np.diff(offsets)
+    if counts.all():
+        return flat, counts
+
+    padded = np.maximum(counts, 1)
+    values = np.full(padded.sum(), np.nan, dtype=float if flat.dtype.kind in 'fiub' else object)
+    target = np.repeat(np.cumsum(padded) - padded - offsets[:-1], counts) + np.arange(len(flat))
+    values[target] = flat
+
+    return values, padded
+
+
+def _event_frame(subjects, index, images, study, counts, responses, rt, valid):
+    # Assembles the event table from per-trial arrays and flat per-keypress arrays
+    starts = np.cumsum(counts) - counts
+    responses = pd.Categorical(responses)
+    valid = np.asarray(valid, dtype=object) == 'Yes'
+    rt = pd.to_numeric(pd.Series(rt, copy=False), errors='coerce').to_numpy(dtype=np.float32)
+    rt[responses == 'None'] = np.nan
+    condition = np.repeat(np.asarray(study, dtype=bool), counts)
+
+    old = responses == 'old'
+    new = responses == 'new'
+    outcome = np.full(len(responses), 4, dtype=np.int8)
+    outcome[valid & old & condition] = 0
+    outcome[valid & new & condition] = 1
+    outcome[valid & old & ~condition] = 2
+    outcome[valid & new & ~condition] = 3
+
+    def repeated(values):
+        # Categorical per trial, codes repeated per keypress so the strings are never repeated
+        codes, uniques = pd.factorize(values)
+        return pd.Categorical.from_codes(np.repeat(codes, counts), uniques)
+
+    data = {'Subject ID': repeated(subjects) if subjects is not None else pd.Categorical([np.nan] * len(responses)),
+            'Trial': np.repeat(index.astype(np.int32), counts),
+            'Press': (np.arange(len(responses)) - np.repeat(starts, counts)).astype(np.int16),
+            'Image': repeated(images),
+            'Condition': pd.Categorical.from_codes(condition.astype(np.int8), ['new', 'old']),
+            'Response': responses,
+            'Valid': valid,
+            'RT': rt,
+            'Outcome': pd.Categorical.from_codes(outcome, EVENT_OUTCOMES)}
+
+    return pd.DataFrame(data, columns=EVENT_COLUMNS)
+
+
 def process_data(df):
     """
         Processes df contents to calculate proportion of hits, false alarms,
@@ -86,17 +479,24 @@ def process_data(df):
     return hit_rate, false_alarm_rate, avg_rt
 
 
-def store_results(path, data):
+def store_results(path, data, db=None, fmt='csv'):
     """
-        Stores results into a CSV at specified path.
+        Stores results into a CSV at specified path and/or in a results database.
 
         Arguments:
             path (str): absolute path to target directory
             data (list): results of data processing
+            db (ResultsDB): optional results database the results are also stored in
+            fmt (str): 'csv', or None to only store the results in db
 
         return:
-            dir_path (str): absolute path to new CSV file
+            dir_path (str): absolute path to new CSV file, the database file if no CSV is written
     """
+    if db is not None:
+        db.add_results(data)
+        if fmt is None:
+            return db.path
+
     df = pd.DataFrame(data=[data],
                       columns=["Subject ID", 'Trial', 'Hit Ratio', 'False Alarm Ratio', 'Average RT (sec)'])
 
@@ -111,7 +511,7 @@ def store_results(path, data):
     return dir_path
 
 
-def output_results(df, path, subj, trial, img_list):
+def output_results(df, path, subj, trial, img_list, db=None, fmt='csv', cache=None):
     """
         Main driver function to perform processing and outputting of
         results
@@ -121,15 +521,21 @@ def output_results(df, path, subj, trial, img_list):
             path (str): absolute path to target directory
             subj (int): subject number or ID
             trial (int): trial number
-            img_list (list): list of images from study set
+            img_list (list): list of images from study set, None for a continuous-recognition session
+            db (ResultsDB): optional results database the results are also stored in
+            fmt (str): 'csv', or None to only store the results in db
+            cache (AnalysisCache): optional cache of scored sessions, used if path is a test phase file;
+            df may then be None and is only read on a miss
 
         return:
             None: outputs and or saves results
     """
 
-    f_df = format_df(df, img_list)
-
-    hit_ratio, false_alarm_ratio, rt_avg = process_data(f_df)
+    if cache is not None and os.path.isfile(path):
+        _, (hit_ratio, false_alarm_ratio, rt_avg) = cache.analyse(path, img_list, df=df, frame=False)
+    else:
+        f_df = format_df_vectorized(df, img_list)
+        hit_ratio, false_alarm_ratio, rt_avg = process_data(f_df)
 
     data = [subj, trial, hit_ratio, false_alarm_ratio, rt_avg]
 
@@ -143,7 +549,7 @@ def output_results(df, path, subj, trial, img_list):
     if str(save).lower() != 'y':
         exit()
     else:
-        results = store_results(path, data)
+        results = store_results(path, data, db=db, fmt=fmt)
         print(f"Results have been saved to: {results}")
 
 
@@ -0,0 +1,241 @@
+# Imports #
+import json
+import numpy as np
+from trial_writer import RowWriter
+
+SCHEDULE_COLUMNS = ['Image', 'Requested', 'Requested Frames', 'Presented Frames', 'Achieved', 'Duration Error',
+                    'Terminated', 'Onset', 'Offset', 'Requested ISI', 'ISI Frames', 'Achieved ISI']
+
+
+# Classes #
+class FrameScheduler:
+    """
+        Frame-locked presentation for display_image. Durations are converted to a number
+        of frames of the measured refresh rate and each trial is driven by counting flips,
+        redrawing the stimuli on every frame, instead of by core.wait and clock deadlines.
+        Between flips the keyboard is polled until draw_margin before the next refresh, so
+        reaction times keep the resolution of the response collector. The achieved duration
+        of every trial is the time between its onset and offset flips.
+
+        A trial record is complete once the next trial's onset gives its achieved interval.
+        It is then appended to the CSV file of the phase and added to running totals for the
+        session summary, so only the current trial is kept in memory.
+
+        Arguments:
+            win: psychopy window object
+            refresh_rate (float): refresh rate of the monitor in Hz, measured from the window if not given
+            draw_margin (float): time in seconds before the next refresh reserved for drawing and flipping
+    """
+
+    def __init__(self, win, refresh_rate=None, draw_margin=0.004):
+        if refresh_rate is None:
+            refresh_rate = win.getActualFrameRate() or 60.0
+
+        self.win = win
+        self.refresh_rate = refresh_rate
+        self.frame_period = 1.0 / refresh_rate
+        self.draw_margin = draw_margin
+        self.last = None
+        self._last_offset = None
+        self._log = None
+
+        self._count = 0
+        self._terminated = 0
+        self._late = 0
+        self._errors = 0
+        self._error_sum = 0.0
+        self._error_max = 0.0
+        self._isi_error_max = None
+
+    def frames(self, duration):
+        """
+            Number of frames closest to a duration.
+
+            Arguments:
+                duration (float): time in seconds
+
+            return:
+                frames (int): number of frames, at least one
+        """
+        return max(1, int(round(duration / self.frame_period)))
+
+    def start_phase(self, path=None, append=False):
+        """
+            Marks the start of a phase, so its first trial is not given an interval from the
+            last trial of the previous phase. The trial records of the phase are appended to a
+            CSV file as they complete.
+
+            Arguments:
+                path (str): absolute path to CSV file, None to only keep the session summary
+                append (bool): true to continue the file of an interrupted phase
+        """
+        self.end_phase()
+        if path is not None:
+            self._log = RowWriter(path, SCHEDULE_COLUMNS, append=append)
+
+    def end_phase(self):
+        """
+            Completes the last trial of the phase, without an achieved interval, and closes the
+            CSV file of the phase.
+
+            return:
+                path (str): absolute path to CSV file, None if the phase had none
+        """
+        if self.last is not None:
+            self._complete(self.last)
+            self.last = None
+        self._last_offset = None
+
+        if self._log is None:
+            return None
+
+        path = self._log.close()
+        self._log = None
+
+        return path
+
+    def present(self, flip, stims, duration, clock, collector, stop_keys=None):
+        """
+            Shows stimuli for the number of frames closest to duration, or until one of
+            stop_keys is pressed, and blanks the screen with the offset flip.
+
+            Arguments:
+                flip (function): flips the window and returns the flip time, e.g. win.flip or FrameTimer.flip
+                stims (list): psychopy stimuli drawn on every frame, already drawn for the onset flip
+                duration (float): requested presentation time in seconds
+                clock: psychopy clock the response timestamps refer to
+                collector (ResponseCollector): response collector polled between flips
+                stop_keys (list): keys that end the presentation early
+
+            return:
+                keys (list): (key, timestamp) pairs in the order they were pressed
+                onset (float): clock time of the onset flip
+                offset (float): clock time of the offset flip
+                presented (bool): false if a key ended the presentation early
+        """
+        n = self.frames(duration)
+        keys = []
+        terminated = False
+
+        onset_flip = flip()
+        onset = last = clock.getTime()
+        shown = 1
+
+        while True:
+            keys.extend(collector.collect(clock, last + self.frame_period - self.draw_margin, stop_keys=stop_keys))
+            if stop_keys and any(key in stop_keys for key, key_time in keys):
+                terminated = True
+                break
+            if shown == n:
+                break
+
+            for stim in stims:
+                stim.draw()
+            flip()
+            last = clock.getTime()
+            shown += 1
+
+        offset_flip = flip()
+        offset = clock.getTime()
+
+        achieved = offset_flip - onset_flip
+        if self.last is not None:
+            self.last['Achieved ISI'] = onset_flip - self._last_offset
+            self._complete(self.last)
+        self._last_offset = offset_flip
+
+        self.last = {'Image': str(getattr(stims[0], 'name', '')) if stims else '', 'Requested': duration,
+                     'Requested Frames': n, 'Presented Frames': shown, 'Achieved': achieved,
+                     'Duration Error': np.nan if terminated else achieved - duration,
+                     'Terminated': terminated, 'Onset': onset, 'Offset': offset, 'Requested ISI': np.nan,
+                     'ISI Frames': 0, 'Achieved ISI': np.nan}
+
+        return keys, onset, offset, not terminated
+
+    def blank(self, flip, duration):
+        """
+            Keeps the screen blank after the offset flip, so that the next onset flip falls
+            the number of frames closest to duration after it.
+
+            Arguments:
+                flip (function): flips the window and returns the flip time
+                duration (float): requested interval in seconds between offset and next onset
+
+            return:
+                frames (int): number of frames of the interval, at least one as the next onset flip
+                cannot fall on the refresh of the offset flip
+        """
+        n = max(1, int(round(duration / self.frame_period)))
+        for _ in range(n - 1):
+            flip()
+
+        if self.last is not None:
+            self.last['Requested ISI'] = duration
+            self.last['ISI Frames'] = n
+
+        return n
+
+    def hold(self, flip, duration):
+        """
+            Shows what is drawn for the number of frames closest to duration, e.g. for pause.
+
+            Arguments:
+                flip (function): flips the window and returns the flip time
+                duration (float): time in seconds
+
+            return:
+                achieved (float): time in seconds between the first flip and the flip ending the hold
+        """
+        first = flip()
+        last = first
+        for _ in range(self.frames(duration)):
+            last = flip()
+
+        return last - first
+
+    def summary(self):
+        """
+            Summarises how closely the achieved durations matched the requested ones.
+
+            return:
+                summary (dict): refresh rate, trial counts and duration and interval error statistics
+        """
+        return {'trials': self._count,
+                'refresh_rate': self.refresh_rate,
+                'frame_period': self.frame_period,
+                'terminated': self._terminated,
+                'trials_with_late_offset': self._late,
+                'mean_abs_duration_error': self._error_sum / self._errors if self._errors else None,
+                'max_abs_duration_error': self._error_max if self._errors else None,
+                'max_abs_isi_error': self._isi_error_max}
+
+    def save_summary(self, path):
+        """
+            Stores the session summary as JSON.
+
+            Arguments:
+                path (str): absolute path to JSON file
+
+            return:
+                path (str): absolute path to JSON file
+        """
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+        return path
+
+    def _complete(self, record):
+        # Adds a finished trial to the session totals and the file of the phase
+        self._count += 1
+        self._terminated += bool(record['Terminated'])
+        self._late += int(abs(record['Achieved'] - record['Presented Frames'] * self.frame_period)
+                          > self.frame_period / 2)
+        if not np.isnan(record['Duration Error']):
+            self._errors += 1
+            self._error_sum += abs(record['Duration Error'])
+            self._error_max = max(self._error_max, abs(record['Duration Error']))
+        isi_error = abs(record['Achieved ISI'] - record['ISI Frames'] * self.frame_period)
+        if not np.isnan(isi_error):
+            self._isi_error_max = max(self._isi_error_max or 0.0, isi_error)
+        if self._log is not None:
+            self._log.write(record)
@@ -0,0 +1,169 @@
+# Imports #
+import json
+import numpy as np
+from trial_writer import RowWriter
+
+TIMING_COLUMNS = ['Image', 'Requested', 'Onset Flip', 'Offset Flip', 'Duration', 'Duration Error', 'Dropped Frames',
+                  'Flip Times']
+
+
+# Classes #
+class FrameTimer:
+    """
+        Opt-in frame-timing capture for display_image. Records the timestamp of every flip
+        of each trial, the achieved presentation duration, its error against the requested
+        duration and, for frame-locked trials, how many frames were dropped while the image
+        was on screen. Flip times are stored as one ';'-delimited string per trial.
+
+        Only the record of the last trial is kept: the records of a phase are appended to
+        its CSV file as each trial ends and the session summary is kept as running totals,
+        so memory does not grow with the length of the session.
+
+        Arguments:
+            win: psychopy window object
+            refresh_rate (float): refresh rate of the monitor in Hz, measured from the window if not given
+    """
+
+    def __init__(self, win, refresh_rate=None):
+        if refresh_rate is None:
+            refresh_rate = win.getActualFrameRate() or 60.0
+
+        self.win = win
+        self.frame_period = 1.0 / refresh_rate
+        self.last = None
+        self.count = 0
+        self._name = None
+        self._requested = None
+        self._flips = []
+        self._log = None
+
+        self._dropped = 0
+        self._with_drops = 0
+        self._errors = 0
+        self._error_sum = 0.0
+        self._error_max = 0.0
+
+    def start_phase(self, path=None, append=False):
+        """
+            Starts a phase, whose trial records are appended to a CSV file as they end.
+
+            Arguments:
+                path (str): absolute path to CSV file, None to only keep the session summary
+                append (bool): true to continue the file of an interrupted phase
+        """
+        self.end_phase()
+        if path is not None:
+            self._log = RowWriter(path, TIMING_COLUMNS, append=append)
+
+    def end_phase(self):
+        """
+            Closes the CSV file of the phase.
+
+            return:
+                path (str): absolute path to CSV file, None if the phase had none
+        """
+        if self._log is None:
+            return None
+
+        path = self._log.close()
+        self._log = None
+
+        return path
+
+    def start_trial(self, name, requested):
+        """
+            Starts recording the flips of a trial.
+
+            Arguments:
+                name (str): name of the image presented
+                requested (float): requested presentation duration in seconds
+        """
+        self._name = name
+        self._requested = requested
+        self._flips = []
+
+    def flip(self):
+        """
+            Flips the window and records the flip timestamp.
+
+            return:
+                t (float): time of the flip
+        """
+        t = self.win.flip()
+        self._flips.append(t)
+
+        return t
+
+    def end_trial(self, terminated=False, offset_flip=1, frame_locked=False):
+        """
+            Summarises the flips of the current trial.
+
+            Arguments:
+                terminated (bool): true if a response ended the presentation before the requested duration
+                offset_flip (int): index of the flip that took the image off screen, after any redraws
+                frame_locked (bool): true if the image was redrawn on every frame up to the offset flip
+
+            return:
+                record (dict): timing record of the trial
+        """
+        flips = self._flips
+        onset = flips[0] if len(flips) > 0 else np.nan
+        offset = flips[offset_flip] if len(flips) > offset_flip else np.nan
+        duration = offset - onset
+        error = np.nan if terminated else duration - self._requested
+
+        if frame_locked:
+            # Every interval between the flips of a redrawn image should last one frame, an interval of
+            # about k frames means k - 1 refreshes were missed
+            intervals = np.diff(flips[:offset_flip + 1]) / self.frame_period
+            dropped = int((np.rint(intervals[intervals > 1.5]) - 1).sum())
+        else:
+            # Nothing is flipped between the onset and offset of a waited presentation, so drops are not measured
+            dropped = np.nan
+
+        record = {'Image': self._name, 'Requested': self._requested, 'Onset Flip': onset, 'Offset Flip': offset,
+                  'Duration': duration, 'Duration Error': error, 'Dropped Frames': dropped,
+                  'Flip Times': ';'.join(map(str, flips))}
+
+        self.count += 1
+        if dropped > 0:
+            self._dropped += dropped
+            self._with_drops += 1
+        if not np.isnan(error):
+            self._errors += 1
+            self._error_sum += abs(error)
+            self._error_max = max(self._error_max, abs(error))
+        if self._log is not None:
+            self._log.write(record)
+        self.last = record
+
+        return record
+
+    def summary(self):
+        """
+            Summarises timing fidelity over every recorded trial of the session.
+
+            return:
+                summary (dict): trial counts, dropped frames and duration error statistics
+        """
+        return {'trials': self.count,
+                'frame_period': self.frame_period,
+                'dropped_frames': self._dropped,
+                'trials_with_drops': self._with_drops,
+                'mean_abs_duration_error': self._error_sum / self._errors if self._errors else None,
+                'max_abs_duration_error': self._error_max if self._errors else None}
+
+    def save_summary(self, path):
+        """
+            Stores the session summary as JSON.
+
+            Arguments:
+                path (str): absolute path to JSON file
+
+            return:
+                path (str): absolute path to JSON file
+        """
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+        return path
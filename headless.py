@@ -0,0 +1,365 @@
+"""
+Headless simulation backend for the experiment.
+
+Replaces psychopy's visual, event, core, gui and logging modules with stand-ins that
+run on a virtual clock, so a whole session (main -> study_phase/test_phase ->
+end_experiment) runs as fast as the CPU allows on a machine with no display.
+Keyboard input comes from a SimulatedResponder with configurable hit and false alarm
+probabilities and an ex-Gaussian reaction time distribution.
+
+- Usage: python headless.py <dataset> <target> [--subjects N] [--images N] [--trials N]
+
+"""
+# Imports #
+import argparse
+import math
+import os
+import sys
+import types
+import numpy as np
+
+PSYCHOPY_MODULES = ('visual', 'event', 'core', 'gui', 'logging')
+PATCHED_MODULES = ('experiment_backend', 'experiment_results', 'ui_main', 'response_collection', 'stimulus_cache',
+                   'frame_timing', 'text_pool')
+
+
+# Classes #
+class SimulatedResponder:
+    """
+        Synthetic participant. An image is "old" to the responder if it was shown in a
+        study trial (image without instructions) earlier in the session.
+
+        Arguments:
+            valid_keys (list): keyboard keys for old and new responses
+            hit_rate (float): probability of answering old to a studied image
+            false_alarm_rate (float): probability of answering old to a new image
+            rt_mu (float): mean of the normal component of reaction times in seconds
+            rt_sigma (float): standard deviation of the normal component in seconds
+            rt_tau (float): mean of the exponential component in seconds
+            invalid_rate (float): probability of pressing an invalid key before responding
+            miss_rate (float): probability of not responding at all
+            seed (int): value for seeding the responder's random generator
+    """
+
+    def __init__(self, valid_keys=('a', 'l'), hit_rate=0.8, false_alarm_rate=0.2, rt_mu=0.5, rt_sigma=0.08,
+                 rt_tau=0.15, invalid_rate=0.0, miss_rate=0.0, seed=0):
+        self.valid_keys = list(valid_keys)
+        self.hit_rate = hit_rate
+        self.false_alarm_rate = false_alarm_rate
+        self.rt_mu = rt_mu
+        self.rt_sigma = rt_sigma
+        self.rt_tau = rt_tau
+        self.invalid_rate = invalid_rate
+        self.miss_rate = miss_rate
+        self.rng = np.random.default_rng(seed)
+
+        self.studied = set()
+        self.log = []
+
+    def study(self, name):
+        """
+            Remembers an image shown during the study phase.
+
+            Arguments:
+                name (str): name of the image
+        """
+        self.studied.add(name)
+
+    def respond(self, name):
+        """
+            Decides the keypresses for a test trial.
+
+            Arguments:
+                name (str): name of the image
+
+            return:
+                keys (list): (key, seconds after onset) pairs
+        """
+        old = name in self.studied
+        rt = max(0.05, self.rng.normal(self.rt_mu, self.rt_sigma) + self.rng.exponential(self.rt_tau))
+
+        keys = []
+        if self.rng.random() < self.invalid_rate:
+            keys.append(('x', rt / 2))
+        if self.rng.random() >= self.miss_rate:
+            says_old = self.rng.random() < (self.hit_rate if old else self.false_alarm_rate)
+            keys.append((self.valid_keys[0] if says_old else self.valid_keys[1], rt))
+
+        self.log.append((name, old, keys))
+
+        return keys
+
+
+class HeadlessBackend:
+    """
+        Virtual-clock stand-ins for the psychopy modules used by the experiment.
+
+        Arguments:
+            responder (SimulatedResponder): synthetic participant providing keypresses
+            dialog (list): subject number, number of images and presentation time entered in the dialog
+            refresh_rate (float): simulated refresh rate of the monitor in Hz
+            poll_step (float): virtual time in seconds that passes on every keyboard poll
+    """
+
+    def __init__(self, responder=None, dialog=(1, 10, 1.0), refresh_rate=60.0, poll_step=0.0002):
+        self.responder = responder if responder is not None else SimulatedResponder()
+        self.dialog = [str(x) for x in dialog]
+        self.frame_period = 1.0 / refresh_rate
+        self.poll_step = poll_step
+
+        self.now = 0.0
+        self.flips = 0
+        self.pending = []
+        self.showing = None
+
+        self.modules = {name: types.ModuleType('psychopy.' + name) for name in PSYCHOPY_MODULES}
+        self._build()
+
+    def install(self):
+        """
+            Registers the stand-ins as the psychopy package and patches experiment modules
+            that were already imported.
+        """
+        package = types.ModuleType('psychopy')
+        for name, module in self.modules.items():
+            setattr(package, name, module)
+            sys.modules['psychopy.' + name] = module
+        sys.modules['psychopy'] = package
+
+        for mod_name in PATCHED_MODULES:
+            module = sys.modules.get(mod_name)
+            if module is None:
+                continue
+            for name in PSYCHOPY_MODULES:
+                if hasattr(module, name):
+                    setattr(module, name, self.modules[name])
+
+    def _build(self):
+        backend = self
+
+        class Clock:
+            def __init__(self):
+                self.t0 = backend.now
+
+            def getTime(self):
+                return backend.now - self.t0
+
+            def reset(self, newT=0.0):
+                self.t0 = backend.now + newT
+
+        def wait(secs, hogCPUperiod=0.2):
+            backend.now += max(0.0, secs)
+
+        def get_time():
+            return backend.now
+
+        def quit():
+            pass
+
+        class Window:
+            def __init__(self, size=(800, 800), **kwargs):
+                self.size = size
+                self.drawn = []
+
+            def flip(self, clearBuffer=True):
+                backend.now = (math.floor(backend.now / backend.frame_period + 1e-9) + 1) * backend.frame_period
+                backend.flips += 1
+                backend.on_flip(self.drawn)
+                self.drawn = []
+                return backend.now
+
+            def clearBuffer(self, **kwargs):
+                self.drawn = []
+
+            def getActualFrameRate(self, **kwargs):
+                return 1.0 / backend.frame_period
+
+            def close(self):
+                pass
+
+        class ImageStim:
+            def __init__(self, win, image=None, pos=(0, 0), size=None, name=None, **kwargs):
+                self.win = win
+                self.image = image
+                self.pos = pos
+                self.size = size
+                self.name = name
+
+            def draw(self):
+                self.win.drawn.append(self)
+
+        class TextStim:
+            def __init__(self, win, text='', pos=(0, 0), height=None, color=None, **kwargs):
+                self.win = win
+                self.text = text
+                self.pos = pos
+                self.height = height
+                self.color = color
+
+            def draw(self):
+                self.win.drawn.append(self)
+
+        def get_keys(keyList=None, timeStamped=False):
+            due = [(key, t) for key, t in backend.pending if t <= backend.now]
+            if not due:
+                backend.now += backend.poll_step
+                return []
+            backend.pending = [(key, t) for key, t in backend.pending if t > backend.now]
+            if timeStamped:
+                return [(key, t - timeStamped.t0) for key, t in due]
+            return [key for key, t in due]
+
+        def clear_events(eventType=None):
+            backend.pending = []
+
+        def wait_keys(maxWait=float('inf'), keyList=None, **kwargs):
+            backend.now += 0.5
+            return ['space']
+
+        class Dlg:
+            def __init__(self, title='', **kwargs):
+                self.data = []
+
+            def addField(self, label, initial='', **kwargs):
+                pass
+
+            def show(self):
+                self.data = list(backend.dialog)
+                return self.data
+
+        def no_op(*args, **kwargs):
+            pass
+
+        core, visual, event = self.modules['core'], self.modules['visual'], self.modules['event']
+        gui, logging = self.modules['gui'], self.modules['logging']
+
+        core.Clock, core.wait, core.getTime, core.quit = Clock, wait, get_time, quit
+        visual.Window, visual.ImageStim, visual.TextStim = Window, ImageStim, TextStim
+        event.getKeys, event.clearEvents, event.waitKeys = get_keys, clear_events, wait_keys
+        gui.Dlg = Dlg
+        logging.LogFile, logging.data, logging.DATA = no_op, no_op, 25
+
+    def on_flip(self, drawn):
+        images = [stim for stim in drawn if hasattr(stim, 'image')]
+        texts = [stim for stim in drawn if hasattr(stim, 'text')]
+
+        for im in images:
+            # A frame-locked presentation redraws the image on every frame, the participant
+            # only reacts to its onset
+            if im is self.showing:
+                continue
+            if texts:
+                self.pending = [(key, self.now + t) for key, t in self.responder.respond(im.name)]
+            else:
+                self.responder.study(im.name)
+        self.showing = images[0] if images else None
+
+
+# Functions #
+def synthetic_dataset(path, num=200, size=32, seed=0):
+    """
+        Writes a folder of small random JPEG images to use as a simulated stimulus pool.
+
+        Arguments:
+            path (str): absolute path to target folder of dataset
+            num (int): number of images
+            size (int): width and height of each image in pixels
+            seed (int): value for seeding the image contents
+
+        return:
+            path (str): absolute path to target folder of dataset
+    """
+    from PIL import Image
+
+    os.makedirs(path, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    for i in range(num):
+        pixels = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(os.path.join(path, f"{i + 1}.jpg"))
+
+    return path
+
+
+def run_session(dataset_dir, target_dir, seed=1, trials=1, delay=0.5, keys=('a', 'l'), subj=1, num=10, time=1.0,
+                responder=None, answers=('y', 'y'), frame_timing=False, db_path=None, journal=False,
+                cache_dir=None, ingest_url=None, continuous_trials=None, frame_locked=True, profile=False,
+                manifest=False, fmt='csv'):
+    """
+        Runs one full session through ui_main.main on the headless backend, answering the
+        end-of-experiment prompts with answers.
+
+        Arguments:
+            dataset_dir (str): absolute path to parent directory of dataset
+            target_dir (str): target path to save experiment data
+            seed (int): value for seeding to generate random images
+            trials (int): number of trials for the experiment
+            delay (float): delay or interval between images
+            keys (list): valid keyboard keys for old and new
+            subj (int): subject number or id
+            num (int): length of study list (number of images)
+            time (float): time each study image is to be presented
+            responder (SimulatedResponder): synthetic participant, defaults to one using keys
+            answers (list): replies to the "process the results?" and "save results?" prompts
+            frame_timing (bool): true to record frame timing of every trial
+            db_path (str): optional path of a results database to also store the session in
+            journal (bool): true to journal every trial and resume an interrupted session
+            cache_dir (str): optional directory of a cache the scored session is stored in
+            ingest_url (str): optional address of an ingest collector every trial is also sent to
+            continuous_trials (int): length of a continuous-recognition session to run instead of the
+            study and test phases
+            frame_locked (bool): true to count presentation times and delays in frames, false to wait for them
+            profile (bool): true to time the calls of the session and save them to session_profile.json, and
+            the response polling gaps to response_latency.json
+            manifest (bool): true to list the dataset from its manifest
+            fmt (str): file format of the phase data, 'csv' or 'npz'
+
+        return:
+            backend (HeadlessBackend): the backend, holding the virtual time and responder log
+    """
+    if responder is None:
+        responder = SimulatedResponder(valid_keys=keys, seed=subj)
+
+    backend = HeadlessBackend(responder=responder, dialog=(subj, num, time))
+    backend.install()
+
+    import experiment_backend
+    import experiment_results
+    import ui_main
+
+    replies = iter(answers)
+    for module in (experiment_backend, experiment_results):
+        module.input = lambda *args: next(replies)
+
+    try:
+        win = backend.modules['visual'].Window([800, 800])
+        ui_main.main(win, dataset_dir, target_dir, seed, trials, delay, list(keys), frame_timing=frame_timing,
+                     db_path=db_path, journal=journal, cache_dir=cache_dir,
+                     ingest_url=ingest_url, continuous_trials=continuous_trials,
+                     frame_locked=frame_locked, profile=profile, manifest=manifest, fmt=fmt)
+    except SystemExit:
+        pass
+    finally:
+        for module in (experiment_backend, experiment_results):
+            del module.input
+
+    return backend
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Run simulated sessions without a display.")
+    parser.add_argument('dataset', help="dataset directory, filled with synthetic images if empty or missing")
+    parser.add_argument('target', help="directory to save experiment data")
+    parser.add_argument('--subjects', type=int, default=1, help="number of simulated subjects")
+    parser.add_argument('--images', type=int, default=10, help="length of study list")
+    parser.add_argument('--trials', type=int, default=1, help="number of trials per subject")
+    parser.add_argument('--seed', type=int, default=1, help="seed for stimulus sampling")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.dataset) or not os.listdir(args.dataset):
+        synthetic_dataset(args.dataset, num=max(200, args.images * 4))
+
+    for subject in range(args.subjects):
+        session = run_session(args.dataset, args.target, seed=args.seed, trials=args.trials, subj=subject,
+                              num=args.images)
+        print(f"Subject {subject}: {session.flips} flips, {session.now:.1f} s of simulated time")
@@ -0,0 +1,459 @@
+"""
+Collection of trial records from several experiment stations over the lab network.
+
+Each station runs an IngestClient next to its own files: completed trials are appended
+to a local spool file and posted in batches, as JSON over HTTP, to the collector. While
+the collector cannot be reached the client keeps the records in its spool and retries
+with exponential backoff, so the presentation loop never waits on the network and
+records left over when a session ends are sent by the next session on the station.
+Records the collector rejects (a 4xx reply) are never retried: they are moved to a
+dead-letter file next to the spool, so one bad record cannot block the ones after it.
+
+The collector (IngestCollector) accepts batches from any number of stations and writes
+them into one shared ResultsDB from a single writer thread, which stores all batches
+waiting at that moment in one transaction. A batch is acknowledged once committed, and
+stores are idempotent per trial, so a batch sent again after a lost acknowledgement is
+not duplicated. Every client session has its own id, so stations that use the same
+subject ids, or repeat sessions on one station, never overwrite each other's trials.
+Port 0 picks a free port, so both ends run on localhost as well.
+
+- Usage: python ingest_service.py <database> [--host HOST] [--port PORT]
+
+"""
+# Imports #
+import argparse
+import json
+import os
+import queue
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from results_db import ResultsDB
+from trial_writer import _json_default, load_journal
+
+REQUIRED_FIELDS = ('subject', 'date', 'trial', 'phase', 'run', 'data')
+
+_STOP = object()
+
+
+# Classes #
+class IngestClient:
+    """
+        Sends the completed trials of a session to an ingest collector from a background
+        thread. write() only queues the record; the thread spools it to disk and posts the
+        spooled records once batch_size records are waiting or flush_interval seconds have
+        passed, retrying failed posts after 1, 2, 4, ... times flush_interval, up to max_backoff.
+        A batch the collector rejects is split in halves until the rejected records are found,
+        which are appended to dead_letter_path with the reason and not sent again.
+
+        Arguments:
+            url (str): address of the collector, e.g. http://192.168.1.10:8765
+            subj (int): subject number or id
+            spool_path (str): absolute path to spool file, records in it from an earlier session are sent first
+            station (str): name of the station, defaults to the host name
+            seed (int): seed of the image lists, stored with the sessions
+            timing (float): presentation time, stored with the sessions
+            batch_size (int): number of records that triggers a post
+            flush_interval (float): maximum time in seconds a record waits before it is posted
+            timeout (float): timeout in seconds of one post
+            max_backoff (float): maximum time in seconds between retries
+    """
+
+    def __init__(self, url, subj, spool_path, station=None, seed=None, timing=None, batch_size=50,
+                 flush_interval=1.0, timeout=5.0, max_backoff=30.0):
+        self.url = url.rstrip('/') + '/trials'
+        self.spool_path = spool_path
+        self.dead_letter_path = os.path.splitext(spool_path)[0] + '.rejected.jsonl'
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        # The session id keeps the trials of this session apart from those of any other station or
+        # session with the same subject id and date
+        self.context = {'station': station or socket.gethostname(), 'session': uuid.uuid4().hex, 'subject': subj,
+                        'date': str(date.today()), 'started': str(datetime.now()), 'seed': seed, 'timing': timing}
+
+        self.sent = 0
+        self.pending = 0
+        self.rejected = 0
+        self.failures = 0
+        self.last_error = None
+        self.error = None
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='ingest-client', daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, phase, trial, run, data):
+        """
+            Queues the record of a completed trial.
+
+            Arguments:
+                phase (str): 'study_phase' or 'test_phase'
+                trial (int): trial number of experiment
+                run (int): index of the trial within the phase
+                data (dict): column values of the trial
+        """
+        self._queue.put_nowait(dict(self.context, phase=phase, trial=trial, run=run, data=data))
+
+    def close(self):
+        """
+            Makes a last attempt to post the spooled records and stops the thread. Records
+            that could not be delivered stay in the spool.
+
+            return:
+                pending (int): number of records left in the spool
+        """
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+        if self.error is not None:
+            raise self.error
+
+        return self.pending
+
+    def _post(self, batch):
+        # 'sent', 'retry' for network and server errors, or the reason the collector rejected the batch
+        body = json.dumps({'records': batch}, default=_json_default).encode('utf-8')
+        request = urllib.request.Request(self.url, data=body, method='POST',
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                if json.load(response)['stored'] == len(batch):
+                    return 'sent'
+                raise ValueError("Collector did not store the whole batch")
+        except urllib.error.HTTPError as ex:
+            self.failures += 1
+            self.last_error = repr(ex)
+            # Timeouts and rate limits are the only client errors worth sending again
+            if 400 <= ex.code < 500 and ex.code not in (408, 429):
+                try:
+                    return json.load(ex)['error']
+                except (ValueError, KeyError, TypeError):
+                    return repr(ex)
+            return 'retry'
+        except (OSError, ValueError, KeyError) as ex:
+            self.failures += 1
+            self.last_error = repr(ex)
+            return 'retry'
+
+    def _deliver(self, batch):
+        # Number of records from the start of batch that were sent or dead-lettered
+        status = self._post(batch)
+        if status == 'sent':
+            self.sent += len(batch)
+            return len(batch)
+        if status == 'retry':
+            return 0
+        if len(batch) == 1:
+            self._dead_letter(batch[0], status)
+            return 1
+
+        half = len(batch) // 2
+        done = self._deliver(batch[:half])
+        if done < half:
+            return done
+
+        return half + self._deliver(batch[half:])
+
+    def _dead_letter(self, record, reason):
+        with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'error': reason, 'record': record}, default=_json_default) + '\n')
+        self.rejected += 1
+
+    def _flush(self, records):
+        while records:
+            batch = records[:self.batch_size]
+            done = self._deliver(batch)
+            del records[:done]
+            if done < len(batch):
+                break
+
+        return not records
+
+    def _run(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.spool_path)), exist_ok=True)
+        records = load_journal(self.spool_path)
+        f = open(self.spool_path, 'a', encoding='utf-8')
+        backoff = 0.0
+        deadline = time.monotonic() if records else None
+        stopping = False
+
+        try:
+            while not stopping:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+
+                if item is _STOP:
+                    stopping = True
+                elif item is not None:
+                    f.write(json.dumps(item, default=_json_default) + '\n')
+                    f.flush()
+                    records.append(item)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+                self.pending = len(records)
+
+                if records and (stopping or (len(records) >= self.batch_size and not backoff)
+                                or time.monotonic() >= deadline):
+                    spooled = len(records)
+                    if self._flush(records):
+                        f.truncate(0)
+                        backoff = 0.0
+                        deadline = None
+                    else:
+                        # Only the records still waiting are kept in the spool
+                        if len(records) < spooled:
+                            f.truncate(0)
+                            f.writelines(json.dumps(r, default=_json_default) + '\n' for r in records)
+                            f.flush()
+                        backoff = min(self.max_backoff, backoff * 2 or self.flush_interval)
+                        deadline = time.monotonic() + backoff
+                    self.pending = len(records)
+        except Exception as ex:
+            self.error = ex
+        finally:
+            f.close()
+
+
+class _IngestHandler(BaseHTTPRequestHandler):
+    """
+        Request handler of IngestCollector: POST /trials stores a batch, GET /status
+        reports the collector counters.
+    """
+
+    def do_POST(self):
+        if self.path != '/trials':
+            self.send_error(404)
+            return
+
+        try:
+            records = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['records']
+            missing = [field for record in records for field in REQUIRED_FIELDS if field not in record]
+        except (TypeError, ValueError, KeyError) as ex:
+            self._reply(400, {'error': repr(ex)})
+            return
+        if missing:
+            self._reply(400, {'error': f"Records without fields: {sorted(set(missing))}"})
+            return
+
+        try:
+            stored = self.server.collector.submit(records)
+        except ValueError as ex:
+            # A record conflicting with a stored trial, sending it again cannot succeed
+            self._reply(409, {'error': repr(ex)})
+            return
+        except (TypeError, KeyError) as ex:
+            # A record with fields of the wrong type is rejected for good as well
+            self._reply(400, {'error': repr(ex)})
+            return
+        except Exception as ex:
+            self._reply(500, {'error': repr(ex)})
+            return
+
+        self._reply(200, {'stored': stored})
+
+    def do_GET(self):
+        if self.path != '/status':
+            self.send_error(404)
+            return
+
+        self._reply(200, self.server.collector.stats())
+
+    def log_message(self, format, *args):
+        # One line per batch from every station would drown the collector's console
+        pass
+
+    def _reply(self, code, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class IngestCollector:
+    """
+        HTTP collector writing the trial records posted by IngestClients into one ResultsDB.
+        Requests are served on a thread each; a single writer thread owns the database and
+        stores everything queued at once in one transaction, up to max_records records.
+
+        Arguments:
+            db_path (str): absolute path to database file, created if it does not exist
+            host (str): address to listen on, '0.0.0.0' for all interfaces
+            port (int): port to listen on, 0 for any free port
+            max_records (int): maximum number of records stored in one transaction
+    """
+
+    def __init__(self, db_path, host='127.0.0.1', port=8765, max_records=5000):
+        self.db_path = db_path
+        self.max_records = max_records
+
+        self.stored = 0
+        self.batches = 0
+        self.transactions = 0
+
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write, name='ingest-writer', daemon=True)
+        self._writer.start()
+        self._serving = None
+
+        self.server = ThreadingHTTPServer((host, port), _IngestHandler)
+        self.server.daemon_threads = True
+        self.server.collector = self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def url(self):
+        """
+            Address IngestClients post to.
+        """
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """
+            Serves requests from a background thread.
+
+            return:
+                collector (IngestCollector): the collector itself
+        """
+        self._serving = threading.Thread(target=self.server.serve_forever, name='ingest-server', daemon=True)
+        self._serving.start()
+
+        return self
+
+    def serve_forever(self):
+        """
+            Serves requests until interrupted.
+        """
+        self.server.serve_forever()
+
+    def close(self):
+        """
+            Stops serving, stores the batches still queued and closes the database.
+        """
+        if self._serving is not None:
+            self.server.shutdown()
+            self._serving.join()
+            self._serving = None
+        self.server.server_close()
+
+        if self._writer.is_alive():
+            self._queue.put(_STOP)
+            self._writer.join()
+
+    def submit(self, records):
+        """
+            Queues a batch for the writer thread and waits until it is committed.
+
+            Arguments:
+                records (list): trial records, see ResultsDB.add_trials
+
+            return:
+                stored (int): number of records stored
+        """
+        item = {'records': records, 'done': threading.Event(), 'error': None}
+        self._queue.put(item)
+        item['done'].wait()
+
+        if item['error'] is not None:
+            raise item['error']
+
+        return len(records)
+
+    def stats(self):
+        """
+            Counters of the collector.
+
+            return:
+                stats (dict): 'stored' records, 'batches' received and 'transactions' committed
+        """
+        return {'stored': self.stored, 'batches': self.batches, 'transactions': self.transactions}
+
+    def _write(self):
+        db = ResultsDB(self.db_path)
+        stopping = False
+
+        while not stopping:
+            items = [self._queue.get()]
+            if items[0] is _STOP:
+                break
+
+            count = len(items[0]['records'])
+            while count < self.max_records:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                items.append(item)
+                count += len(item['records'])
+
+            # If the combined transaction fails, each batch is stored on its own so one bad
+            # batch does not fail the batches of the other stations
+            if not self._store(db, items) and len(items) > 1:
+                for item in items:
+                    self._store(db, [item])
+            for item in items:
+                item['done'].set()
+
+        db.close()
+
+    def _store(self, db, items):
+        try:
+            db.add_trials([record for item in items for record in item['records']])
+        except Exception as ex:
+            for item in items:
+                item['error'] = ex
+            return False
+
+        for item in items:
+            item['error'] = None
+        self.stored += sum(len(item['records']) for item in items)
+        self.batches += len(items)
+        self.transactions += 1
+
+        return True
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Collect trial records from experiment stations into one database.")
+    parser.add_argument('database', help="path of the SQLite database")
+    parser.add_argument('--host', default='0.0.0.0', help="address to listen on")
+    parser.add_argument('--port', type=int, default=8765, help="port to listen on")
+    args = parser.parse_args()
+
+    collector = IngestCollector(args.database, host=args.host, port=args.port)
+    print(f"Collecting trial records into {args.database} at {collector.url}")
+    try:
+        collector.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        collector.close()
+        print(f"Stored {collector.stored} records from {collector.batches} batches")
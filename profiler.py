@@ -0,0 +1,142 @@
+"""
+Opt-in per-call profiler of a session. The functions of PROFILED_FUNCTIONS are swapped
+for timing wrappers while a session runs and restored afterwards, and the calls are
+summarised per function (count, total, mean, median, 99th percentile and maximum).
+
+- Usage: python ui_main.py --profile (or EXPERIMENT_PROFILE=1), which saves the report to session_profile.json
+- In code: with Profiler() as profiler: ...; profiler.save(path)
+
+"""
+# Imports #
+import importlib
+import json
+import sys
+import time
+from array import array
+import numpy as np
+
+# Functions timed by default, as module and attribute path
+PROFILED_FUNCTIONS = (('experiment_backend', 'image_stim'), ('experiment_backend', 'key_instructions'),
+                      ('experiment_backend', 'display_image'), ('experiment_backend', 'create_directory'),
+                      ('trial_buffer', 'TrialBuffer.record_study'), ('trial_buffer', 'TrialBuffer.record_test'),
+                      ('trial_buffer', 'TrialBuffer.to_df'), ('experiment_results', 'load_data'),
+                      ('experiment_results', 'format_df'), ('experiment_results', 'format_df_vectorized'),
+                      ('experiment_results', 'process_data'))
+
+# Modules that import the profiled functions by name, their references are swapped as well
+PATCHED_MODULES = ('experiment_backend', 'experiment_results', 'ui_main', 'batch_analysis', 'analysis_cache',
+                   'stream_analysis')
+
+
+# Classes #
+class Profiler:
+    """
+        Opt-in per-call timing of the functions of a session. install() swaps each function
+        for a timing wrapper in its module, its class and every module of PATCHED_MODULES
+        that imported it, and uninstall() puts the originals back, so a session that is not
+        profiled runs the unmodified functions with no overhead at all.
+
+        Arguments:
+            functions (list): (module, attribute path) pairs of the functions to time
+    """
+
+    def __init__(self, functions=PROFILED_FUNCTIONS):
+        self.functions = functions
+        self.samples = {}
+        self._patches = []
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *exc):
+        self.uninstall()
+
+    def install(self):
+        """
+            Starts timing every call of the profiled functions.
+
+            return:
+                profiler (Profiler): the profiler itself
+        """
+        for module_name, path in self.functions:
+            owner = importlib.import_module(module_name)
+            *parents, name = path.split('.')
+            for parent in parents:
+                owner = getattr(owner, parent)
+
+            original = vars(owner)[name]
+            wrapper = self._wrap(path, original)
+
+            self._patch(owner, name, original, wrapper)
+            if parents:
+                continue
+            for patched_name in PATCHED_MODULES:
+                module = sys.modules.get(patched_name)
+                if module is not None and module is not owner and vars(module).get(name) is original:
+                    self._patch(module, name, original, wrapper)
+
+        return self
+
+    def uninstall(self):
+        """
+            Restores the original functions.
+        """
+        for owner, name, original in reversed(self._patches):
+            setattr(owner, name, original)
+        self._patches = []
+
+    def report(self):
+        """
+            Summarises the recorded calls.
+
+            return:
+                report (dict): per function, number of calls and total, mean, median, 99th
+                percentile and maximum time in seconds
+        """
+        report = {}
+        for path, samples in self.samples.items():
+            if not samples:
+                continue
+            values = np.frombuffer(samples, dtype=float)
+            p50, p99 = np.percentile(values, [50, 99])
+            report[path] = {'count': len(values), 'total': float(values.sum()), 'mean': float(values.mean()),
+                            'p50': float(p50), 'p99': float(p99), 'max': float(values.max())}
+
+        return report
+
+    def save(self, path):
+        """
+            Stores the report as JSON.
+
+            Arguments:
+                path (str): absolute path to JSON file
+
+            return:
+                path (str): absolute path to JSON file
+        """
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+        return path
+
+    def _wrap(self, path, func):
+        samples = self.samples.setdefault(path, array('d'))
+        append = samples.append
+        clock = time.perf_counter
+
+        def timed(*args, **kwargs):
+            t0 = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                append(clock() - t0)
+
+        timed.__wrapped__ = func
+        timed.__name__ = func.__name__
+        timed.__doc__ = func.__doc__
+
+        return timed
+
+    def _patch(self, owner, name, original, wrapper):
+        setattr(owner, name, wrapper)
+        self._patches.append((owner, name, original))
@@ -0,0 +1,90 @@
+# Imports #
+import json
+from psychopy import core, event
+
+
+# Classes #
+class ResponseCollector:
+    """
+        Collects keyboard responses until a deadline without pinning a CPU core.
+
+        Far from the deadline the loop sleeps for poll_interval between polls; within
+        spin_window of the deadline it spins so the deadline itself is met precisely.
+        Every keypress is returned with its timestamp, including several arriving in one poll.
+
+        Arguments:
+            poll_interval (float): time in seconds slept between polls outside the spin window
+            spin_window (float): time in seconds before the deadline during which the loop spins
+    """
+
+    def __init__(self, poll_interval=0.001, spin_window=0.002):
+        self.poll_interval = poll_interval
+        self.spin_window = spin_window
+
+        self.polls = 0
+        self.total_gap = 0.0
+        self.max_gap = 0.0
+
+    def collect(self, clock, deadline, stop_keys=None):
+        """
+            Polls the keyboard until the deadline or until one of stop_keys is pressed.
+
+            Arguments:
+                clock: psychopy clock the deadline and timestamps refer to
+                deadline (float): clock time in seconds to stop polling at
+                stop_keys (list): keys that end collection early
+
+            return:
+                keys (list): (key, timestamp) pairs in the order they were pressed
+        """
+        keys = []
+        last = clock.getTime()
+
+        while True:
+            polled = event.getKeys(timeStamped=clock)
+            now = clock.getTime()
+
+            self.polls += 1
+            self.total_gap += now - last
+            self.max_gap = max(self.max_gap, now - last)
+            last = now
+
+            if polled:
+                keys.extend(polled)
+                if stop_keys and any(key in stop_keys for key, key_time in polled):
+                    break
+
+            if now >= deadline:
+                break
+
+            remaining = deadline - now
+            if remaining > self.spin_window:
+                core.wait(min(self.poll_interval, remaining - self.spin_window), hogCPUperiod=0)
+
+        return keys
+
+    def latency(self):
+        """
+            Reports the measured polling latency, i.e. how stale a keypress timestamp can be.
+
+            return:
+                latency (dict): number of polls, mean and maximum time in seconds between polls
+        """
+        return {'polls': self.polls,
+                'mean_gap': self.total_gap / self.polls if self.polls else 0.0,
+                'max_gap': self.max_gap}
+
+    def save_latency(self, path):
+        """
+            Stores the polling latency of the session as JSON.
+
+            Arguments:
+                path (str): absolute path to JSON file
+
+            return:
+                path (str): absolute path to JSON file
+        """
+        with open(path, 'w') as f:
+            json.dump(self.latency(), f, indent=2)
+
+        return path
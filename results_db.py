@@ -0,0 +1,446 @@
+"""
+Embedded SQLite store for experiment data and results.
+
+Sessions (one phase of one trial of one subject on one day), their trials and the
+individual keyboard responses are kept in normalized tables indexed on subject, date
+and image, so cohort questions such as "all sessions of subject X last month" are
+answered with one indexed query instead of walking the directory tree.
+
+- Usage: python results_db.py <database> [--subject ID] [--since YYYY-MM-DD] [--until YYYY-MM-DD] [--responses]
+
+"""
+# Imports #
+import argparse
+import os
+import sqlite3
+from datetime import date, datetime
+from itertools import zip_longest
+import numpy as np
+import pandas as pd
+
+# source tells apart sessions of the same subject, date, trial and phase: '' for sessions stored
+# from files, the session id of the IngestClient for streamed ones
+SESSIONS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    subject TEXT NOT NULL,
+    date TEXT NOT NULL,
+    trial INTEGER NOT NULL,
+    phase TEXT NOT NULL,
+    started TEXT,
+    seed INTEGER,
+    exposure REAL,
+    valid_keys TEXT,
+    path TEXT,
+    station TEXT,
+    source TEXT NOT NULL DEFAULT '',
+    UNIQUE (subject, date, trial, phase, source)
+);
+"""
+
+SCHEMA = SESSIONS_SCHEMA + """
+CREATE TABLE IF NOT EXISTS trials (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    image TEXT,
+    start REAL,
+    end REAL,
+    delay REAL,
+    num_responses INTEGER,
+    old INTEGER,
+    lag INTEGER
+);
+CREATE TABLE IF NOT EXISTS responses (
+    id INTEGER PRIMARY KEY,
+    trial_id INTEGER NOT NULL REFERENCES trials (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    response TEXT,
+    rt REAL,
+    valid TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    subject TEXT NOT NULL,
+    trial INTEGER,
+    hit_ratio REAL,
+    false_alarm_ratio REAL,
+    avg_rt REAL,
+    created TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_subject_date ON sessions (subject, date);
+CREATE INDEX IF NOT EXISTS sessions_date ON sessions (date);
+CREATE INDEX IF NOT EXISTS trials_session ON trials (session_id, position);
+CREATE INDEX IF NOT EXISTS trials_image ON trials (image);
+CREATE INDEX IF NOT EXISTS responses_trial ON responses (trial_id, position);
+CREATE INDEX IF NOT EXISTS results_subject ON results (subject, created);
+"""
+
+RESULT_COLUMNS = ["Subject ID", 'Trial', 'Hit Ratio', 'False Alarm Ratio', 'Average RT (sec)']
+
+
+# Functions #
+def _value(x, kind=float):
+    """
+        Converts a dataframe cell to a value SQLite can store, None for missing cells.
+
+        Arguments:
+            x: dataframe cell
+            kind (type): python type to convert to
+
+        return:
+            value: converted value or None
+    """
+    if x is None or (np.isscalar(x) and pd.isna(x)):
+        return None
+
+    return kind(x)
+
+
+def _where(subject=None, since=None, until=None, phase=None, image=None):
+    """
+        Builds the WHERE clause shared by the session queries.
+
+        Arguments:
+            subject (int): subject number or id
+            since (str or date): first date to include, YYYY-MM-DD
+            until (str or date): last date to include, YYYY-MM-DD
+            phase (str): 'study_phase' or 'test_phase'
+            image (str): image name
+
+        return:
+            clause (str): WHERE clause, empty if there is no condition
+            params (list): query parameters
+    """
+    conditions = []
+    params = []
+    for column, op, value in (('s.subject', '=', subject), ('s.date', '>=', since), ('s.date', '<=', until),
+                              ('s.phase', '=', phase), ('t.image', '=', image)):
+        if value is not None:
+            conditions.append(f"{column} {op} ?")
+            params.append(str(value))
+
+    return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+
+# Classes #
+class ResultsDB:
+    """
+        SQLite store of sessions, trials, responses and processed results.
+
+        Arguments:
+            path (str): absolute path to database file, created if it does not exist
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+            Closes the database connection.
+        """
+        self.conn.close()
+
+    def _migrate(self):
+        # Trials of databases created before continuous-recognition sessions were stored get their
+        # 'Old' and 'Lag' columns, empty for study and test trials
+        trial_columns = [row[1] for row in self.conn.execute("PRAGMA table_info(trials)")]
+        with self.conn:
+            for column in ('old', 'lag'):
+                if column not in trial_columns:
+                    self.conn.execute(f"ALTER TABLE trials ADD COLUMN {column} INTEGER")
+
+        # Databases created before sessions had a source are rebuilt with the wider unique key.
+        # SQLite cannot change a constraint in place, so the table is copied, with foreign keys
+        # off so dropping the old table does not cascade to the trials
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(sessions)")]
+        if 'source' in columns:
+            return
+
+        self.conn.execute("PRAGMA foreign_keys = OFF")
+        try:
+            with self.conn:
+                self.conn.execute(SESSIONS_SCHEMA.replace('sessions', 'sessions_new', 1))
+                self.conn.execute(f"INSERT INTO sessions_new ({', '.join(columns)}) "
+                                  f"SELECT {', '.join(columns)} FROM sessions")
+                self.conn.execute("DROP TABLE sessions")
+                self.conn.execute("ALTER TABLE sessions_new RENAME TO sessions")
+        finally:
+            self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.executescript(SCHEMA)
+
+    def add_session(self, name, df, subj, trial, day=None, path=None):
+        """
+            Stores the dataframe of one phase of a trial, replacing a previous copy of the
+            same session. All rows are inserted in one transaction.
+
+            Arguments:
+                name (str): phase name, 'study_phase', 'test_phase' or 'continuous_phase'
+                df (pandas dataframe): dataframe as filled by study_phase or test_phase, or as read back
+                from the CSV file of continuous_phase
+                subj (int): subject number or id
+                trial (int): trial number of experiment
+                day (str or date): date of the session, defaults to today
+                path (str): path of the file the session was also written to
+
+            return:
+                session_id (int): id of the session row
+        """
+        day = str(day or date.today())
+        first = df.iloc[0] if len(df) else pd.Series(dtype=object)
+        valid_keys = first.get('Valid Keys')
+
+        session = (str(subj), day, int(trial), name, _value(first.get('Date'), str), _value(first.get('Seed'), int),
+                   _value(first.get('Exp. Timing')), ",".join(valid_keys) if isinstance(valid_keys, list) else None,
+                   path)
+
+        columns = {col: df[col].tolist() if col in df else [None] * len(df)
+                   for col in ('Image', 'Start', 'End', 'Delay', 'Number of Responses', 'Responses', 'Reaction Time',
+                               'Valid Response', 'Old', 'Lag')}
+
+        with self.conn:
+            self.conn.execute("DELETE FROM sessions WHERE subject = ? AND date = ? AND trial = ? AND phase = ? "
+                              "AND source = ''", session[:4])
+            session_id = self.conn.execute(
+                "INSERT INTO sessions (subject, date, trial, phase, started, seed, exposure, valid_keys, path) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", session).lastrowid
+
+            # Trial ids are assigned here so responses can reference them without a query per trial
+            base = self.conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM trials").fetchone()[0]
+            self.conn.executemany(
+                "INSERT INTO trials (id, session_id, position, image, start, end, delay, num_responses, old, lag) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(base + i, session_id, i, _value(columns['Image'][i], str), _value(columns['Start'][i]),
+                  _value(columns['End'][i]), _value(columns['Delay'][i]),
+                  _value(columns['Number of Responses'][i], int), _value(columns['Old'][i], int),
+                  _value(columns['Lag'][i], int)) for i in range(len(df))])
+
+            rows = []
+            for i, (resp, rt, valid) in enumerate(zip(columns['Responses'], columns['Reaction Time'],
+                                                      columns['Valid Response'])):
+                if not isinstance(resp, list):
+                    continue
+                for j, (r, t, v) in enumerate(zip_longest(resp, rt or [], valid or [])):
+                    rows.append((base + i, j, _value(r, str), _value(t), _value(v, str)))
+            self.conn.executemany("INSERT INTO responses (trial_id, position, response, rt, valid) "
+                                  "VALUES (?, ?, ?, ?, ?)", rows)
+
+        return session_id
+
+    def add_trials(self, records):
+        """
+            Stores single trials streamed from experiment stations, all in one transaction.
+            Sessions are kept apart by the session id of the sending client, so stations using
+            the same subject id, or two sessions of a subject on one day, never share rows. A
+            trial already stored at its position is skipped if it shows the same image, so a
+            batch sent again after a failed acknowledgement is not stored twice. Otherwise the
+            record conflicts with the stored trial, ValueError is raised and nothing of the
+            batch is stored.
+
+            Arguments:
+                records (list): trial records with 'subject', 'date', 'trial', 'phase', 'run' and
+                'data' (the column values of TrialBuffer.row), and optionally 'session' (the id of
+                the sending session), 'started', 'seed', 'timing' and 'station'
+
+            return:
+                stored (int): number of trials stored or found already stored
+        """
+        sessions = {}
+        with self.conn:
+            for record in records:
+                data = record['data']
+                session = (str(record['subject']), str(record['date']), int(record['trial']), record['phase'],
+                           str(record.get('session') or record.get('station') or ''))
+
+                if session not in sessions:
+                    row = self.conn.execute("SELECT id FROM sessions WHERE subject = ? AND date = ? AND trial = ? "
+                                            "AND phase = ? AND source = ?", session).fetchone()
+                    if row is None:
+                        valid_keys = data.get('Valid Keys')
+                        row = (self.conn.execute(
+                            "INSERT INTO sessions (subject, date, trial, phase, source, started, seed, exposure, "
+                            "valid_keys, station) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            session + (_value(record.get('started'), str), _value(record.get('seed'), int),
+                                       _value(record.get('timing')),
+                                       ",".join(valid_keys) if isinstance(valid_keys, list) else None,
+                                       _value(record.get('station'), str))).lastrowid,)
+                    sessions[session] = row[0]
+                session_id = sessions[session]
+
+                stored = self.conn.execute("SELECT image FROM trials WHERE session_id = ? AND position = ?",
+                                           (session_id, int(record['run']))).fetchone()
+                if stored is not None:
+                    if stored[0] == _value(data.get('Image'), str):
+                        continue
+                    raise ValueError(f"Trial {record['run']} of {record['phase']} {record['trial']} of subject "
+                                     f"{record['subject']} is already stored with image {stored[0]}")
+                trial_id = self.conn.execute(
+                    "INSERT INTO trials (session_id, position, image, start, end, delay, num_responses, old, lag) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (session_id, int(record['run']), _value(data.get('Image'), str), _value(data.get('Start')),
+                     _value(data.get('End')), _value(data.get('Delay')),
+                     _value(data.get('Number of Responses'), int), _value(data.get('Old'), int),
+                     _value(data.get('Lag'), int))).lastrowid
+
+                resp = data.get('Responses')
+                if isinstance(resp, list):
+                    self.conn.executemany(
+                        "INSERT INTO responses (trial_id, position, response, rt, valid) VALUES (?, ?, ?, ?, ?)",
+                        [(trial_id, j, _value(r, str), _value(t), _value(v, str))
+                         for j, (r, t, v) in enumerate(zip_longest(resp, data.get('Reaction Time') or [],
+                                                                   data.get('Valid Response') or []))])
+
+        return len(records)
+
+    def add_results(self, data):
+        """
+            Stores the processed results of a trial.
+
+            Arguments:
+                data (list): subject, trial, hit ratio, false alarm ratio and average RT
+
+            return:
+                result_id (int): id of the results row
+        """
+        subj, trial, hit_ratio, false_alarm_ratio, rt_avg = data
+        with self.conn:
+            return self.conn.execute(
+                "INSERT INTO results (subject, trial, hit_ratio, false_alarm_ratio, avg_rt, created) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (str(subj), _value(trial, int), _value(hit_ratio), _value(false_alarm_ratio), _value(rt_avg),
+                 str(datetime.now()))).lastrowid
+
+    def sessions(self, subject=None, since=None, until=None, phase=None):
+        """
+            Lists stored sessions.
+
+            Arguments:
+                subject (int): subject number or id
+                since (str or date): first date to include, YYYY-MM-DD
+                until (str or date): last date to include, YYYY-MM-DD
+                phase (str): 'study_phase' or 'test_phase'
+
+            return:
+                df (pandas dataframe): one row per session with its number of trials
+        """
+        where, params = _where(subject, since, until, phase)
+        query = ("SELECT s.*, (SELECT COUNT(*) FROM trials t WHERE t.session_id = s.id) AS trials "
+                 "FROM sessions s" + where + " ORDER BY s.subject, s.date, s.trial, s.phase")
+
+        return pd.read_sql_query(query, self.conn, params=params)
+
+    def responses(self, subject=None, since=None, until=None, phase='test_phase', image=None):
+        """
+            Lists stored responses with their trial and session, one row per keypress.
+
+            Arguments:
+                subject (int): subject number or id
+                since (str or date): first date to include, YYYY-MM-DD
+                until (str or date): last date to include, YYYY-MM-DD
+                phase (str): 'study_phase' or 'test_phase'
+                image (str): image name
+
+            return:
+                df (pandas dataframe): one row per response
+        """
+        where, params = _where(subject, since, until, phase, image)
+        query = ("SELECT s.id AS session_id, s.subject, s.date, s.trial, s.phase, t.position AS trial_position, "
+                 "t.image, t.num_responses, r.position AS response_position, r.response, r.rt, r.valid "
+                 "FROM sessions s JOIN trials t ON t.session_id = s.id JOIN responses r ON r.trial_id = t.id"
+                 + where + " ORDER BY s.id, t.position, r.position")
+
+        return pd.read_sql_query(query, self.conn, params=params)
+
+    def results(self, subject=None):
+        """
+            Lists stored processed results.
+
+            Arguments:
+                subject (int): subject number or id
+
+            return:
+                df (pandas dataframe): results in the columns written by store_results, plus the time stored
+        """
+        query = ("SELECT subject, trial, hit_ratio, false_alarm_ratio, avg_rt, created FROM results"
+                 + (" WHERE subject = ?" if subject is not None else "") + " ORDER BY created")
+        df = pd.read_sql_query(query, self.conn, params=[str(subject)] if subject is not None else [])
+        df.columns = RESULT_COLUMNS + ['Created']
+
+        return df
+
+    def session_df(self, session_id):
+        """
+            Rebuilds the dataframe of a stored session in the layout of create_df, so it can be
+            passed to output_results like a loaded CSV.
+
+            Arguments:
+                session_id (int): id of the session row
+
+            return:
+                df (pandas dataframe): session data with list columns for the responses
+        """
+        session = self.conn.execute("SELECT subject, phase, started, seed, exposure, valid_keys FROM sessions "
+                                    "WHERE id = ?", (session_id,)).fetchone()
+        if session is None:
+            raise KeyError(f"No session with id {session_id}")
+        subject, phase, started, seed, exposure, valid_keys = session
+
+        trials = pd.read_sql_query("SELECT id, position, image, start, end, delay, num_responses, old, lag FROM trials "
+                                   "WHERE session_id = ? ORDER BY position", self.conn, params=[session_id])
+
+        if phase not in ('test_phase', 'continuous_phase'):
+            return pd.DataFrame({'Subject ID': subject, 'Date': started, 'Seed': seed,
+                                 'Valid Keys': [valid_keys.split(",") if valid_keys else None] * len(trials),
+                                 'Image': trials['image'], 'Start': trials['start'], 'End': trials['end'],
+                                 'Exp. Timing': exposure, 'Delay': trials['delay']})
+
+        responses = pd.read_sql_query("SELECT r.trial_id, r.response, r.rt, r.valid FROM responses r "
+                                      "JOIN trials t ON r.trial_id = t.id WHERE t.session_id = ? "
+                                      "ORDER BY t.position, r.position", self.conn, params=[session_id])
+        grouped = responses.groupby('trial_id')
+
+        def cells(column):
+            lists = grouped[column].agg(list)
+            return [lists.get(trial_id, []) for trial_id in trials['id']]
+
+        df = pd.DataFrame({'Subject ID': subject, 'Date': started, 'Image': trials['image'],
+                           'Reaction Time': cells('rt'), 'Responses': cells('response'),
+                           'Number of Responses': trials['num_responses'], 'Valid Response': cells('valid')})
+        if phase == 'continuous_phase':
+            df.insert(2, 'Position', trials['position'])
+            df.insert(4, 'Old', trials['old'].astype(bool))
+            df.insert(5, 'Lag', trials['lag'])
+
+        return df
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Query the experiment results database.")
+    parser.add_argument('database', help="path of the SQLite database")
+    parser.add_argument('--subject', help="subject number or id")
+    parser.add_argument('--since', help="first date to include, YYYY-MM-DD")
+    parser.add_argument('--until', help="last date to include, YYYY-MM-DD")
+    parser.add_argument('--responses', action='store_true', help="list responses instead of sessions")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        parser.error(f"Database does not exist: {args.database}")
+
+    with ResultsDB(args.database) as db:
+        if args.responses:
+            print(db.responses(args.subject, args.since, args.until).to_string(index=False))
+        else:
+            print(db.sessions(args.subject, args.since, args.until).to_string(index=False))
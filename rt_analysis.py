@@ -0,0 +1,321 @@
+"""
+Reaction time distribution analysis over a whole cohort at once.
+
+Works on the exploded format_df table: every valid response is labelled with its
+condition (hit, false alarm, correct rejection or miss) and grouped by subject and
+condition. Quantiles and MAD-based outlier trimming are computed for all groups in
+single sorted passes, and the ex-Gaussian maximum likelihood fits of all groups are
+solved together with batched damped Newton steps.
+
+- Usage: python rt_analysis.py <root> [--output FILE] [--trim K]
+
+"""
+# Imports #
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+CONDITIONS = {'Hits': 'hit', 'False Alarms': 'false alarm', 'New to New': 'correct rejection',
+              'New to Old': 'miss'}
+DEFAULT_QUANTILES = (0.1, 0.3, 0.5, 0.7, 0.9)
+MAD_SCALE = 1.4826
+
+
+# Functions #
+def rt_table(f_df, by=None):
+    """
+        Collects the valid reaction times of format_df output with their condition.
+
+        Arguments:
+            f_df (pandas dataframe): dataframe returned by format_df or format_df_vectorized
+            by (str, list or pandas series): grouping column(s) or keys, e.g. 'Subject ID'
+
+        return:
+            rts (pandas dataframe): grouping key(s), 'Condition' and 'RT' for every valid response
+    """
+    condition = pd.Series(pd.NA, index=f_df.index, dtype=object)
+    for col, name in CONDITIONS.items():
+        condition[f_df[col].to_numpy() == 1] = name
+
+    if by is None:
+        keys = pd.DataFrame({'Group': 'All'}, index=f_df.index)
+    elif isinstance(by, (str, list)):
+        keys = f_df[[by] if isinstance(by, str) else by]
+    else:
+        keys = pd.DataFrame({by.name or 'Group': by.to_numpy()}, index=f_df.index)
+
+    rts = keys.assign(Condition=condition, RT=pd.to_numeric(f_df['Valid RT'], errors='coerce'))
+
+    return rts[rts['Condition'].notna() & (rts['RT'] > 0)].reset_index(drop=True)
+
+
+def group_quantiles(values, codes, n_groups, quantiles):
+    """
+        Computes quantiles of every group with one sort, interpolating linearly like np.quantile.
+
+        Arguments:
+            values (numpy array): observations
+            codes (numpy array): group index of every observation, 0 to n_groups - 1
+            n_groups (int): number of groups
+            quantiles (list): probabilities in [0, 1]
+
+        return:
+            q (numpy array): n_groups x len(quantiles) quantiles, NaN for empty groups
+    """
+    counts = np.bincount(codes, minlength=n_groups)
+    q = np.full((n_groups, len(quantiles)), np.nan)
+    if len(values) == 0:
+        return q
+
+    sorted_values = values[np.lexsort((values, codes))]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    filled = counts > 0
+
+    pos = np.asarray(quantiles)[None, :] * (counts[filled, None] - 1)
+    low = np.floor(pos).astype(np.int64)
+    high = np.minimum(low + 1, counts[filled, None] - 1)
+    low_values = sorted_values[starts[filled, None] + low]
+    high_values = sorted_values[starts[filled, None] + high]
+    q[filled] = low_values + (pos - low) * (high_values - low_values)
+
+    return q
+
+
+def mad_trim(values, codes, n_groups, k=3.0):
+    """
+        Flags observations within k scaled median absolute deviations of their group median.
+
+        Arguments:
+            values (numpy array): observations
+            codes (numpy array): group index of every observation, 0 to n_groups - 1
+            n_groups (int): number of groups
+            k (float): cut-off in scaled MADs (MAD x 1.4826, the normal-consistent scale)
+
+        return:
+            keep (numpy array): true for observations that are not outliers
+    """
+    median = group_quantiles(values, codes, n_groups, [0.5])[:, 0]
+    deviation = np.abs(values - median[codes])
+    mad = group_quantiles(deviation, codes, n_groups, [0.5])[:, 0] * MAD_SCALE
+
+    # A group with MAD 0 keeps only the values at its median
+    return deviation <= k * mad[codes]
+
+
+def exgauss_start(values, codes, n_groups):
+    """
+        Method-of-moments starting values of the ex-Gaussian parameters of every group.
+
+        Arguments:
+            values (numpy array): observations
+            codes (numpy array): group index of every observation, 0 to n_groups - 1
+            n_groups (int): number of groups
+
+        return:
+            mu (numpy array): mean of the normal component
+            sigma (numpy array): standard deviation of the normal component
+            tau (numpy array): mean of the exponential component
+    """
+    n = np.bincount(codes, minlength=n_groups).astype(float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.bincount(codes, values, n_groups) / n
+        d = values - mean[codes]
+        var = np.bincount(codes, d * d, n_groups) / n
+        skew = np.bincount(codes, d ** 3, n_groups) / n / var ** 1.5
+
+    sd = np.sqrt(var)
+    tau = sd * np.cbrt(np.clip(skew, 0.05, 1.9) / 2)
+    sigma = np.sqrt(np.maximum(var - tau * tau, (0.1 * sd) ** 2))
+
+    return mean - tau, sigma, tau
+
+
+def exgauss_terms(values, codes, n_groups, params):
+    """
+        Ex-Gaussian log-likelihood of every group and its gradient with respect to
+        (mu, log sigma, log tau), summed over each group's observations in one pass.
+
+        Arguments:
+            values (numpy array): observations
+            codes (numpy array): group index of every observation, 0 to n_groups - 1
+            n_groups (int): number of groups
+            params (numpy array): n_groups x 3 array of mu, log sigma and log tau
+
+        return:
+            loglik (numpy array): log-likelihood per group
+            grad (numpy array): n_groups x 3 gradient per group
+    """
+    from scipy.special import log_ndtr
+
+    mu, sigma, tau = params[codes, 0], np.exp(params[codes, 1]), np.exp(params[codes, 2])
+
+    z = (values - mu) / sigma - sigma / tau
+    log_cdf = log_ndtr(z)
+    # Mills ratio phi(z) / Phi(z), computed in log space so it stays finite in the far tail
+    ratio = np.exp(-0.5 * z * z - 0.5 * np.log(2 * np.pi) - log_cdf)
+    s2t2 = sigma * sigma / (tau * tau)
+
+    loglik = -np.log(tau) + (mu - values) / tau + s2t2 / 2 + log_cdf
+    d_mu = 1 / tau - ratio / sigma
+    d_log_sigma = s2t2 - ratio * ((values - mu) / sigma + sigma / tau)
+    d_log_tau = -1 - (mu - values) / tau - s2t2 + ratio * sigma / tau
+
+    grad = np.stack([np.bincount(codes, d, n_groups) for d in (d_mu, d_log_sigma, d_log_tau)], axis=1)
+
+    return np.bincount(codes, loglik, n_groups), grad
+
+
+def fit_exgauss(values, codes, n_groups, max_iter=100, tol=1e-10, gtol=1e-6, step=1e-6):
+    """
+        Fits the ex-Gaussian distribution to every group by maximum likelihood with damped
+        Newton (Levenberg-Marquardt) steps taken for all groups at once. Each iteration
+        evaluates the analytic gradients of every observation in a few vectorized passes,
+        builds each group's 3 x 3 Hessian from them by finite differences and solves all
+        Newton systems in one batched call; a group whose likelihood does not improve
+        keeps its parameters and raises its damping. Sigma and tau are fitted on the log
+        scale, between 0.001 and 10 times the group's standard deviation.
+
+        A group has converged once a step improves its log-likelihood by less than tol
+        relative to it, its gradient per observation falls below gtol, or no step improves
+        it at any damping. Groups whose likelihood peaks on a bound (a normal or exponential
+        component that vanishes, mostly in small groups) or that are not finite get NaN
+        parameters and converged false.
+
+        Arguments:
+            values (numpy array): observations
+            codes (numpy array): group index of every observation, 0 to n_groups - 1
+            n_groups (int): number of groups
+            max_iter (int): maximum number of iterations
+            tol (float): convergence tolerance on the relative log-likelihood improvement of a step
+            gtol (float): convergence tolerance on the per-observation gradient of a group
+            step (float): finite-difference step for the Hessian
+
+        return:
+            fit (pandas dataframe): 'mu', 'sigma', 'tau', 'loglik', 'iterations' and 'converged' per group
+    """
+    n = np.bincount(codes, minlength=n_groups).astype(float)
+    mu0, sigma0, tau0 = exgauss_start(values, codes, n_groups)
+    active = (n > 0) & np.isfinite(mu0) & (sigma0 > 0) & (tau0 > 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sd = np.sqrt(sigma0 * sigma0 + tau0 * tau0)
+        lower, upper = np.log(1e-3 * sd), np.log(10 * sd)
+
+    params = np.column_stack([mu0, np.log(sigma0), np.log(tau0)])
+    params[~active] = 0.0
+    loglik, grad = exgauss_terms(values, codes, n_groups, params)
+    damping = np.full(n_groups, 1e-3)
+    iterations = np.zeros(n_groups, dtype=np.int64)
+    done = active & (np.abs(grad).max(axis=1) / np.maximum(n, 1) < gtol)
+    eye = np.eye(3)
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        for i in range(max_iter):
+            todo = active & ~done
+            if not todo.any():
+                break
+
+            # Only the observations of groups still being fitted are evaluated
+            sub = todo[codes]
+            sub_values, sub_codes = values[sub], codes[sub]
+
+            hessian = np.empty((n_groups, 3, 3))
+            for j in range(3):
+                shifted = params.copy()
+                shifted[:, j] += step
+                hessian[:, :, j] = (exgauss_terms(sub_values, sub_codes, n_groups, shifted)[1] - grad) / step
+            curvature = -(hessian + hessian.transpose(0, 2, 1)) / 2
+
+            system = curvature + (damping * n)[:, None, None] * eye
+            system[~todo] = eye
+            delta = np.linalg.solve(system, np.where(todo[:, None], grad, 0.0)[:, :, None])[:, :, 0]
+
+            trial = params + delta
+            trial[:, 1:] = np.clip(trial[:, 1:], lower[:, None], upper[:, None])
+            trial_loglik, trial_grad = exgauss_terms(sub_values, sub_codes, n_groups, trial)
+            better = todo & np.isfinite(trial_loglik) & (trial_loglik >= loglik)
+            change = trial_loglik - loglik
+
+            params[better], loglik[better], grad[better] = trial[better], trial_loglik[better], trial_grad[better]
+            damping = np.where(better, np.maximum(damping / 3, 1e-9), np.where(todo, damping * 4, damping))
+            iterations += todo
+
+            # Tested on the state after the update, so the flag always describes the returned parameters
+            done |= todo & ((better & (change <= tol * (1 + np.abs(loglik))))
+                            | (np.abs(grad).max(axis=1) / n < gtol) | (damping > 1e12))
+
+    on_bound = ((params[:, 1:] <= lower[:, None] + 1e-6) | (params[:, 1:] >= upper[:, None] - 1e-6)).any(axis=1)
+    failed = active & (on_bound | ~np.isfinite(params).all(axis=1) | ~np.isfinite(loglik))
+
+    fit = pd.DataFrame({'mu': params[:, 0], 'sigma': np.exp(params[:, 1]), 'tau': np.exp(params[:, 2]),
+                        'loglik': loglik, 'iterations': iterations, 'converged': done & ~failed})
+    fit.loc[~active, ['mu', 'sigma', 'tau', 'loglik']] = np.nan
+    fit.loc[failed, ['mu', 'sigma', 'tau']] = np.nan
+
+    return fit
+
+
+def rt_summary(f_df, by=None, quantiles=DEFAULT_QUANTILES, trim=3.0, fit=True, min_fit=10):
+    """
+        Summarises reaction times per group and condition: counts, MAD trimming, mean, SD,
+        quantiles and ex-Gaussian parameters, all computed for the whole cohort at once.
+
+        Arguments:
+            f_df (pandas dataframe): dataframe returned by format_df or format_df_vectorized
+            by (str, list or pandas series): grouping column(s) or keys, e.g. 'Subject ID'
+            quantiles (list): probabilities of the reported quantiles
+            trim (float): MAD cut-off for outliers, None to keep every response
+            fit (bool): true to fit the ex-Gaussian distribution
+            min_fit (int): minimum number of responses kept for a group to be fitted
+
+        return:
+            summary (pandas dataframe): one row per group and condition
+    """
+    rts = rt_table(f_df, by=by)
+    key_columns = [col for col in rts.columns if col != 'RT']
+    codes, groups = pd.MultiIndex.from_frame(rts[key_columns]).factorize()
+    n_groups = len(groups)
+    values = rts['RT'].to_numpy(dtype=float)
+
+    total = np.bincount(codes, minlength=n_groups)
+    if trim is not None:
+        keep = mad_trim(values, codes, n_groups, trim)
+        values, codes = values[keep], codes[keep]
+    n = np.bincount(codes, minlength=n_groups)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.bincount(codes, values, n_groups) / n
+        sd = np.sqrt(np.bincount(codes, (values - mean[codes]) ** 2, n_groups) / (n - 1))
+
+    summary = pd.DataFrame({'N': total, 'N Trimmed': total - n, 'Mean RT': mean, 'SD RT': sd},
+                           index=pd.MultiIndex.from_tuples(groups, names=key_columns))
+    q = group_quantiles(values, codes, n_groups, quantiles)
+    for i, p in enumerate(quantiles):
+        summary[f"Q{p:g}"] = q[:, i]
+
+    if fit:
+        enough = (n >= min_fit)[codes]
+        params = fit_exgauss(values[enough], codes[enough], n_groups)
+        summary['Mu'], summary['Sigma'], summary['Tau'] = (params[col].to_numpy() for col in ('mu', 'sigma', 'tau'))
+        summary['Log Likelihood'] = params['loglik'].to_numpy()
+        summary['Converged'] = params['converged'].to_numpy()
+
+    return summary.sort_index()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Summarise reaction time distributions of every subject.")
+    parser.add_argument('root', help="directory experiment data was saved to")
+    parser.add_argument('--output', help="path of the summary CSV (default: <root>/rt_results.csv)")
+    parser.add_argument('--trim', type=float, default=3.0, help="MAD cut-off for outliers")
+    args = parser.parse_args()
+
+    from analysis import session_frames
+
+    out = args.output or os.path.join(args.root, 'rt_results.csv')
+    table = rt_summary(session_frames(args.root), by='Subject ID', trim=args.trim)
+    table.to_csv(out)
+    print(table.to_string())
+    print(f"Reaction time summary saved to: {out}")
@@ -0,0 +1,249 @@
+# Imports #
+import warnings
+import numpy as np
+import pandas as pd
+
+COUNT_COLUMNS = ['Hits', 'Misses', 'False Alarms', 'Correct Rejections']
+
+
+# Functions #
+def norm_ppf(p):
+    """
+        Inverse of the standard normal CDF, vectorized (scipy.special.ndtri).
+
+        Arguments:
+            p (numpy array): probabilities
+
+        return:
+            z (numpy array): z scores, -inf/inf at 0/1 and NaN outside [0, 1]
+    """
+    from scipy.special import ndtri
+
+    return ndtri(np.asarray(p, dtype=float))
+
+
+def corrected_rates(hits, misses, false_alarms, correct_rejections, correction='loglinear'):
+    """
+        Computes hit and false alarm rates with an extreme-rate correction.
+
+        Arguments:
+            hits (numpy array): number of "old" responses to old images
+            misses (numpy array): number of "new" responses to old images
+            false_alarms (numpy array): number of "old" responses to new images
+            correct_rejections (numpy array): number of "new" responses to new images
+            correction (str): 'loglinear' (add 0.5 to counts and 1 to totals), 'macmillan'
+            (replace rates of 0 and 1 with 1/(2N) and 1 - 1/(2N)) or None
+
+        return:
+            hit_rate (numpy array): corrected hit rate, NaN without old responses
+            false_alarm_rate (numpy array): corrected false alarm rate, NaN without new responses
+    """
+    hits, misses, false_alarms, correct_rejections = (np.asarray(x, dtype=float) for x in
+                                                      (hits, misses, false_alarms, correct_rejections))
+    n_old = hits + misses
+    n_new = false_alarms + correct_rejections
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if correction == 'loglinear':
+            hit_rate = (hits + 0.5) / (n_old + 1)
+            false_alarm_rate = (false_alarms + 0.5) / (n_new + 1)
+        else:
+            hit_rate = hits / n_old
+            false_alarm_rate = false_alarms / n_new
+            if correction == 'macmillan':
+                hit_rate = np.clip(hit_rate, 0.5 / n_old, 1 - 0.5 / n_old)
+                false_alarm_rate = np.clip(false_alarm_rate, 0.5 / n_new, 1 - 0.5 / n_new)
+            elif correction is not None:
+                raise ValueError(f"Unknown rate correction: {correction}")
+
+    hit_rate = np.where(n_old > 0, hit_rate, np.nan)
+    false_alarm_rate = np.where(n_new > 0, false_alarm_rate, np.nan)
+
+    return hit_rate, false_alarm_rate
+
+
+def sdt_measures(hits, misses, false_alarms, correct_rejections, correction='loglinear'):
+    """
+        Computes d', criterion c and A' from response counts.
+
+        Arguments:
+            hits (numpy array): number of "old" responses to old images
+            misses (numpy array): number of "new" responses to old images
+            false_alarms (numpy array): number of "old" responses to new images
+            correct_rejections (numpy array): number of "new" responses to new images
+            correction (str): extreme-rate correction applied before d' and c, see corrected_rates
+
+        return:
+            d_prime (numpy array): sensitivity z(H) - z(F)
+            criterion (numpy array): bias -(z(H) + z(F)) / 2
+            a_prime (numpy array): nonparametric sensitivity from the uncorrected rates
+    """
+    hit_rate, false_alarm_rate = corrected_rates(hits, misses, false_alarms, correct_rejections, correction)
+    z_hit = norm_ppf(hit_rate)
+    z_fa = norm_ppf(false_alarm_rate)
+
+    h, f = corrected_rates(hits, misses, false_alarms, correct_rejections, correction=None)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        above = 0.5 + ((h - f) * (1 + h - f)) / (4 * h * (1 - f))
+        below = 0.5 - ((f - h) * (1 + f - h)) / (4 * f * (1 - h))
+    a_prime = np.where(h == f, 0.5, np.where(h > f, above, below))
+    a_prime = np.where(np.isnan(h) | np.isnan(f), np.nan, a_prime)
+
+    return z_hit - z_fa, -(z_hit + z_fa) / 2, a_prime
+
+
+def response_counts(f_df, by=None):
+    """
+        Counts hits, misses, false alarms and correct rejections in format_df output.
+
+        Arguments:
+            f_df (pandas dataframe): dataframe returned by format_df or format_df_vectorized
+            by (str, list or pandas series): grouping column(s) or keys, e.g. 'Subject ID';
+            everything is one group if not given
+
+        return:
+            counts (pandas dataframe): one row per group with the four response counts
+    """
+    scores = pd.DataFrame({'Hits': f_df['Hits'] == 1,
+                           'Misses': f_df['New to Old'] == 1,
+                           'False Alarms': f_df['False Alarms'] == 1,
+                           'Correct Rejections': f_df['New to New'] == 1}, index=f_df.index)
+
+    if by is None:
+        return scores.sum().to_frame('All').T
+
+    if isinstance(by, str):
+        keys = f_df[by]
+    elif isinstance(by, list):
+        keys = [f_df[col] for col in by]
+    else:
+        keys = by
+    return scores.groupby(keys).sum()
+
+
+def bootstrap_measures(counts, n_boot=10000, ci=0.95, correction='loglinear', seed=None, chunk=1000):
+    """
+        Bootstraps confidence intervals of d', c and A' for every row of a count matrix at once.
+        Resampling the trials of a subject with replacement gives binomial hit and false
+        alarm counts, so all subjects and resamples are drawn in one vectorized call per chunk.
+
+        Arguments:
+            counts (pandas dataframe): response counts as returned by response_counts
+            n_boot (int): number of bootstrap resamples
+            ci (float): confidence level of the intervals
+            correction (str): extreme-rate correction, see corrected_rates
+            seed (int): value for seeding the resampling
+            chunk (int): number of resamples drawn at once, bounds memory use
+
+        return:
+            samples (dict): subjects x n_boot float32 arrays of d', c and A' resamples
+            intervals (pandas dataframe): lower and upper bounds per row and measure
+    """
+    rng = np.random.default_rng(seed)
+    hits, misses, false_alarms, correct_rejections = (counts[col].to_numpy(dtype=float) for col in COUNT_COLUMNS)
+    n_old = (hits + misses).astype(np.int64)
+    n_new = (false_alarms + correct_rejections).astype(np.int64)
+    h, f = corrected_rates(hits, misses, false_alarms, correct_rejections, correction=None)
+
+    samples = {name: np.empty((len(counts), n_boot), dtype=np.float32) for name in ("d'", 'c', "A'")}
+
+    for start in range(0, n_boot, chunk):
+        size = min(chunk, n_boot - start)
+        boot_hits = rng.binomial(n_old[:, None], np.nan_to_num(h)[:, None], (len(counts), size))
+        boot_fas = rng.binomial(n_new[:, None], np.nan_to_num(f)[:, None], (len(counts), size))
+        measures = sdt_measures(boot_hits, n_old[:, None] - boot_hits, boot_fas, n_new[:, None] - boot_fas,
+                                correction)
+        for name, values in zip(("d'", 'c', "A'"), measures):
+            samples[name][:, start:start + size] = values
+
+    tail = (1 - ci) / 2 * 100
+    intervals = {}
+    for name, values in samples.items():
+        # nanpercentile is much slower, so it only handles rows with undefined resamples
+        low, high = np.percentile(values, [tail, 100 - tail], axis=1)
+        undefined = np.isnan(values).any(axis=1)
+        if undefined.any():
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                low[undefined], high[undefined] = np.nanpercentile(values[undefined], [tail, 100 - tail], axis=1)
+        intervals[name + ' Low'] = low
+        intervals[name + ' High'] = high
+
+    return samples, pd.DataFrame(intervals, index=counts.index)
+
+
+def group_bootstrap(values, n_boot=10000, ci=0.95, seed=None):
+    """
+        Bootstraps the confidence interval of a group mean by resampling subjects, with all
+        resamples drawn as one index matrix.
+
+        Arguments:
+            values (numpy array): one value per subject, e.g. d'
+            n_boot (int): number of bootstrap resamples
+            ci (float): confidence level of the interval
+            seed (int): value for seeding the resampling
+
+        return:
+            mean (float): group mean, NaN if no value is defined
+            low (float): lower bound of the interval, NaN without resamples
+            high (float): upper bound of the interval, NaN without resamples
+    """
+    rng = np.random.default_rng(seed)
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return np.nan, np.nan, np.nan
+    if not n_boot:
+        return float(values.mean()), np.nan, np.nan
+
+    means = values[rng.integers(0, len(values), (n_boot, len(values)))].mean(axis=1)
+    tail = (1 - ci) / 2 * 100
+    low, high = np.percentile(means, [tail, 100 - tail])
+
+    return float(values.mean()), float(low), float(high)
+
+
+def sdt_table(f_df, by=None, n_boot=10000, ci=0.95, correction='loglinear', seed=None, group=False):
+    """
+        Computes signal-detection metrics with bootstrap confidence intervals per group.
+        With group, a last 'Group' row holds the total counts, the mean rates and measures
+        over the groups and intervals of the mean d', c and A' from group_bootstrap.
+
+        Arguments:
+            f_df (pandas dataframe): dataframe returned by format_df or format_df_vectorized
+            by (str, list or pandas series): grouping column(s) or keys, e.g. 'Subject ID'
+            n_boot (int): number of bootstrap resamples, 0 to skip the intervals
+            ci (float): confidence level of the intervals
+            correction (str): extreme-rate correction, see corrected_rates
+            seed (int): value for seeding the resampling
+            group (bool): true to add the 'Group' row
+
+        return:
+            table (pandas dataframe): counts, corrected rates, d', c, A' and their intervals per group
+    """
+    table = response_counts(f_df, by=by)
+    counts = [table[col].to_numpy() for col in COUNT_COLUMNS]
+
+    table['Hit Rate'], table['False Alarm Rate'] = corrected_rates(*counts, correction=correction)
+    table["d'"], table['c'], table["A'"] = sdt_measures(*counts, correction=correction)
+
+    if n_boot:
+        samples, intervals = bootstrap_measures(table, n_boot=n_boot, ci=ci, correction=correction, seed=seed)
+        table = table.join(intervals)
+
+    if group:
+        row = {col: table[col].sum() for col in COUNT_COLUMNS}
+        for col in ('Hit Rate', 'False Alarm Rate'):
+            row[col] = table[col].mean() if table[col].notna().any() else np.nan
+        for name in ("d'", 'c', "A'"):
+            # The same seed resamples the same subjects for every measure
+            mean, low, high = group_bootstrap(table[name].to_numpy(), n_boot=n_boot, ci=ci, seed=seed)
+            row[name] = mean
+            if n_boot:
+                row[name + ' Low'], row[name + ' High'] = low, high
+
+        label = 'Group' if table.index.nlevels == 1 else ('Group',) + ('',) * (table.index.nlevels - 1)
+        table.loc[label, list(row)] = list(row.values())
+        table[COUNT_COLUMNS] = table[COUNT_COLUMNS].astype(np.int64)
+
+    return table
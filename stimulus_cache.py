@@ -0,0 +1,203 @@
+# Imports #
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from psychopy import visual
+
+
+# Functions #
+def decode_image(path, store=None):
+    """
+        Decodes an image file into memory so no file access or JPEG decoding is
+        left for the moment the stimulus is built.
+
+        Arguments:
+            path (str): path of image
+            store (TextureStore): optional store of pre-resized pixels, used instead of decoding
+
+        return:
+            im (PIL image): fully decoded image
+    """
+    if store is not None and path in store:
+        return store.image(path)
+
+    im = Image.open(path)
+    im.load()
+
+    return im
+
+
+# Classes #
+class StimulusCache:
+    """
+        Bounded LRU cache of image stimuli for the study and test phases.
+
+        Images can be decoded up front with preload() or fetched ahead of time on a
+        background thread with prefetch() while the current image is on screen. Only
+        the decoding runs in the background; psychopy stimuli (and their OpenGL
+        textures) are always created on the calling thread.
+
+        Arguments:
+            win: psychopy window object
+            max_size (int): maximum number of decoded images and stimuli kept in memory
+            prefetch (int): number of upcoming images to decode in the background
+            reuse (bool): true to keep a single ImageStim and swap its image each trial
+            size (float): size of the image stimulus
+            pos (list): position of the image stimulus
+            store (TextureStore): optional store of pre-resized pixels, used instead of decoding
+    """
+
+    def __init__(self, win, max_size=256, prefetch=5, reuse=False, size=0.3, pos=(0, 0), store=None):
+        self.win = win
+        self.max_size = max_size
+        self.prefetch_n = prefetch
+        self.reuse = reuse
+        self.size = size
+        self.pos = pos
+        self.store = store
+
+        self.hits = 0
+        self.misses = 0
+
+        self._decoded = OrderedDict()
+        self._stims = OrderedDict()
+        self._pending = {}
+        self._stim = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def get(self, path):
+        """
+            Returns the image stimulus for a path, building it only if it is not cached.
+
+            Arguments:
+                path (str): path of image
+
+            return:
+                im: psychopy visual image object
+        """
+        name = str(os.path.basename(path))
+
+        if self.reuse:
+            pixels = self._pixels(path)
+            if self._stim is None:
+                self._stim = visual.ImageStim(self.win, pixels, pos=self.pos, size=self.size, name=name)
+            else:
+                self._stim.image = pixels
+                self._stim.name = name
+            return self._stim
+
+        if path in self._stims:
+            self.hits += 1
+            self._stims.move_to_end(path)
+            return self._stims[path]
+
+        im = visual.ImageStim(self.win, self._pixels(path), pos=self.pos, size=self.size, name=name)
+        self._stims[path] = im
+        with self._lock:
+            self._decoded.pop(path, None)
+        if len(self._stims) > self.max_size:
+            self._stims.popitem(last=False)
+
+        return im
+
+    def preload(self, paths):
+        """
+            Decodes (and, unless reusing a single stimulus, builds) every image up front.
+            Raises ValueError if there are more distinct images than the cache holds, as
+            the images past max_size would silently be decoded during the session again.
+
+            Arguments:
+                paths (list): paths of images, e.g. the study and test lists
+
+            return:
+                None: images are stored in the cache
+        """
+        paths = list(OrderedDict.fromkeys(paths))
+        if len(paths) > self.max_size:
+            raise ValueError(f"Cannot preload {len(paths)} images into a cache of {self.max_size}")
+
+        for path in paths:
+            if self.reuse:
+                self._store(path, decode_image(path, store=self.store))
+            elif path not in self._stims:
+                name = str(os.path.basename(path))
+                self._stims[path] = visual.ImageStim(self.win, decode_image(path, store=self.store), pos=self.pos,
+                                                     size=self.size, name=name)
+
+    def prefetch(self, paths, index):
+        """
+            Decodes the images following position index on a background thread.
+
+            Arguments:
+                paths (list): paths of images in presentation order
+                index (int): position of the image currently being presented
+
+            return:
+                None: decoded images are stored in the cache as they complete
+        """
+        for path in paths[index + 1:index + 1 + self.prefetch_n]:
+            with self._lock:
+                if path in self._stims or path in self._decoded or path in self._pending:
+                    continue
+                self._pending[path] = self._executor.submit(self._fetch, path)
+
+    def stats(self):
+        """
+            Reports cache hit/miss counters.
+
+            return:
+                stats (dict): hits, misses, hit rate and number of cached items
+        """
+        total = self.hits + self.misses
+
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'stimuli': len(self._stims),
+                'decoded': len(self._decoded)}
+
+    def close(self):
+        """
+            Stops the background thread and releases cached images.
+        """
+        self._executor.shutdown(wait=True)
+        self._decoded.clear()
+        self._stims.clear()
+        self._pending.clear()
+
+    def _pixels(self, path):
+        with self._lock:
+            if path in self._decoded:
+                self.hits += 1
+                self._decoded.move_to_end(path)
+                return self._decoded[path]
+            future = self._pending.get(path)
+
+        if future is not None:
+            # Already being decoded in the background, waiting is still cheaper than starting over
+            self.hits += 1
+            return future.result()
+
+        self.misses += 1
+        im = decode_image(path, store=self.store)
+        self._store(path, im)
+
+        return im
+
+    def _fetch(self, path):
+        im = decode_image(path, store=self.store)
+        self._store(path, im)
+        with self._lock:
+            self._pending.pop(path, None)
+
+        return im
+
+    def _store(self, path, im):
+        with self._lock:
+            self._decoded[path] = im
+            self._decoded.move_to_end(path)
+            if len(self._decoded) > self.max_size:
+                self._decoded.popitem(last=False)
@@ -0,0 +1,123 @@
+# Imports #
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Functions #
+def subject_rng(seed, subj):
+    """
+        Creates the random generator of one subject. Streams are derived from a
+        SeedSequence with the subject number as spawn key, so they are independent of
+        each other and identical to the children of SeedSequence(seed).spawn().
+
+        Arguments:
+            seed (int): value for seeding to generate random images
+            subj (int): subject number or id
+
+        return:
+            rng (numpy Generator): random generator for the subject
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(subj,)))
+
+
+def index_dtype(size):
+    """
+        Picks the smallest unsigned integer type able to index an image list.
+
+        Arguments:
+            size (int): number of images in overall dataset
+
+        return:
+            dtype (numpy dtype): integer type of image indices
+    """
+    return np.min_scalar_type(max(size - 1, 0))
+
+
+def sample_indices(rng, num, size):
+    """
+        Draws the study list and the lures without replacement in one call and shuffles
+        them into the test list.
+
+        Arguments:
+            rng (numpy Generator): random generator of the subject
+            num (int): length of study list (number of images)
+            size (int): number of images in overall dataset
+
+        return:
+            study_idx (numpy array): indices into the image list for the study set
+            test_idx (numpy array): indices into the image list for the test set
+    """
+    if 2 * num > size:
+        raise ValueError(f"Dataset of {size} images is too small for {num} study images and {num} lures")
+
+    picks = rng.choice(size, 2 * num, replace=False).astype(index_dtype(size))
+
+    return picks[:num], rng.permutation(picks)
+
+
+def subject_lists(seed, num, size, subj, counterbalance=False):
+    """
+        Generates the study and test lists of one subject. When counterbalancing, each
+        odd-numbered subject studies the lures of the preceding even-numbered subject and
+        gets that subject's study images as lures, so every image is old and new equally often.
+
+        Arguments:
+            seed (int): value for seeding to generate random images
+            num (int): length of study list (number of images)
+            size (int): number of images in overall dataset
+            subj (int): subject number or id
+            counterbalance (bool): true to swap old and new images between subject pairs
+
+        return:
+            study_idx (numpy array): indices into the image list for the study set
+            test_idx (numpy array): indices into the image list for the test set
+    """
+    rng = subject_rng(seed, subj)
+
+    if counterbalance and subj % 2 == 1:
+        partner_study, partner_test = sample_indices(subject_rng(seed, subj - 1), num, size)
+        lures = np.setdiff1d(partner_test, partner_study, assume_unique=True)
+        study_idx = rng.permutation(lures)
+        return study_idx, rng.permutation(np.concatenate([study_idx, partner_study]))
+
+    return sample_indices(rng, num, size)
+
+
+def generate_cohort(seed, num, size, subjects, counterbalance=False, workers=None):
+    """
+        Pre-generates study and test lists for many subjects in parallel. Results depend
+        only on seed and subject numbers, not on the number of workers.
+
+        Arguments:
+            seed (int): value for seeding to generate random images
+            num (int): length of study list (number of images)
+            size (int): number of images in overall dataset
+            subjects (int or list): number of subjects, or the subject numbers to generate
+            counterbalance (bool): true to swap old and new images between subject pairs
+            workers (int): number of worker processes, defaults to the number of CPUs
+
+        return:
+            study (numpy array): subjects x num image indices of study sets
+            test (numpy array): subjects x 2*num image indices of test sets
+    """
+    if isinstance(subjects, int):
+        subjects = range(subjects)
+    subjects = list(subjects)
+
+    chunk = max(1, len(subjects) // 64)
+    chunks = [subjects[i:i + chunk] for i in range(0, len(subjects), chunk)]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parts = list(pool.map(_cohort_chunk, [(seed, num, size, c, counterbalance) for c in chunks]))
+
+    study = np.concatenate([p[0] for p in parts]) if parts else np.empty((0, num), dtype=index_dtype(size))
+    test = np.concatenate([p[1] for p in parts]) if parts else np.empty((0, 2 * num), dtype=index_dtype(size))
+
+    return study, test
+
+
+def _cohort_chunk(args):
+    seed, num, size, subjects, counterbalance = args
+    lists = [subject_lists(seed, num, size, subj, counterbalance) for subj in subjects]
+
+    return np.stack([s for s, t in lists]), np.stack([t for s, t in lists])
@@ -0,0 +1,183 @@
+"""
+Bounded-memory scoring of large test phase exports.
+
+The CSV is read in chunks. Each chunk is scored with format_df_vectorized and folded
+into running per-subject totals of hits, false alarms, correct rejections, misses and
+valid reaction time count, sum and sum of squares. Memory stays at one chunk plus
+one row of totals per subject, whatever the size of the file. The metrics are those
+of process_data, with NaN instead of a division error for subjects without old or
+new responses.
+
+- Usage: python stream_analysis.py <test_phase.csv> <study_phase.csv> [--chunksize N] [--output FILE]
+
+"""
+# Imports #
+import argparse
+import math
+from ast import literal_eval
+from experiment_results import *
+
+AGGREGATE_COLUMNS = ['Hits', 'False Alarms', 'New to New', 'New to Old', 'RT Count', 'RT Sum', 'RT Sum Sq']
+COUNT_COLUMNS = ['Hits', 'False Alarms', 'New to New', 'New to Old', 'RT Count']
+
+
+# Functions #
+def read_chunks(path, chunksize=100000, usecols=None):
+    """
+        Reads a CSV written by create_directory in chunks, parsing list cells like load_data.
+
+        Arguments:
+            path (str): absolute path to CSV file
+            chunksize (int): number of rows per chunk
+            usecols (list): optional names of the columns to read, the index is then skipped
+
+        return:
+            chunks (iterator): dataframes of at most chunksize rows
+    """
+    converters = {"Responses": literal_eval, "Reaction Time": literal_eval, 'Valid Response': literal_eval}
+    index_col = 0
+    if usecols is not None:
+        converters = {col: f for col, f in converters.items() if col in usecols}
+        index_col = None
+
+    return pd.read_csv(path, encoding='iso-8859-1', header='infer', index_col=index_col, chunksize=chunksize,
+                       usecols=usecols, converters=converters)
+
+
+def study_lists(path, chunksize=100000):
+    """
+        Collects the study images of every subject in a study phase CSV.
+
+        Arguments:
+            path (str): absolute path to study phase CSV file
+            chunksize (int): number of rows per chunk
+
+        return:
+            img_lists (dict): subject id mapped to the list of its study images
+    """
+    img_lists = {}
+    for chunk in read_chunks(path, chunksize, usecols=['Subject ID', 'Image']):
+        for subj, images in chunk.dropna(subset=['Image']).groupby('Subject ID')['Image']:
+            img_lists.setdefault(subj, []).extend(images.tolist())
+
+    return img_lists
+
+
+def chunk_aggregates(chunk, img_list):
+    """
+        Scores one chunk of test phase rows and sums the scores per subject.
+
+        Arguments:
+            chunk (pandas dataframe): test phase rows
+            img_list (list or dict): study images, or subject id mapped to that subject's study images
+
+        return:
+            totals (pandas dataframe): one row per subject in the chunk with the AGGREGATE_COLUMNS sums
+    """
+    # Positional index, so exploded rows map back to their subject even if exports were concatenated
+    chunk = chunk.reset_index(drop=True)
+    if isinstance(img_list, dict):
+        f_df = pd.concat([format_df_vectorized(group, img_list.get(subj, []))
+                          for subj, group in chunk.groupby('Subject ID')])
+    else:
+        f_df = format_df_vectorized(chunk, img_list)
+
+    if 'Subject ID' in chunk:
+        keys = chunk['Subject ID'].to_numpy()[f_df.index.to_numpy()]
+    else:
+        keys = np.repeat('All', len(f_df))
+
+    rt = f_df['Valid RT'].to_numpy(dtype=float)
+    valid_rt = ~np.isnan(rt)
+    rt = np.where(valid_rt, rt, 0.0)
+
+    scores = pd.DataFrame({'Hits': f_df['Hits'].to_numpy() == 1,
+                           'False Alarms': f_df['False Alarms'].to_numpy() == 1,
+                           'New to New': f_df['New to New'].to_numpy() == 1,
+                           'New to Old': f_df['New to Old'].to_numpy() == 1,
+                           'RT Count': valid_rt, 'RT Sum': rt, 'RT Sum Sq': rt * rt})
+
+    return scores.groupby(keys).sum()
+
+
+def stream_aggregates(path, img_list, chunksize=100000):
+    """
+        Folds every chunk of a test phase CSV into running per-subject totals.
+
+        Arguments:
+            path (str): absolute path to test phase CSV file
+            img_list (list or dict): study images, or subject id mapped to that subject's study images
+            chunksize (int): number of rows per chunk
+
+        return:
+            totals (pandas dataframe): one row per subject with the AGGREGATE_COLUMNS sums
+    """
+    totals = pd.DataFrame(columns=AGGREGATE_COLUMNS, dtype=float)
+    for chunk in read_chunks(path, chunksize):
+        totals = totals.add(chunk_aggregates(chunk, img_list), fill_value=0)
+
+    totals[COUNT_COLUMNS] = totals[COUNT_COLUMNS].astype(np.int64)
+    totals.index.name = 'Subject ID'
+
+    return totals
+
+
+def aggregate_metrics(totals):
+    """
+        Computes the process_data metrics, plus the reaction time standard deviation, from
+        running totals, for every subject and for all subjects pooled.
+
+        Arguments:
+            totals (pandas dataframe): totals returned by stream_aggregates
+
+        return:
+            metrics (pandas dataframe): hit ratio, false alarm ratio, average RT and RT SD per
+            subject, with the pooled metrics in the last row 'All'
+    """
+    totals = pd.concat([totals, totals.sum().to_frame('All').T])
+
+    rows = []
+    for row in totals[AGGREGATE_COLUMNS].itertuples(index=False):
+        hits, false_alarms, new_to_new, new_to_old, rt_count, rt_sum, rt_sum_sq = row
+        old_items = hits + new_to_old
+        new_items = false_alarms + new_to_new
+        # Python's round, as in process_data, so the ratios match it exactly
+        hit_rate = round(hits / old_items, 2) if old_items else np.nan
+        false_alarm_rate = round(false_alarms / new_items, 2) if new_items else np.nan
+        avg_rt = round(rt_sum / rt_count, 4) if rt_count else np.nan
+        rt_sd = math.sqrt(max(0.0, (rt_sum_sq - rt_sum * rt_sum / rt_count) / (rt_count - 1))) \
+            if rt_count > 1 else np.nan
+        rows.append((hit_rate, false_alarm_rate, avg_rt, rt_sd))
+
+    return pd.DataFrame(rows, index=totals.index,
+                        columns=['Hit Ratio', 'False Alarm Ratio', 'Average RT (sec)', 'RT SD (sec)'])
+
+
+def stream_results(path, img_list, chunksize=100000):
+    """
+        Scores a test phase CSV of any size in bounded memory.
+
+        Arguments:
+            path (str): absolute path to test phase CSV file
+            img_list (list or dict): study images, or subject id mapped to that subject's study images
+            chunksize (int): number of rows per chunk
+
+        return:
+            metrics (pandas dataframe): per-subject and pooled metrics, see aggregate_metrics
+    """
+    return aggregate_metrics(stream_aggregates(path, img_list, chunksize))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Score a large test phase export in bounded memory.")
+    parser.add_argument('test', help="test phase CSV")
+    parser.add_argument('study', help="study phase CSV with the study images of every subject")
+    parser.add_argument('--chunksize', type=int, default=100000, help="rows read per chunk")
+    parser.add_argument('--output', help="path of the metrics CSV")
+    args = parser.parse_args()
+
+    metrics = stream_results(args.test, study_lists(args.study, args.chunksize), args.chunksize)
+    print(metrics.to_string())
+    if args.output:
+        metrics.to_csv(args.output)
@@ -0,0 +1,18 @@
+# Imports #
+import os
+import sys
+import pytest
+
+# The modules of the experiment live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from headless import HeadlessBackend, synthetic_dataset
+
+# Modules importing psychopy get the virtual-clock stand-ins
+HeadlessBackend().install()
+
+
+# Fixtures #
+@pytest.fixture(scope='session')
+def dataset(tmp_path_factory):
+    return synthetic_dataset(str(tmp_path_factory.mktemp('dataset')), num=60, size=16)
@@ -0,0 +1,88 @@
+# Imports #
+import glob
+import os
+import pandas as pd
+import pytest
+from headless import run_session
+from continuous_recognition import DEFAULT_LAGS, continuous_schedule, new_images_needed
+
+
+# Functions #
+@pytest.mark.parametrize('p_repeat', [0.0, 0.5, 1.0])
+def test_schedule_invariants(p_repeat):
+    schedule = list(continuous_schedule(3, 2000, 1500, subj=2, p_repeat=p_repeat))
+
+    assert [p.position for p in schedule] == list(range(1500))
+
+    first_shown = {}
+    for p in schedule:
+        if p.old:
+            assert p.lag in DEFAULT_LAGS
+            # An old image is the new image shown exactly lag trials before, and comes back only once
+            assert first_shown.pop(p.image) == p.position - p.lag
+        else:
+            assert p.lag is None
+            assert p.image not in first_shown
+            first_shown[p.image] = p.position
+
+    news = [p.image for p in schedule if not p.old]
+    assert len(set(news)) == len(news)
+    if p_repeat == 0.0:
+        assert len(news) == 1500
+
+
+def test_schedule_is_reproducible():
+    first = list(continuous_schedule(3, 500, 400, subj=2))
+
+    assert list(continuous_schedule(3, 500, 400, subj=2)) == first
+    assert list(continuous_schedule(3, 500, 400, subj=3)) != first
+
+
+def test_schedule_weights_and_endless_stream():
+    stream = continuous_schedule(1, 10000, None, lags=(2, 5), weights=(1, 0))
+
+    assert {p.lag for _, p in zip(range(2000), stream) if p.old} == {2}
+
+
+def test_new_images_needed_bounds_schedule():
+    for size in (450, 600, 1000):
+        needed = new_images_needed(7, size, 600, subj=1)
+        news = sum(not p.old for p in continuous_schedule(7, size, 600, subj=1))
+
+        assert news <= needed <= size
+
+
+def test_new_images_needed_dataset_too_small():
+    with pytest.raises(ValueError):
+        new_images_needed(7, 10, 100)
+
+
+def test_schedule_rejects_zero_lag():
+    with pytest.raises(ValueError):
+        next(continuous_schedule(1, 10, 10, lags=(0, 1)))
+
+
+def test_interrupted_session_resumes(dataset, tmp_path):
+    full_dir, resumed_dir = str(tmp_path / 'full'), str(tmp_path / 'resumed')
+    full = run_session(dataset, full_dir, journal=True, continuous_trials=30)
+
+    # The journal of a session interrupted after its session header and first 12 trials
+    retired = glob.glob(os.path.join(full_dir, '**', 'trial_journal.jsonl.done'), recursive=True)[0]
+    journal = os.path.join(resumed_dir, os.path.relpath(retired, full_dir))[:-len('.done')]
+    os.makedirs(os.path.dirname(journal))
+    with open(retired, encoding='utf-8') as f, open(journal, 'w', encoding='utf-8') as out:
+        out.writelines(f.readlines()[:13])
+
+    resumed = run_session(dataset, resumed_dir, journal=True, continuous_trials=30)
+
+    assert resumed.flips < full.flips
+    columns = ['Position', 'Image', 'Old', 'Lag']
+    expected, result = (pd.read_csv(glob.glob(os.path.join(path, '**', 'continuous_phase.csv'), recursive=True)[0])
+                        for path in (full_dir, resumed_dir))
+    pd.testing.assert_frame_equal(result[columns], expected[columns])
+    assert result['Date'].iloc[0] == expected['Date'].iloc[0]
+
+
+def test_session_runs_a_single_trial(dataset, tmp_path):
+    with pytest.raises(ValueError):
+        run_session(dataset, str(tmp_path), trials=2, continuous_trials=10)
@@ -0,0 +1,66 @@
+# Imports #
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataset_manifest import MANIFEST_NAME, build_manifest, load_manifest
+from headless import run_session, synthetic_dataset
+
+
+# Functions #
+def nested_dataset(path):
+    synthetic_dataset(path, num=4, size=8)
+    synthetic_dataset(os.path.join(path, 'nested'), num=2, size=8)
+
+    return path
+
+
+def mark_invalid(manifest_path, rel_path):
+    # Flags an unchanged image as broken in the stored manifest, which a reused entry keeps
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    for entry in manifest['images']:
+        if entry['path'] == rel_path:
+            entry['valid'] = False
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+
+
+def test_manifest_lists_nested_images(tmp_path):
+    root = nested_dataset(str(tmp_path / 'dataset'))
+
+    assert len(build_manifest(root, recursive=True)) == 6
+    assert len(build_manifest(root, recursive=False)) == 4
+
+
+def test_manifest_of_other_listing_is_rebuilt(tmp_path):
+    root = nested_dataset(str(tmp_path / 'dataset'))
+    manifest_path = os.path.join(root, MANIFEST_NAME)
+
+    build_manifest(root, recursive=True)
+    mark_invalid(manifest_path, '1.jpg')
+    assert load_manifest(manifest_path, recursive=False) == {}
+    assert not {e['path']: e for e in build_manifest(root, recursive=True)}['1.jpg']['valid']
+
+    mark_invalid(manifest_path, '1.jpg')
+    assert {e['path']: e for e in build_manifest(root, recursive=False)}['1.jpg']['valid']
+    assert load_manifest(manifest_path, recursive=False).keys() == {'1.jpg', '2.jpg', '3.jpg', '4.jpg'}
+
+
+def test_concurrent_builds_leave_one_manifest(tmp_path):
+    root = synthetic_dataset(str(tmp_path / 'dataset'), num=20, size=8)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda _: build_manifest(root, workers=2), range(16)))
+
+    assert len(load_manifest(os.path.join(root, MANIFEST_NAME))) == 20
+    assert [name for name in os.listdir(root) if name.endswith('.tmp')] == []
+
+
+def test_session_writes_manifest_only_when_asked(tmp_path):
+    root = synthetic_dataset(str(tmp_path / 'dataset'), num=60, size=16)
+
+    run_session(root, str(tmp_path / 'plain'))
+    assert not os.path.exists(os.path.join(root, MANIFEST_NAME))
+
+    run_session(root, str(tmp_path / 'manifest'), manifest=True)
+    assert len(load_manifest(os.path.join(root, MANIFEST_NAME))) == 60
@@ -0,0 +1,76 @@
+# Imports #
+import glob
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from experiment_results import (_flatten, _pad_empty, event_metrics, event_table, format_df_vectorized, load_data,
+                                load_npz_events, process_data, save_npz)
+from headless import run_session
+
+STUDY = ['/dataset/1.jpg', '/dataset/2.jpg', '/dataset/3.jpg']
+
+
+# Functions #
+def session(subj=1):
+    # Test trials with several keypresses, invalid keys and a trial without a response
+    return pd.DataFrame({'Subject ID': subj,
+                         'Image': ['1.jpg', '4.jpg', '2.jpg', '5.jpg', '3.jpg', '6.jpg', '1.jpg', '4.jpg'],
+                         'Reaction Time': [[0.51], [0.42, 0.6], [-1], [0.38], [0.7], [0.33, 0.9], [0.45], [0.5]],
+                         'Responses': [['old'], ['x', 'new'], ['None'], ['old'], ['new'], ['old', 'new'], ['old'],
+                                       ['new']],
+                         'Valid Response': [['Yes'], ['No', 'Yes'], ['No'], ['Yes'], ['Yes'], ['Yes', 'Yes'],
+                                            ['Yes'], ['Yes']]})
+
+
+@pytest.mark.parametrize('cells', [[[1.5, 2.5], [], [3.5], [], [4.5, 5.5, 6.5]],
+                                   [['old'], [], ['x', 'new']],
+                                   [[1.0], [2.0]]])
+def test_pad_empty_matches_flatten(cells):
+    flat = np.array([x for cell in cells for x in cell])
+    offsets = np.concatenate([[0], np.cumsum([len(cell) for cell in cells])])
+
+    values, counts = _pad_empty(flat, offsets)
+    expected, expected_counts = _flatten(cells)
+
+    assert counts.tolist() == expected_counts.tolist()
+    assert pd.Series(values, dtype=object).equals(pd.Series(expected, dtype=object))
+
+
+def test_npz_events_match_event_table(tmp_path):
+    df = session()
+    # A trial stored without any keypress
+    for col in ('Responses', 'Reaction Time', 'Valid Response'):
+        df[col] = [[] if i == 3 else cell for i, cell in enumerate(df[col])]
+
+    events = load_npz_events(save_npz(df, str(tmp_path / 'test_phase.npz')), STUDY)
+
+    pd.testing.assert_frame_equal(events, event_table(df, STUDY))
+
+
+def test_event_metrics_match_process_data():
+    df = session()
+
+    assert event_metrics(event_table(df, STUDY)) == process_data(format_df_vectorized(df, STUDY))
+
+
+def test_event_metrics_by_subject():
+    sessions = [session(1), session(2).iloc[::-1]]
+    df = pd.concat(sessions, ignore_index=True)
+
+    metrics = event_metrics(event_table(df, STUDY), by='Subject ID')
+
+    for subj, part in zip((1, 2), sessions):
+        expected = process_data(format_df_vectorized(part.reset_index(drop=True), STUDY))
+        assert tuple(metrics.loc[subj]) == expected
+
+
+@pytest.mark.parametrize('continuous_trials', [None, 20])
+def test_npz_session_stores_no_csv(dataset, tmp_path, continuous_trials):
+    run_session(dataset, str(tmp_path), frame_timing=True, continuous_trials=continuous_trials, fmt='npz')
+
+    phases = glob.glob(os.path.join(str(tmp_path), '**', '*_phase*.*'), recursive=True)
+    assert phases and all(path.endswith('.npz') for path in phases)
+    rows = {os.path.basename(path): len(load_data(path)) for path in phases if path.endswith('_phase.npz')}
+    expected = {'continuous_phase.npz': 20} if continuous_trials else {'study_phase.npz': 10, 'test_phase.npz': 20}
+    assert rows == expected
@@ -0,0 +1,118 @@
+# Imports #
+import glob
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from frame_scheduler import FrameScheduler
+from headless import run_session
+
+
+# Classes #
+class Display:
+    # Window whose flips advance a virtual clock by one refresh, and a collector pressing scripted keys
+
+    def __init__(self, refresh_rate=60.0, presses=()):
+        self.period = 1.0 / refresh_rate
+        self.now = 0.0
+        self.flips = 0
+        self.presses = list(presses)
+
+    def flip(self):
+        self.flips += 1
+        self.now += self.period
+        return self.now
+
+    def getTime(self):
+        return self.now
+
+    def getActualFrameRate(self):
+        return 1.0 / self.period
+
+    def collect(self, clock, until, stop_keys=None):
+        keys = [(key, self.now) for key, flip in self.presses if flip == self.flips]
+        self.presses = [(key, flip) for key, flip in self.presses if flip != self.flips]
+        return keys
+
+
+# Functions #
+@pytest.mark.parametrize('duration, frames', [(1.0, 60), (0.5, 30), (0.02, 1), (0.001, 1)])
+def test_frames(duration, frames):
+    assert FrameScheduler(Display(), refresh_rate=60.0).frames(duration) == frames
+
+
+@pytest.mark.parametrize('duration', [0.001, 0.25, 1.0])
+def test_present_counts_frames(duration):
+    display = Display()
+    scheduler = FrameScheduler(display)
+    n = scheduler.frames(duration)
+
+    keys, onset, offset, presented = scheduler.present(display.flip, [], duration, display, display)
+
+    assert presented and keys == []
+    # Onset flip, n - 1 redraws and the offset flip
+    assert display.flips == n + 1
+    assert scheduler.last['Presented Frames'] == n
+    assert scheduler.last['Achieved'] == pytest.approx(n * display.period)
+
+
+def test_present_stops_on_key():
+    display = Display(presses=[('a', 10)])
+    scheduler = FrameScheduler(display)
+
+    keys, onset, offset, presented = scheduler.present(display.flip, [], 1.0, display, display, stop_keys=['a'])
+
+    assert not presented and keys == [('a', 10 * display.period)]
+    assert scheduler.last['Presented Frames'] == 10
+    assert scheduler.last['Terminated']
+
+
+@pytest.mark.parametrize('delay, frames', [(0.5, 30), (0.02, 1), (0.0, 1)])
+def test_blank_counts_frames(delay, frames, tmp_path):
+    display = Display()
+    scheduler = FrameScheduler(display)
+    scheduler.start_phase(str(tmp_path / 'schedule.csv'))
+    scheduler.present(display.flip, [], 0.1, display, display)
+    before = display.flips
+
+    assert scheduler.blank(display.flip, delay) == frames
+    # The onset flip of the next trial is the last frame of the interval
+    assert display.flips - before == frames - 1
+
+    scheduler.present(display.flip, [], 0.1, display, display)
+    trials = pd.read_csv(scheduler.end_phase(), index_col=0)
+    assert len(trials) == 2
+    assert trials.loc[0, 'ISI Frames'] == frames
+    assert trials.loc[0, 'Achieved ISI'] == pytest.approx(frames * display.period)
+    # The interval after the last trial of a phase is never completed by an onset
+    assert np.isnan(trials.loc[1, 'Achieved ISI'])
+
+
+def test_session_summary_is_kept_as_totals(tmp_path):
+    display = Display(presses=[('a', 3)])
+    scheduler = FrameScheduler(display)
+    for phase in range(2):
+        scheduler.start_phase(str(tmp_path / f'schedule_{phase}.csv'))
+        for _ in range(5):
+            scheduler.present(display.flip, [], 0.1, display, display, stop_keys=['a'])
+            scheduler.blank(display.flip, 0.5)
+        scheduler.end_phase()
+
+    summary = scheduler.summary()
+    assert summary['trials'] == 10
+    assert summary['terminated'] == 1
+    assert summary['trials_with_late_offset'] == 0
+    assert summary['max_abs_isi_error'] == pytest.approx(0, abs=1e-9)
+    assert len(pd.read_csv(str(tmp_path / 'schedule_0.csv'))) == len(pd.read_csv(str(tmp_path / 'schedule_1.csv')))
+
+
+def test_session_presents_requested_frames(dataset, tmp_path):
+    run_session(dataset, str(tmp_path), delay=0.5, time=1.0)
+
+    schedules = glob.glob(os.path.join(str(tmp_path), '**', '*_schedule.csv'), recursive=True)
+    assert len(schedules) == 2
+    for path in schedules:
+        trials = pd.read_csv(path)
+        shown = trials[~trials['Terminated']]
+        assert (shown['Presented Frames'] == shown['Requested Frames']).all()
+        assert (trials['ISI Frames'] == 30).all()
@@ -0,0 +1,92 @@
+# Imports #
+import glob
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from frame_timing import FrameTimer
+from headless import run_session
+
+PERIOD = 1.0 / 60.0
+
+
+# Classes #
+class Window:
+    # Flips at scripted intervals, in frames
+
+    def __init__(self, intervals):
+        self.times = np.cumsum([1.0] + list(intervals)) * PERIOD
+        self.flips = 0
+
+    def flip(self):
+        self.flips += 1
+        return self.times[self.flips - 1]
+
+    def getActualFrameRate(self):
+        return 1.0 / PERIOD
+
+
+# Functions #
+def timed_trial(intervals, frame_locked=True, terminated=False):
+    win = Window(intervals)
+    timer = FrameTimer(win)
+    timer.start_trial('1.jpg', sum(intervals) * PERIOD)
+    for _ in range(len(intervals) + 1):
+        timer.flip()
+
+    return timer.end_trial(terminated=terminated, offset_flip=len(intervals), frame_locked=frame_locked)
+
+
+@pytest.mark.parametrize('intervals, dropped', [([1, 1, 1, 1], 0), ([1.2, 1.3, 1.2, 1.4], 0), ([1, 3, 1, 1], 2),
+                                                ([2, 1, 2, 1], 2), ([1, 1, 1, 0.6], 0)])
+def test_dropped_frames_counts_missed_refreshes(intervals, dropped):
+    assert timed_trial(intervals)['Dropped Frames'] == dropped
+
+
+def test_dropped_frames_of_terminated_trial():
+    assert timed_trial([1, 4], terminated=True)['Dropped Frames'] == 3
+
+
+def test_dropped_frames_not_measured_when_waiting():
+    record = timed_trial([30], frame_locked=False)
+
+    assert np.isnan(record['Dropped Frames'])
+    assert record['Duration Error'] == pytest.approx(0)
+
+
+def test_flip_times_are_delimited():
+    record = timed_trial([1, 2])
+
+    assert [float(t) for t in record['Flip Times'].split(';')] == pytest.approx([PERIOD, 2 * PERIOD, 4 * PERIOD])
+
+
+def test_session_drops_no_frames(dataset, tmp_path):
+    run_session(dataset, str(tmp_path), frame_timing=True)
+
+    frames = glob.glob(os.path.join(str(tmp_path), '**', '*_frames.csv'), recursive=True)
+    assert len(frames) == 2
+    for path in frames:
+        trials = pd.read_csv(path)
+        assert (trials['Dropped Frames'] == 0).all()
+        flips = trials['Flip Times'].str.split(';')
+        assert (flips.str.len() > 1).all()
+
+
+def test_records_are_streamed_per_phase(tmp_path):
+    win = Window([1, 1, 3, 1] * 4)
+    timer = FrameTimer(win)
+    for phase in range(2):
+        timer.start_phase(str(tmp_path / f'frames_{phase}.csv'))
+        for _ in range(2):
+            timer.start_trial('1.jpg', 5 * PERIOD)
+            for _ in range(4):
+                timer.flip()
+            timer.end_trial(offset_flip=3, frame_locked=True)
+        timer.end_phase()
+
+    assert timer.summary()['trials'] == 4
+    assert timer.summary()['dropped_frames'] == 8
+    for phase in range(2):
+        trials = pd.read_csv(str(tmp_path / f'frames_{phase}.csv'), index_col=0)
+        assert trials.index.tolist() == [0, 1]
+        assert (trials['Dropped Frames'] == 2).all()
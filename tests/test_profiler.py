@@ -0,0 +1,60 @@
+# Imports #
+import glob
+import os
+import sys
+import experiment_backend
+import experiment_results
+import trial_buffer
+import ui_main
+from headless import run_session
+from profiler import PATCHED_MODULES, PROFILED_FUNCTIONS, Profiler
+
+
+# Functions #
+def references():
+    # Every module attribute and class attribute the profiler may swap
+    found = {}
+    for module_name, path in PROFILED_FUNCTIONS:
+        owner = sys.modules[module_name]
+        *parents, name = path.split('.')
+        for parent in parents:
+            owner = getattr(owner, parent)
+        found[(module_name, path)] = vars(owner)[name]
+        for patched_name in PATCHED_MODULES:
+            module = sys.modules.get(patched_name)
+            if module is not None and not parents and name in vars(module):
+                found[(patched_name, path)] = vars(module)[name]
+
+    return found
+
+
+def test_uninstall_restores_originals():
+    original = references()
+
+    with Profiler() as profiler:
+        patched = references()
+        assert all(patched[key] is not original[key] for key in original if key[0] == 'experiment_backend')
+        assert ui_main.display_image is experiment_backend.display_image
+        assert trial_buffer.TrialBuffer.to_df.__wrapped__ is original[('trial_buffer', 'TrialBuffer.to_df')]
+        assert profiler.samples
+
+    assert references() == original
+    assert ui_main.load_data is experiment_results.load_data
+    assert not hasattr(experiment_backend.display_image, '__wrapped__')
+
+
+def test_profiled_session_restores_originals(dataset, tmp_path):
+    original = references()
+
+    run_session(dataset, str(tmp_path), profile=True)
+
+    assert all(current is original[key] for key, current in references().items())
+
+
+def test_latency_is_saved_only_when_profiled(dataset, tmp_path):
+    for profile in (False, True):
+        run_session(dataset, str(tmp_path / str(profile)), profile=profile)
+
+    saved = [os.path.relpath(path, str(tmp_path)).split(os.sep)[0]
+             for path in glob.glob(os.path.join(str(tmp_path), '**', 'response_latency.json'), recursive=True)]
+    assert saved == ['True']
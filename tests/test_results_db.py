@@ -0,0 +1,89 @@
+# Imports #
+import glob
+import os
+import sqlite3
+import pytest
+from experiment_results import load_data
+from headless import run_session
+from results_db import ResultsDB
+
+
+# Functions #
+def record(run, image, session='a', station=None, subject=1):
+    return {'subject': subject, 'date': '2024-05-01', 'trial': 0, 'phase': 'test_phase', 'run': run,
+            'session': session, 'station': station,
+            'data': {'Image': image, 'Responses': ['old'], 'Reaction Time': [0.5], 'Valid Response': ['Yes'],
+                     'Number of Responses': 1}}
+
+
+def count(db, table):
+    return db.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+@pytest.fixture
+def db(tmp_path):
+    with ResultsDB(str(tmp_path / 'results.db')) as db:
+        yield db
+
+
+def test_add_trials_resend_is_stored_once(db):
+    batch = [record(run, f"{run + 1}.jpg") for run in range(3)]
+
+    assert db.add_trials(batch) == 3
+    assert db.add_trials(batch) == 3
+
+    assert count(db, 'sessions') == 1
+    assert count(db, 'trials') == 3
+    assert count(db, 'responses') == 3
+
+
+def test_add_trials_keeps_sessions_apart(db):
+    db.add_trials([record(run, f"{run + 1}.jpg", session='a', station='A') for run in range(3)])
+    db.add_trials([record(run, f"{run + 11}.jpg", session='b', station='B') for run in range(3)])
+
+    assert count(db, 'sessions') == 2
+    images = db.conn.execute("SELECT s.station, t.image FROM trials t JOIN sessions s ON s.id = t.session_id "
+                             "ORDER BY s.station, t.position").fetchall()
+    assert images == [('A', '1.jpg'), ('A', '2.jpg'), ('A', '3.jpg'),
+                      ('B', '11.jpg'), ('B', '12.jpg'), ('B', '13.jpg')]
+
+
+def test_add_trials_conflict_stores_nothing(db):
+    db.add_trials([record(0, '1.jpg')])
+
+    with pytest.raises(ValueError):
+        db.add_trials([record(1, '2.jpg'), record(0, '5.jpg')])
+
+    assert count(db, 'trials') == 1
+    assert db.conn.execute("SELECT image FROM trials").fetchone() == ('1.jpg',)
+
+
+def test_continuous_session_is_stored(dataset, tmp_path):
+    db_path = str(tmp_path / 'results.db')
+
+    run_session(dataset, str(tmp_path), continuous_trials=20, db_path=db_path)
+
+    stored = glob.glob(os.path.join(str(tmp_path), '**', 'continuous_phase.csv'), recursive=True)[0]
+    expected = load_data(stored)
+    with ResultsDB(db_path) as db:
+        session = db.conn.execute("SELECT id, path FROM sessions WHERE phase = 'continuous_phase'").fetchone()
+        df = db.session_df(session[0])
+
+    assert session[1] == stored
+    assert df['Position'].tolist() == list(range(20))
+    assert df['Image'].tolist() == expected['Image'].tolist()
+    assert df['Old'].tolist() == expected['Old'].tolist()
+    assert df['Lag'].fillna(0).tolist() == expected['Lag'].fillna(0).tolist()
+
+
+def test_trials_of_older_databases_get_continuous_columns(tmp_path):
+    path = str(tmp_path / 'results.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE trials (id INTEGER PRIMARY KEY, session_id INTEGER, position INTEGER, image TEXT, "
+                 "start REAL, end REAL, delay REAL, num_responses INTEGER)")
+    conn.close()
+
+    with ResultsDB(path) as db:
+        columns = [row[1] for row in db.conn.execute("PRAGMA table_info(trials)")]
+
+    assert columns[-2:] == ['old', 'lag']
@@ -0,0 +1,42 @@
+# Imports #
+import numpy as np
+import pytest
+from rt_analysis import fit_exgauss
+
+
+# Functions #
+@pytest.fixture(scope='module')
+def groups():
+    # A large ex-Gaussian group, a tiny one, an all-equal one and an empty one
+    rng = np.random.default_rng(0)
+    values = np.concatenate([rng.normal(0.4, 0.05, 3000) + rng.exponential(0.2, 3000), rng.normal(0.5, 0.08, 3),
+                             np.full(5, 0.5)])
+    codes = np.repeat([0, 1, 2], [3000, 3, 5])
+
+    return values, codes, 4
+
+
+def test_fit_exgauss_recovers_parameters(groups):
+    fit = fit_exgauss(*groups)
+
+    assert fit.loc[0, 'converged']
+    assert fit.loc[0, ['mu', 'sigma', 'tau']].tolist() == pytest.approx([0.4, 0.05, 0.2], abs=0.01)
+
+
+def test_fit_exgauss_degenerate_groups(groups):
+    fit = fit_exgauss(*groups)
+
+    assert not fit.loc[2:, 'converged'].any()
+    assert fit.loc[2:, ['mu', 'sigma', 'tau', 'loglik']].isna().all().all()
+
+
+def test_fit_exgauss_flag_describes_returned_fit(groups):
+    fit = fit_exgauss(*groups, max_iter=1)
+
+    assert not fit['converged'].any()
+    for max_iter in (2, 5, 100):
+        fit = fit_exgauss(*groups, max_iter=max_iter)
+        # A group is only flagged converged with finite parameters
+        assert fit.loc[fit['converged'], ['mu', 'sigma', 'tau']].notna().all().all()
+        assert (fit['iterations'] <= max_iter).all()
+    assert fit.loc[:1, 'converged'].all()
@@ -0,0 +1,21 @@
+# Imports #
+import numpy as np
+import pytest
+from sdt_metrics import norm_ppf, sdt_measures
+
+
+# Functions #
+def test_norm_ppf_known_values():
+    z = norm_ppf([0.0, 0.025, 0.5, 0.975, 1.0, -0.5, 1.5, np.nan])
+
+    assert z[1:4] == pytest.approx([-1.959964, 0.0, 1.959964], abs=1e-6)
+    assert z[0] == -np.inf and z[4] == np.inf
+    assert np.isnan(z[5:]).all()
+
+
+def test_sdt_measures_of_symmetric_counts():
+    d_prime, criterion, a_prime = sdt_measures([84], [16], [16], [84], correction=None)
+
+    assert d_prime[0] == pytest.approx(2 * norm_ppf(0.84), abs=1e-12)
+    assert criterion[0] == pytest.approx(0, abs=1e-12)
+    assert a_prime[0] > 0.5
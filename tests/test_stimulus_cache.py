@@ -0,0 +1,56 @@
+# Imports #
+import os
+import pytest
+from psychopy import visual
+from stimulus_cache import StimulusCache
+
+
+# Functions #
+@pytest.fixture
+def paths(dataset):
+    return [os.path.join(dataset, f"{i + 1}.jpg") for i in range(8)]
+
+
+@pytest.fixture
+def cache():
+    cache = StimulusCache(visual.Window([800, 800]), max_size=3, prefetch=2)
+    yield cache
+    cache.close()
+
+
+def test_get_evicts_least_recently_used(cache, paths):
+    a, b, c, d = paths[:4]
+    for path in (a, b, c, a, d):
+        cache.get(path)
+
+    assert list(cache._stims) == [c, a, d]
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 4
+
+    cache.get(b)
+    assert cache.stats()['misses'] == 5
+    assert b in cache._stims and c not in cache._stims
+
+
+def test_prefetch_hits_and_misses(cache, paths):
+    cache.prefetch(paths, -1)
+    for path in paths[:2]:
+        assert cache.get(path).name == os.path.basename(path)
+
+    cache.get(paths[2])
+
+    assert cache.stats()['hits'] == 2
+    assert cache.stats()['misses'] == 1
+
+
+def test_preload_keeps_every_image(cache, paths):
+    cache.preload(paths[:3] + paths[:3])
+    for path in paths[:3]:
+        cache.get(path)
+
+    assert cache.stats()['misses'] == 0
+    assert cache.stats()['stimuli'] == 3
+
+
+def test_preload_past_max_size(cache, paths):
+    with pytest.raises(ValueError):
+        cache.preload(paths[:4])
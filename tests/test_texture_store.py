@@ -0,0 +1,46 @@
+# Imports #
+import os
+import numpy as np
+from PIL import Image
+from dataset_manifest import valid_images
+from experiment_backend import add_data
+from headless import synthetic_dataset
+from texture_store import STORE_NAME, TextureStore, open_store, prepare_dataset
+
+
+# Functions #
+def replace_image(path, value):
+    # Rewrites an image with uniform pixels and a later modification time
+    Image.fromarray(np.full((8, 8, 3), value, dtype=np.uint8)).save(path)
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+
+def test_stale_slots_are_refreshed_into_a_new_file(tmp_path):
+    root = synthetic_dataset(str(tmp_path / 'dataset'), num=4, size=8)
+    store_path = os.path.join(root, STORE_NAME)
+    img_paths = add_data(root)
+    prepare_dataset(img_paths, store_path, win_size=(20, 20), size=0.5, workers=1)
+
+    mapped = TextureStore(store_path)
+    before = mapped.pixels(img_paths[0]).copy()
+    inode = os.stat(store_path).st_ino
+    replace_image(img_paths[0], 200)
+
+    store = open_store(root)
+
+    assert store.stale() == []
+    assert (store.pixels(img_paths[0])[..., :3] == 200).all()
+    assert (store.pixels(img_paths[1]) == mapped.pixels(img_paths[1])).all()
+    # The store mapped before the refresh still reads the pixels of its own file
+    assert (mapped._pixels[0] == before).all()
+    assert os.stat(store_path).st_ino != inode
+    assert [name for name in os.listdir(root) if name.endswith('.tmp')] == []
+
+
+def test_store_and_session_list_the_same_images(tmp_path):
+    root = synthetic_dataset(str(tmp_path / 'dataset'), num=4, size=8)
+    Image.fromarray(np.zeros((8, 8, 3), dtype=np.uint8)).save(os.path.join(root, 'extra.png'))
+
+    assert valid_images(root, recursive=False) == add_data(root)
+    assert len(add_data(root)) == 4
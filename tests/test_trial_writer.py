@@ -0,0 +1,111 @@
+# Imports #
+import glob
+import json
+import os
+import pandas as pd
+from headless import run_session
+from trial_writer import TrialWriter, load_journal, resume_journal, retire_journal, completed_runs
+
+SESSION = {'seed': 1, 'num': 10, 'timing': 1.0, 'trials': 1, 'continuous_trials': None}
+
+
+# Functions #
+def write_journal(path, session, runs):
+    with TrialWriter(path, session=session) as writer:
+        for run in range(runs):
+            writer.write('study_phase', 0, run, {'Image': f"{run + 1}.jpg"})
+
+    return path
+
+
+def find(target_dir, pattern):
+    return sorted(glob.glob(os.path.join(target_dir, '**', pattern), recursive=True))
+
+
+def test_journal_starts_with_session_header(tmp_path):
+    records = load_journal(write_journal(str(tmp_path / 'journal.jsonl'), SESSION, 3))
+
+    assert records[0] == {'phase': 'session', 'trial': None, 'run': None, 'data': SESSION}
+    assert completed_runs(records, 'study_phase', 0) == [{'Image': '1.jpg'}, {'Image': '2.jpg'}, {'Image': '3.jpg'}]
+
+
+def test_resume_journal_matching_session(tmp_path):
+    path = write_journal(str(tmp_path / 'journal.jsonl'), SESSION, 3)
+
+    records = resume_journal(path, dict(SESSION))
+
+    assert len(completed_runs(records, 'study_phase', 0)) == 3
+    assert os.path.exists(path)
+
+
+def test_resume_journal_other_session_is_retired(tmp_path):
+    path = write_journal(str(tmp_path / 'journal.jsonl'), SESSION, 3)
+
+    assert resume_journal(path, dict(SESSION, seed=2)) == []
+    assert not os.path.exists(path)
+    assert os.path.exists(path + '.done')
+
+
+def test_resume_journal_cut_short(tmp_path):
+    path = write_journal(str(tmp_path / 'journal.jsonl'), SESSION, 3)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"phase": "study_phase", "tri')
+
+    assert len(completed_runs(resume_journal(path, SESSION), 'study_phase', 0)) == 3
+
+
+def test_retire_journal_keeps_earlier_journals(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+
+    retired = [retire_journal(write_journal(path, SESSION, 1)) for _ in range(3)]
+
+    assert retired == [path + '.done', path + '.1.done', path + '.2.done']
+    assert retire_journal(path) is None
+
+
+def test_completed_session_retires_journal(dataset, tmp_path):
+    target_dir = str(tmp_path)
+
+    run_session(dataset, target_dir, journal=True)
+
+    assert find(target_dir, 'trial_journal.jsonl') == []
+    assert len(find(target_dir, 'trial_journal.jsonl.done')) == 1
+
+
+def test_interrupted_session_resumes(dataset, tmp_path):
+    full_dir, resumed_dir = str(tmp_path / 'full'), str(tmp_path / 'resumed')
+    full = run_session(dataset, full_dir, journal=True)
+
+    # The journal of a session interrupted after its session header and first 6 trials
+    retired = find(full_dir, 'trial_journal.jsonl.done')[0]
+    journal = os.path.join(resumed_dir, os.path.relpath(retired, full_dir))[:-len('.done')]
+    os.makedirs(os.path.dirname(journal))
+    with open(retired, encoding='utf-8') as f, open(journal, 'w', encoding='utf-8') as out:
+        out.writelines(f.readlines()[:7])
+
+    resumed = run_session(dataset, resumed_dir, journal=True)
+
+    assert resumed.flips < full.flips
+    expected = pd.read_csv(find(full_dir, 'test_phase.csv')[0])
+    result = pd.read_csv(find(resumed_dir, 'test_phase.csv')[0])
+    assert result['Image'].tolist() == expected['Image'].tolist()
+    assert find(resumed_dir, 'trial_journal.jsonl') == []
+
+
+def test_journal_of_other_session_is_not_resumed(dataset, tmp_path):
+    full_dir, other_dir = str(tmp_path / 'full'), str(tmp_path / 'other')
+    full = run_session(dataset, full_dir, journal=True)
+
+    retired = find(full_dir, 'trial_journal.jsonl.done')[0]
+    journal = os.path.join(other_dir, os.path.relpath(retired, full_dir))[:-len('.done')]
+    os.makedirs(os.path.dirname(journal))
+    with open(retired, encoding='utf-8') as f, open(journal, 'w', encoding='utf-8') as out:
+        lines = f.readlines()
+        header = json.loads(lines[0])
+        header['data']['seed'] = 2
+        out.writelines([json.dumps(header) + '\n'] + lines[1:7])
+
+    other = run_session(dataset, other_dir, journal=True)
+
+    assert other.flips == full.flips
+    assert len(find(other_dir, 'trial_journal.jsonl*.done')) == 2
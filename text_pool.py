@@ -0,0 +1,82 @@
+# Imports #
+import time
+from psychopy import visual
+
+
+# Classes #
+class TextPool:
+    """
+        Pool of text stimuli for one window. Each distinct screen text (with its position,
+        height and colour) is laid out once and the same TextStim is reused across trials
+        and phases, so no text is rasterised right before a stimulus flip.
+
+        Arguments:
+            win: psychopy window object
+    """
+
+    def __init__(self, win):
+        self.win = win
+        self._stims = {}
+
+        self.builds = 0
+        self.hits = 0
+        self.build_time = 0.0
+
+    def get(self, text, pos=(0, 0), height=0.05, color='black'):
+        """
+            Returns the pooled stimulus for a text, building it on first use.
+
+            Arguments:
+                text (str): text to display
+                pos (tuple): position of the text on the window
+                height (float): height of the letters
+                color (str): colour of the text
+
+            return:
+                stim: psychopy visual text object
+        """
+        key = (text, tuple(pos), height, color)
+        stim = self._stims.get(key)
+
+        if stim is not None:
+            self.hits += 1
+            return stim
+
+        t0 = time.perf_counter()
+        stim = visual.TextStim(self.win, text=text, pos=pos, height=height, color=color)
+        self.build_time += time.perf_counter() - t0
+        self.builds += 1
+        self._stims[key] = stim
+
+        return stim
+
+    def prewarm(self):
+        """
+            Draws every pooled stimulus once so its glyphs are rasterised before the
+            experiment starts. The back buffer is cleared afterwards, nothing is shown.
+        """
+        for stim in self._stims.values():
+            stim.draw()
+
+        self.win.clearBuffer()
+
+    def stats(self, trials=None):
+        """
+            Reports pool usage and the setup time saved by reusing stimuli, estimated as the
+            mean time to build a stimulus times the number of reuses.
+
+            Arguments:
+                trials (int): number of trials run, to report the saving per trial
+
+            return:
+                stats (dict): stimuli, builds, hits, build and saved time in seconds
+        """
+        mean_build = self.build_time / self.builds if self.builds else 0.0
+        saved = mean_build * self.hits
+
+        stats = {'stimuli': len(self._stims), 'builds': self.builds, 'hits': self.hits,
+                 'build_time': self.build_time, 'mean_build_time': mean_build, 'saved_time': saved}
+        if trials:
+            stats['saved_per_trial'] = saved / trials
+
+        return stats
@@ -0,0 +1,317 @@
+"""
+Offline "prepare dataset" step that downscales every stimulus once to its on-screen
+resolution and packs the decoded RGBA pixels into a single memory-mapped file.
+
+Stimuli built from the store need no JPEG decoding, and the pixel file is opened
+read-only so several station processes on one host share it through the page cache.
+The size and modification time of every image are kept with its slot: an image that
+was modified or replaced since is never served from its old slot, and open_store
+re-resizes such slots into a new pixel file that replaces the old one, so processes
+that already mapped the store keep reading the pixels they were given.
+
+- Usage: python texture_store.py <dataset> [--window 800 800] [--size 0.3] [--workers N]
+
+"""
+# Imports #
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from dataset_manifest import DATASET_EXTENSIONS, valid_images
+
+STORE_NAME = '.textures.rgba'
+STORE_VERSION = 2
+
+
+# Functions #
+def display_pixels(win_size=(800, 800), size=0.3):
+    """
+        Computes the on-screen resolution of an image stimulus drawn in 'height' units.
+
+        Arguments:
+            win_size (list): window width and height in pixels
+            size (float): size of the image stimulus in 'height' units
+
+        return:
+            width (int): stimulus width in pixels
+            height (int): stimulus height in pixels
+    """
+    side = int(round(size * win_size[1]))
+
+    return side, side
+
+
+def file_signature(path):
+    """
+        Identifies the version of an image file on disk without reading it.
+
+        Arguments:
+            path (str): path of image
+
+        return:
+            signature (list): size in bytes and modification time in nanoseconds, None if the file is missing
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+
+    return [st.st_size, st.st_mtime_ns]
+
+
+def prepare_dataset(img_paths, store_path, win_size=(800, 800), size=0.3, workers=None):
+    """
+        Downscales every image to its display resolution and writes the RGBA pixels into
+        one file, with a JSON index of slots next to it (store_path + '.json').
+
+        Arguments:
+            img_paths (list): paths of all images in overall dataset
+            store_path (str): path of the pixel file to create
+            win_size (list): window width and height in pixels
+            size (float): size of the image stimulus in 'height' units
+            workers (int): number of worker processes, defaults to the number of CPUs
+
+        return:
+            store_path (str): path of the pixel file
+    """
+    width, height = display_pixels(win_size, size)
+    shape = (len(img_paths), height, width, 4)
+    # Taken before resizing, so an image changed meanwhile is seen as stale rather than missed
+    signatures = {path: file_signature(path) for path in img_paths}
+
+    if img_paths:
+        # Allocate the whole file up front so workers can write their slots in place
+        np.memmap(store_path, dtype=np.uint8, mode='w+', shape=shape).flush()
+
+        chunk = max(1, len(img_paths) // 64)
+        jobs = [(store_path, shape, i, img_paths[i:i + chunk]) for i in range(0, len(img_paths), chunk)]
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(_resize_into, jobs))
+    else:
+        # np.memmap cannot map an empty file
+        open(store_path, 'wb').close()
+
+    index = {'version': STORE_VERSION, 'width': width, 'height': height, 'win_size': list(win_size),
+             'size': size, 'images': {path: slot for slot, path in enumerate(img_paths)}, 'signatures': signatures}
+    _write_index(store_path, index)
+
+    return store_path
+
+
+def refresh_store(store_path, paths):
+    """
+        Re-resizes the slots of images that were modified or replaced since the store was
+        prepared and records their new signatures. The slots are written to a copy of the
+        pixel file, which then replaces it, so a mapped store is never modified in place.
+
+        Arguments:
+            store_path (str): path of the pixel file written by prepare_dataset
+            paths (list): stored image paths to refresh, e.g. TextureStore.stale()
+
+        return:
+            refreshed (int): number of slots rewritten
+    """
+    with open(store_path + '.json') as f:
+        index = json.load(f)
+
+    slots = index['images']
+    paths = [path for path in paths if path in slots and os.path.exists(path)]
+    if not paths:
+        return 0
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(store_path) or '.', prefix=os.path.basename(store_path) + '.',
+                                    suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp, open(store_path, 'rb') as f:
+            shutil.copyfileobj(f, tmp)
+
+        pixels = np.memmap(tmp_path, dtype=np.uint8, mode='r+',
+                           shape=(len(slots), index['height'], index['width'], 4))
+        for path in paths:
+            index['signatures'][path] = file_signature(path)
+            pixels[slots[path]] = _resized(path, index['width'], index['height'])
+        pixels.flush()
+        del pixels
+
+        # The pixels are replaced before the index, so a new index never vouches for old pixels
+        os.replace(tmp_path, store_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    _write_index(store_path, index)
+
+    return len(paths)
+
+
+def open_store(dataset_dir):
+    """
+        Opens the texture store prepared for a dataset, if there is one.
+
+        Arguments:
+            dataset_dir (str): absolute path to target folder of dataset
+
+        return:
+            store (TextureStore): the prepared store, or None if the dataset was not prepared
+    """
+    store_path = os.path.join(dataset_dir, STORE_NAME)
+    if not os.path.exists(store_path + '.json'):
+        return None
+
+    with open(store_path + '.json') as f:
+        version = json.load(f).get('version')
+    if version != STORE_VERSION:
+        print(f"Texture store {store_path} was prepared by an older version and is not used, "
+              f"run texture_store.py on the dataset again")
+        return None
+
+    store = TextureStore(store_path)
+    stale = store.stale()
+    if stale:
+        try:
+            refresh_store(store_path, stale)
+            store = TextureStore(store_path)
+        except OSError as ex:
+            # A read-only dataset keeps its stale slots, which TextureStore never serves
+            print(f"Could not refresh {len(stale)} modified images in {store_path}: {ex}")
+
+    return store
+
+
+def _resized(path, width, height):
+    return np.asarray(Image.open(path).convert('RGBA').resize((width, height), Image.LANCZOS))
+
+
+def _resize_into(job):
+    store_path, shape, start, paths = job
+    pixels = np.memmap(store_path, dtype=np.uint8, mode='r+', shape=shape)
+
+    for slot, path in enumerate(paths, start):
+        pixels[slot] = _resized(path, shape[2], shape[1])
+
+    pixels.flush()
+
+
+def _write_index(store_path, index):
+    # Replaced atomically, so a station opening the store never reads a half-written index
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(store_path) or '.', prefix=os.path.basename(store_path) + '.',
+                               suffix='.json.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp, store_path + '.json')
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+# Classes #
+class TextureStore:
+    """
+        Read-only, memory-mapped view of a prepared dataset. An image is only served from
+        its slot while its file still has the size and modification time it was resized
+        from; otherwise it is reported as missing, so the caller decodes the file itself.
+        A file name alone finds a slot only if no other stored image has the same name.
+
+        Arguments:
+            store_path (str): path of the pixel file written by prepare_dataset
+    """
+
+    def __init__(self, store_path):
+        with open(store_path + '.json') as f:
+            index = json.load(f)
+
+        if index['version'] != STORE_VERSION:
+            raise ValueError(f"Texture store {store_path} was prepared by an incompatible version")
+
+        self.width = index['width']
+        self.height = index['height']
+        self._slots = index['images']
+        self._signatures = index['signatures']
+        self._fresh = {}
+
+        names = {}
+        for stored in self._slots:
+            names.setdefault(os.path.basename(stored), []).append(stored)
+        self._names = {name: paths[0] for name, paths in names.items() if len(paths) == 1}
+
+        shape = (len(self._slots), self.height, self.width, 4)
+        if self._slots:
+            self._pixels = np.memmap(store_path, dtype=np.uint8, mode='r', shape=shape)
+        else:
+            self._pixels = np.empty(shape, dtype=np.uint8)
+
+    def __contains__(self, path):
+        return self._slot(path) is not None
+
+    def __len__(self):
+        return len(self._slots)
+
+    def pixels(self, path):
+        """
+            Returns the RGBA pixels of an image as a view into the mapped file (no copy).
+
+            Arguments:
+                path (str): path of image as passed to prepare_dataset (or its file name)
+
+            return:
+                pixels (numpy array): height x width x 4 uint8 array, top row first
+        """
+        slot = self._slot(path)
+        if slot is None:
+            raise KeyError(f"{path} is not in the texture store or was modified since it was prepared")
+
+        return self._pixels[slot]
+
+    def stale(self):
+        """
+            Lists the stored images whose files were modified or replaced since they were resized.
+
+            return:
+                paths (list): stored paths of the stale images that still exist
+        """
+        return [path for path, signature in self._signatures.items()
+                if signature != file_signature(path) and os.path.exists(path)]
+
+    def image(self, path):
+        """
+            Wraps the mapped pixels of an image in a PIL image without copying or decoding.
+
+            Arguments:
+                path (str): path of image as passed to prepare_dataset (or its file name)
+
+            return:
+                im (PIL image): RGBA image sharing memory with the mapped file
+        """
+        return Image.frombuffer('RGBA', (self.width, self.height), self.pixels(path), 'raw', 'RGBA', 0, 1)
+
+    def _slot(self, path):
+        stored = path if path in self._slots else self._names.get(os.path.basename(path))
+        if stored is None:
+            return None
+
+        # The file asked for is checked once per session against the signature of its slot
+        fresh = self._fresh.get(path)
+        if fresh is None:
+            fresh = self._fresh[path] = file_signature(path) == self._signatures.get(stored)
+
+        return self._slots[stored] if fresh else None
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Pre-resize a stimulus dataset into a memory-mapped texture store.")
+    parser.add_argument('dataset', help="absolute path to target folder of dataset")
+    parser.add_argument('--window', type=int, nargs=2, default=[800, 800], help="window width and height in pixels")
+    parser.add_argument('--size', type=float, default=0.3, help="size of the image stimulus in 'height' units")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes")
+    args = parser.parse_args()
+
+    img_paths = valid_images(args.dataset, recursive=False, extensions=DATASET_EXTENSIONS)
+    out = prepare_dataset(img_paths, os.path.join(args.dataset, STORE_NAME), win_size=args.window, size=args.size,
+                          workers=args.workers)
+    print(f"Texture store written to: {out}")
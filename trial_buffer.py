@@ -0,0 +1,142 @@
+# Imports #
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+STUDY_COLUMNS = ['Subject ID', 'Date', 'Seed', 'Valid Keys', 'Image', 'Start', 'End', 'Exp. Timing', 'Delay']
+TEST_COLUMNS = ['Subject ID', 'Date', 'Image', 'Reaction Time', 'Responses', 'Number of Responses', 'Valid Response']
+
+
+# Classes #
+class TrialBuffer:
+    """
+        Fixed-schema record buffer of one phase, preallocated for num trials. Recording a
+        trial stores references into column arrays, so the presentation loop does no
+        pandas work; the dataframe in the layout of create_df is built by to_df at export.
+
+        Arguments:
+            num (int): length of image list (number of trials)
+            subj (int): subject number or id
+            test (bool): true if recording the test phase, else false
+            seed (int): seed of the image lists, stored with study phase data
+            timing (float): presentation time, stored with study phase data
+    """
+
+    __slots__ = ('num', 'subj', 'test', 'date', 'seed', 'timing', 'image', 'start', 'end', 'delay', 'valid_keys',
+                 'responses', 'rt', 'valid', 'num_responses')
+
+    def __init__(self, num, subj, test=True, seed=None, timing=None):
+        self.num = num
+        self.subj = subj
+        self.test = test
+        self.date = str(datetime.now())
+        self.seed = seed
+        self.timing = timing
+
+        self.image = np.full(num, np.nan, dtype=object)
+        if test:
+            self.responses = np.full(num, np.nan, dtype=object)
+            self.rt = np.full(num, np.nan, dtype=object)
+            self.valid = np.full(num, np.nan, dtype=object)
+            self.num_responses = np.full(num, np.nan, dtype=object)
+        else:
+            self.start = np.full(num, np.nan)
+            self.end = np.full(num, np.nan)
+            self.delay = np.full(num, np.nan)
+            self.valid_keys = np.full(num, np.nan, dtype=object)
+
+    def __len__(self):
+        return self.num
+
+    def record_study(self, run, image, start, end, delay, valid_keys):
+        """
+            Records a study phase trial.
+
+            Arguments:
+                run (int): index of the trial within the phase
+                image (str): name of the image presented
+                start (float): starting time of image presentation
+                end (float): ending time of image presentation
+                delay (float): delay or interval between images
+                valid_keys (list): valid input for keyboard keys
+        """
+        self.image[run] = image
+        self.start[run] = start
+        self.end[run] = end
+        self.delay[run] = delay
+        self.valid_keys[run] = valid_keys
+
+    def record_test(self, run, image, responses, rt, valid):
+        """
+            Records a test phase trial.
+
+            Arguments:
+                run (int): index of the trial within the phase
+                image (str): name of the image presented
+                responses (list): keyboard responses
+                rt (list): reaction times
+                valid (list): list indicating if key(s) is/are valid
+        """
+        self.image[run] = image
+        self.responses[run] = responses
+        self.rt[run] = rt
+        self.valid[run] = valid
+        self.num_responses[run] = 0 if "None" in responses else len(responses)
+
+    def row(self, run):
+        """
+            Column values of a recorded trial, as stored in a trial journal.
+
+            Arguments:
+                run (int): index of the trial within the phase
+
+            return:
+                data (dict): column values of the trial
+        """
+        if self.test:
+            return {'Image': self.image[run], 'Responses': self.responses[run], 'Reaction Time': self.rt[run],
+                    'Valid Response': self.valid[run], 'Number of Responses': self.num_responses[run]}
+
+        return {'Image': self.image[run], 'Start': float(self.start[run]), 'End': float(self.end[run]),
+                'Delay': float(self.delay[run]), 'Valid Keys': self.valid_keys[run]}
+
+    def restore(self, runs):
+        """
+            Fills the trials recovered from a trial journal.
+
+            Arguments:
+                runs (list): data of the completed runs, as returned by completed_runs
+
+            return:
+                resume_from (int): index of the first trial that still has to be run
+        """
+        for run, data in enumerate(runs):
+            if self.test:
+                self.record_test(run, data['Image'], data['Responses'], data['Reaction Time'],
+                                 data['Valid Response'])
+            else:
+                self.record_study(run, data['Image'], data['Start'], data['End'], data['Delay'], data['Valid Keys'])
+
+        return len(runs)
+
+    def to_df(self):
+        """
+            Builds the dataframe of the phase in the layout of create_df.
+
+            return:
+                df (pandas dataframe): experimental data of the phase
+        """
+        if self.test:
+            columns = {'Image': self.image, 'Reaction Time': self.rt, 'Responses': self.responses,
+                       'Number of Responses': self.num_responses, 'Valid Response': self.valid}
+            names = TEST_COLUMNS
+        else:
+            columns = {'Seed': self.seed, 'Valid Keys': self.valid_keys, 'Image': self.image, 'Start': self.start,
+                       'End': self.end, 'Exp. Timing': self.timing, 'Delay': self.delay}
+            names = STUDY_COLUMNS
+
+        df = pd.DataFrame(columns, index=np.arange(self.num))
+        df['Subject ID'] = self.subj
+        df['Date'] = self.date
+
+        return df[names]
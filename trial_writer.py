@@ -0,0 +1,283 @@
+# Imports #
+import csv
+import json
+import os
+import queue
+import threading
+import time
+import numpy as np
+
+_STOP = object()
+
+# Phase of the first record of a journal, holding the parameters of its session
+SESSION_PHASE = 'session'
+
+
+# Functions #
+def _json_default(x):
+    """
+        Converts NumPy scalars and arrays in trial records to JSON types.
+
+        Arguments:
+            x: value json cannot serialise
+
+        return:
+            value: int, float, bool or list
+    """
+    if isinstance(x, np.generic):
+        return x.item()
+    if isinstance(x, np.ndarray):
+        return x.tolist()
+
+    raise TypeError(f"Object of type {type(x).__name__} is not JSON serializable")
+
+
+def load_journal(path):
+    """
+        Reads the trial records of a journal. A last line cut short by a crash is ignored.
+
+        Arguments:
+            path (str): absolute path to journal file
+
+        return:
+            records (list): trial records in the order they were written, empty if there is no journal
+    """
+    records = []
+    if not os.path.exists(path):
+        return records
+
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+
+    return records
+
+
+def resume_journal(path, session):
+    """
+        Reads the journal of an interrupted session so it can be resumed. A journal whose
+        session parameters differ from the current ones belongs to another session and is
+        retired instead, so its trials are never skipped or exported as part of this one.
+
+        Arguments:
+            path (str): absolute path to journal file
+            session (dict): parameters of the current session, e.g. seed, number of images and timing
+
+        return:
+            records (list): trial records to resume from, empty if there is no matching journal
+    """
+    records = load_journal(path)
+    if not records:
+        return records
+
+    # Compared as stored, so tuples and NumPy scalars match their JSON form
+    session = json.loads(json.dumps(session, default=_json_default))
+    if records[0].get('phase') == SESSION_PHASE and records[0].get('data') == session:
+        return records
+
+    retire_journal(path)
+
+    return []
+
+
+def retire_journal(path):
+    """
+        Renames the journal of a finished session to <journal>.done (.1.done, .2.done, ...
+        if that exists), so the next session of the subject today starts a new journal.
+
+        Arguments:
+            path (str): absolute path to journal file
+
+        return:
+            path (str): absolute path of the retired journal, None if there was no journal
+    """
+    if not os.path.exists(path):
+        return None
+
+    retired = path + '.done'
+    count = 0
+    while os.path.exists(retired):
+        count += 1
+        retired = f"{path}.{count}.done"
+    os.replace(path, retired)
+
+    return retired
+
+
+def completed_runs(records, phase, trial):
+    """
+        Finds the durable runs of a phase, i.e. the trials that can be skipped when resuming.
+
+        Arguments:
+            records (list): trial records returned by load_journal
+            phase (str): 'study_phase', 'test_phase' or 'continuous_phase'
+            trial (int): trial number of experiment
+
+        return:
+            runs (list): data of runs 0, 1, ... up to the first missing run
+    """
+    found = {r['run']: r['data'] for r in records if r['phase'] == phase and r['trial'] == trial}
+
+    runs = []
+    while len(runs) in found:
+        runs.append(found[len(runs)])
+
+    return runs
+
+
+# Classes #
+class TrialWriter:
+    """
+        Appends completed trial records to a JSON-lines journal from a background thread.
+        write() only puts the record on an unbounded queue, so it never blocks the
+        presentation loop; the thread writes each record as one line and fsyncs after
+        fsync_every records or fsync_interval seconds, whichever comes first.
+
+        Arguments:
+            path (str): absolute path to journal file, appended to if it exists
+            session (dict): parameters of the session, written as the first record of a new journal
+            fsync_every (int): maximum number of records written between fsyncs
+            fsync_interval (float): maximum time in seconds a written record waits for its fsync
+    """
+
+    def __init__(self, path, session=None, fsync_every=10, fsync_interval=1.0):
+        self.path = path
+        self.session = session
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+
+        self.written = 0
+        self.synced = 0
+        self.error = None
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='trial-writer', daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, phase, trial, run, data):
+        """
+            Queues the record of a completed trial.
+
+            Arguments:
+                phase (str): 'study_phase', 'test_phase' or 'continuous_phase'
+                trial (int): trial number of experiment
+                run (int): index of the trial within the phase
+                data (dict): column values of the trial
+        """
+        self._queue.put_nowait({'phase': phase, 'trial': trial, 'run': run, 'data': data})
+
+    def close(self):
+        """
+            Writes and fsyncs the remaining records and stops the thread.
+        """
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        f = open(self.path, 'a', encoding='utf-8')
+        pending = 0
+        deadline = None
+        if self.session is not None and f.tell() == 0:
+            f.write(json.dumps({'phase': SESSION_PHASE, 'trial': None, 'run': None, 'data': self.session},
+                               default=_json_default) + '\n')
+
+        def sync():
+            f.flush()
+            os.fsync(f.fileno())
+            self.synced = self.written
+
+        try:
+            while True:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+
+                if item is _STOP:
+                    break
+                if item is not None:
+                    f.write(json.dumps(item, default=_json_default) + '\n')
+                    self.written += 1
+                    pending += 1
+                    if deadline is None:
+                        deadline = time.monotonic() + self.fsync_interval
+
+                if pending and (pending >= self.fsync_every or time.monotonic() >= deadline):
+                    sync()
+                    pending = 0
+                    deadline = None
+
+            sync()
+        except Exception as ex:
+            self.error = ex
+        finally:
+            f.close()
+
+
+class RowWriter:
+    """
+        Appends the record of every completed trial as one CSV row, in the layout of
+        DataFrame.to_csv, and flushes it, so the rows of a crashed session are on disk and
+        memory does not grow with the number of trials.
+
+        Arguments:
+            path (str): absolute path to CSV file
+            columns (list): column names, i.e. the keys of the records written
+            append (bool): true to continue the file of an interrupted session instead of starting a new one
+    """
+
+    def __init__(self, path, columns, append=False):
+        self.path = path
+        self.columns = list(columns)
+        self.count = 0
+
+        if append and os.path.exists(path):
+            with open(path, newline='', encoding='utf-8') as f:
+                self.count = max(0, sum(1 for _ in csv.reader(f)) - 1)
+        self._file = open(path, 'a' if append else 'w', newline='', encoding='utf-8')
+        self._csv = csv.writer(self._file)
+        if self._file.tell() == 0:
+            self._csv.writerow([''] + self.columns)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, record):
+        """
+            Writes the record of a trial.
+
+            Arguments:
+                record (dict): column values of the trial
+        """
+        self._csv.writerow([self.count] + [record.get(col) for col in self.columns])
+        self._file.flush()
+        self.count += 1
+
+    def close(self):
+        """
+            Closes the CSV file.
+
+            return:
+                path (str): absolute path to CSV file
+        """
+        self._file.close()
+
+        return self.path
@@ -5,12 +5,19 @@ new user-specified local directory. At the end of the trial, the user/experiment
 they would like to calculate and locally save experiment trial metrics.
 
 - This script serves as the driver program for "experiment_backend.py" and "experiment_results.py"
+- Usage: python ui_main.py [--db PATH] [--journal] [--cache DIR] [--ingest URL] [--continuous TRIALS]
+  [--no-frame-locked] [--frame-timing] [--profile] [--manifest] [--format {csv,npz}]
+- Every option defaults to an environment variable of the station, e.g. EXPERIMENT_INGEST_URL, see --help
+- Set EXPERIMENT_PROFILE=1 to save per-call timings of the session to session_profile.json and the
+  response polling gaps to response_latency.json
 
 """
 #########################################################################
 __author__ = "Amanda Sarubbi"
 
 #########################################################################
+import argparse
+import contextlib
 from experiment_backend import *
 from experiment_results import *
 
@@ -76,44 +83,202 @@ def get_info():
     return dataset_path, save_path, int(seed), int(trials), float(delay), keys
 
 
-def main(win, dataset_dir, target_dir, seed, trials, delay, keys):
-    subject, num_images, timing = experiment_info()
+def env_flag(name, default=False):
+    """
+        Reads an on/off setting of the station from an environment variable.
+
+        Arguments:
+            name (str): name of the environment variable
+            default (bool): value if the variable is not set
 
-    df_study = create_df(num_images, subject, test=False)
-    df_test = create_df(num_images * 2, subject, test=True)
+        return:
+            flag (bool): false if the variable is empty or 0, else true
+    """
+    value = os.environ.get(name)
+    if value is None:
+        return default
 
-    df_study['Seed'] = seed
-    df_study['Exp. Timing'] = timing
+    return value not in ('', '0')
 
-    dataset = add_data(dataset_dir)
 
-    study_data, test_data = generate_datasets(seed, num_images, dataset)
+def main(win, dataset_dir, target_dir, seed, trials, delay, keys, frame_timing=False, db_path=None, journal=False,
+         cache_dir=None, ingest_url=None, continuous_trials=None, lags=DEFAULT_LAGS, p_repeat=0.5, frame_locked=True,
+         profile=False, manifest=False, fmt='csv'):
+    if continuous_trials and trials > 1:
+        # Every trial would draw its new images from the same dataset, so images shown in an earlier trial would
+        # be scored as new
+        raise ValueError("A continuous-recognition session runs a single trial")
 
     test_path = ""
 
-    for trial in range(trials):
-        output_text(win, "Now starting the study phase of Trial: " + str(trial + 1))
-        study_path = study_phase(win,
-                                 study_data, df_study, num_images, timing, delay, trial, subject, target_dir, keys)
-        output_text(win, "End of study phase of Trial: " + str(trial + 1))
+    # Everything the session opens is closed, and its profile saved, even if the session crashes or is
+    # interrupted; end_experiment leaves through SystemExit, which unwinds the stack as well
+    with contextlib.ExitStack() as stack:
+        if profile:
+            profiler = Profiler()
+
+            def save_profile():
+                # Next to the data of the last phase, or in the target directory if no phase ran
+                path = os.path.join(os.path.dirname(test_path) or target_dir, 'session_profile.json')
+                print(f"Session profile saved to: {profiler.save(path)}")
+
+            # Registered before the profiler is installed, so it runs once the profiled functions are restored
+            stack.callback(save_profile)
+            stack.enter_context(profiler)
+        subject, num_images, timing = experiment_info()
+
+        # One collector for the whole session, so its polling latency covers every trial
+        collector = ResponseCollector()
+        timer = FrameTimer(win) if frame_timing else None
+        scheduler = FrameScheduler(win) if frame_locked else None
+        # The per-trial logs of a phase cut short are completed and closed on the way out
+        for log in (timer, scheduler):
+            if log is not None:
+                stack.callback(log.end_phase)
+        db = stack.enter_context(ResultsDB(db_path)) if db_path else None
+        analysis_cache = stack.enter_context(AnalysisCache(cache_dir)) if cache_dir else None
+        phases = ('continuous',) if continuous_trials else ('study', 'test')
+        pool = prewarm_screens(win, TextPool(win), keys, trials, phases=phases)
 
-        output_text(win, "Now starting the test phase of Trial: " + str(trial + 1))
-        test_path = test_phase(win,
-                               test_data, df_test, num_images * 2, timing, delay, trial, subject, target_dir, keys)
-        output_text(win, "End of test phase of Trial: " + str(trial + 1))
+        dataset = add_data(dataset_dir, manifest=manifest)
 
-    end_experiment(win, test_path, subject, trials, study_data)
+        if continuous_trials:
+            # A dataset too small for the session fails before it starts
+            needed = new_images_needed(seed, len(dataset), continuous_trials, subject, p_repeat, lags)
+            print(f"Continuous recognition: {continuous_trials} trials per run, at most {needed} new images of "
+                  f"{len(dataset)}")
+            study_data = test_data = None
+        else:
+            study_records = TrialBuffer(num_images, subject, test=False, seed=seed, timing=timing)
+            test_records = TrialBuffer(num_images * 2, subject, test=True)
+            study_data, test_data = generate_datasets(seed, num_images, dataset, subj=subject)
+
+        # Large enough to keep the whole preloaded test list
+        cache = StimulusCache(win, max_size=max(256, len(set(test_data or ()))), store=open_store(dataset_dir))
+        stack.callback(cache.close)
+        if test_data is not None:
+            cache.preload(test_data)
+
+        # A journal left by an interrupted session today is resumed from its last durable trial, if it was
+        # started with the same parameters, including everything the trial lists and schedule depend on
+        session = {'seed': seed, 'num': num_images, 'timing': timing, 'trials': trials, 'delay': delay,
+                   'keys': list(keys), 'continuous_trials': continuous_trials, 'lags': list(lags),
+                   'p_repeat': p_repeat}
+        records = resume_journal(journal_path(target_dir, subject), session) if journal else []
+        writer = TrialWriter(journal_path(target_dir, subject), session=session) if journal else None
+        if writer is not None:
+            stack.enter_context(writer)
+        # One spool per station, so records a collector never received are sent with the next session
+        ingest = IngestClient(ingest_url, subject, os.path.join(target_dir, 'ingest_spool.jsonl'), seed=seed,
+                              timing=timing) if ingest_url else None
+        if ingest is not None:
+            stack.callback(ingest.close)
+
+        for trial in range(trials):
+            if continuous_trials:
+                restored = completed_runs(records, "continuous_phase", trial)
+                if len(restored) < continuous_trials:
+                    output_text(win, banner_text('continuous', trial, start=True), pool=pool)
+                schedule = continuous_schedule(seed, len(dataset), continuous_trials, subject, p_repeat, lags)
+                test_path = continuous_phase(win, dataset, schedule, timing, delay, trial, subject, target_dir, keys,
+                                             cache=cache, collector=collector, timer=timer, pool=pool, writer=writer,
+                                             ingest=ingest, scheduler=scheduler, restored=restored, fmt=fmt, db=db)
+                if len(restored) < continuous_trials:
+                    output_text(win, banner_text('continuous', trial, start=False), pool=pool)
+                continue
+
+            done = study_records.restore(completed_runs(records, "study_phase", trial))
+            if done < num_images:
+                output_text(win, banner_text('study', trial, start=True), pool=pool)
+            study_path = study_phase(win,
+                                     study_data, study_records, num_images, timing, delay, trial, subject, target_dir,
+                                     keys, cache=cache, collector=collector, timer=timer, db=db, writer=writer,
+                                     resume_from=done, ingest=ingest, scheduler=scheduler, fmt=fmt)
+            if done < num_images:
+                output_text(win, banner_text('study', trial, start=False), pool=pool)
+
+            done = test_records.restore(completed_runs(records, "test_phase", trial))
+            if done < num_images * 2:
+                output_text(win, banner_text('test', trial, start=True), pool=pool)
+            test_path = test_phase(win,
+                                   test_data, test_records, num_images * 2, timing, delay, trial, subject, target_dir,
+                                   keys, cache=cache, collector=collector, timer=timer, db=db, pool=pool, writer=writer,
+                                   resume_from=done, ingest=ingest, scheduler=scheduler, fmt=fmt)
+            if done < num_images * 2:
+                output_text(win, banner_text('test', trial, start=False), pool=pool)
+
+        # Closing again on the way out is a no-op
+        cache.close()
+        if writer is not None:
+            writer.close()
+            # The session is complete, a later session of the subject today must not resume it
+            retire_journal(writer.path)
+        if ingest is not None and ingest.close():
+            print(f"{ingest.pending} trial records could not be sent to {ingest_url} ({ingest.last_error}), "
+                  f"they will be sent with the next session")
+        if ingest is not None and ingest.rejected:
+            print(f"{ingest.rejected} trial records were rejected by {ingest_url}, see {ingest.dead_letter_path}")
+        latency = collector.latency()
+        print(f"Response polling: {latency['polls']} polls, {latency['mean_gap'] * 1000:.3f} ms mean and "
+              f"{latency['max_gap'] * 1000:.3f} ms max between polls")
+        if profile:
+            collector.save_latency(os.path.join(os.path.dirname(test_path), 'response_latency.json'))
+        if timer is not None:
+            timer.save_summary(os.path.join(os.path.dirname(test_path), 'frame_timing_summary.json'))
+        if scheduler is not None:
+            scheduler.save_summary(os.path.join(os.path.dirname(test_path), 'frame_schedule_summary.json'))
+        pool_stats = pool.stats(trials=trials * (continuous_trials or num_images * 2))
+        print(f"Text stimulus pool: {pool_stats['builds']} screens built, {pool_stats['hits']} reuses, "
+              f"~{pool_stats['saved_per_trial'] * 1000:.3f} ms setup saved per test trial")
+        end_experiment(win, test_path, subject, trials, study_data, db=db, pool=pool, cache=analysis_cache)
 
 
 if __name__ == '__main__':
 
+    parser = argparse.ArgumentParser(description="Run the recognition memory experiment. Options default to the "
+                                                 "EXPERIMENT_* environment variables of the station.")
+    parser.add_argument('--db', default=os.environ.get('EXPERIMENT_DB'),
+                        help="results database the sessions are also stored in (EXPERIMENT_DB)")
+    parser.add_argument('--journal', action=argparse.BooleanOptionalAction, default=env_flag('EXPERIMENT_JOURNAL'),
+                        help="journal every trial and resume an interrupted session (EXPERIMENT_JOURNAL)")
+    parser.add_argument('--cache', default=os.environ.get('EXPERIMENT_CACHE'),
+                        help="directory of the cache of scored sessions (EXPERIMENT_CACHE)")
+    parser.add_argument('--ingest', default=os.environ.get('EXPERIMENT_INGEST_URL'),
+                        help="address of the ingest collector trials are sent to (EXPERIMENT_INGEST_URL)")
+    parser.add_argument('--continuous', type=int, default=int(os.environ.get('EXPERIMENT_CONTINUOUS') or 0) or None,
+                        help="length of a continuous-recognition session run instead of study and test phases "
+                             "(EXPERIMENT_CONTINUOUS)")
+    parser.add_argument('--lags', type=int, nargs='+', default=list(DEFAULT_LAGS),
+                        help="possible lags in trials of the continuous-recognition repeats")
+    parser.add_argument('--p-repeat', type=float, default=0.5,
+                        help="probability that a continuous-recognition image comes back as old")
+    parser.add_argument('--frame-locked', action=argparse.BooleanOptionalAction,
+                        default=env_flag('EXPERIMENT_FRAME_LOCKED', True),
+                        help="count presentation times and delays in frames (EXPERIMENT_FRAME_LOCKED, on by default)")
+    parser.add_argument('--frame-timing', action=argparse.BooleanOptionalAction,
+                        default=env_flag('EXPERIMENT_FRAME_TIMING'),
+                        help="record the frame timing of every trial (EXPERIMENT_FRAME_TIMING)")
+    parser.add_argument('--profile', action=argparse.BooleanOptionalAction, default=env_flag('EXPERIMENT_PROFILE'),
+                        help="save per-call timings of the session to session_profile.json and the response polling "
+                             "gaps to response_latency.json (EXPERIMENT_PROFILE)")
+    parser.add_argument('--manifest', action=argparse.BooleanOptionalAction, default=env_flag('EXPERIMENT_MANIFEST'),
+                        help="list the dataset from its manifest, written to the dataset folder on first use "
+                             "(EXPERIMENT_MANIFEST)")
+    parser.add_argument('--format', choices=('csv', 'npz'), default=os.environ.get('EXPERIMENT_FORMAT') or 'csv',
+                        help="file format the phase data is stored in (EXPERIMENT_FORMAT, csv by default)")
+    args = parser.parse_args()
+
     first_dir, sec_dir, rseed, num_tri, num_del, val_keys = get_info()
 
     try:
         win = visual.Window([800, 800], fullscr=False, monitor='testMonitor', screen=0, allowGUI=True,
                             units='height', color='white')
 
-        main(win, first_dir, sec_dir, rseed, num_tri, num_del, val_keys)
+        main(win, first_dir, sec_dir, rseed, num_tri, num_del, val_keys, frame_timing=args.frame_timing,
+             db_path=args.db, journal=args.journal, cache_dir=args.cache, ingest_url=args.ingest,
+             continuous_trials=args.continuous, lags=args.lags, p_repeat=args.p_repeat,
+             frame_locked=args.frame_locked, profile=args.profile, manifest=args.manifest,
+             fmt=args.format)
 
     except Exception as ex:
         win.close()